@@ -0,0 +1,248 @@
+"""
+Link history archive for X link moderation bot.
+Stores expired link_history rows in compressed, append-only segment files
+and streams them back for analytics.
+
+Usage: python archive.py [--dir archive] stats
+       python archive.py [--dir archive] export [--since 2024-01-01] [--until ...] [--chat ID] > links.csv
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'XGA1'
+SEGMENT_PREFIX = 'links-'
+SEGMENT_SUFFIX = '.xga'
+
+
+class ArchivedLink(NamedTuple):
+    """One archived link_history row."""
+
+    id: int
+    user_id: int
+    timestamp: int
+    link_url: str
+    chat_id: int
+    canonical_id: Optional[str]
+
+
+class SegmentInfo(NamedTuple):
+    """Header of a segment file: its row count and id and time ranges."""
+
+    path: str
+    rows: int
+    first_id: int
+    last_id: int
+    min_timestamp: int
+    max_timestamp: int
+
+
+def _pack_ints(values: Sequence[int], delta: bool = False) -> bytes:
+    """Encode integers as little-endian int64s, optionally as deltas, and compress."""
+    if delta:
+        values = [value - previous for previous, value in zip([0, *values], values)]
+    packed = array('q', values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return zlib.compress(packed.tobytes(), 6)
+
+
+def _unpack_ints(blob: bytes, delta: bool = False) -> List[int]:
+    packed = array('q')
+    packed.frombytes(zlib.decompress(blob))
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    values = packed.tolist()
+    if delta:
+        total = 0
+        for index, value in enumerate(values):
+            total += value
+            values[index] = total
+    return values
+
+
+def _pack_strings(values: Sequence[Optional[str]]) -> bytes:
+    """Encode strings NUL-separated (None as empty) and compress."""
+    return zlib.compress('\0'.join(value or '' for value in values).encode('utf-8'), 6)
+
+
+def _unpack_strings(blob: bytes, rows: int) -> List[str]:
+    if rows == 0:
+        return []
+    return zlib.decompress(blob).decode('utf-8').split('\0')
+
+
+# Column name -> (encoder, decoder); ids and timestamps are nearly sorted, so deltas compress well
+COLUMNS = {
+    'id': (lambda rows: _pack_ints([row[0] for row in rows], delta=True),
+           lambda blob, count: _unpack_ints(blob, delta=True)),
+    'user_id': (lambda rows: _pack_ints([row[1] for row in rows]),
+                lambda blob, count: _unpack_ints(blob)),
+    'timestamp': (lambda rows: _pack_ints([row[2] for row in rows], delta=True),
+                  lambda blob, count: _unpack_ints(blob, delta=True)),
+    'link_url': (lambda rows: _pack_strings([row[3] for row in rows]),
+                 _unpack_strings),
+    'chat_id': (lambda rows: _pack_ints([row[4] for row in rows]),
+                lambda blob, count: _unpack_ints(blob)),
+    'canonical_id': (lambda rows: _pack_strings([row[5] for row in rows]),
+                     _unpack_strings),
+}
+
+
+class LinkArchive:
+    """Directory of immutable, column-compressed segment files.
+
+    Each segment holds a contiguous id range of link_history rows, as
+    (id, user_id, timestamp, link_url, chat_id, canonical_id) tuples in
+    id order. A segment file is a magic number, a length-prefixed JSON
+    header with the row count, id and time ranges and column sizes, and
+    one zlib-compressed block per column.
+
+    Segments are named after their first id and written to a temporary
+    file first, so a crash leaves either no segment or a complete one,
+    and re-archiving the same rows replaces it instead of duplicating.
+    """
+
+    def __init__(self, directory: str):
+        """Use (and create if needed) the given directory."""
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def write_segment(self, rows: Sequence[Sequence[Any]]) -> str:
+        """Write rows (in id order) as a new segment; returns its path."""
+        blobs = {name: encode(rows) for name, (encode, _) in COLUMNS.items()}
+        header = {
+            'rows': len(rows),
+            'first_id': rows[0][0],
+            'last_id': rows[-1][0],
+            'min_timestamp': min(row[2] for row in rows),
+            'max_timestamp': max(row[2] for row in rows),
+            'columns': [[name, len(blob)] for name, blob in blobs.items()],
+        }
+        encoded_header = json.dumps(header).encode('utf-8')
+
+        path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{rows[0][0]:012d}{SEGMENT_SUFFIX}")
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(encoded_header)))
+            f.write(encoded_header)
+            for blob in blobs.values():
+                f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+        return path
+
+    def _read_header(self, f) -> Dict[str, Any]:
+        if f.read(4) != MAGIC:
+            raise ValueError(f"{f.name} is not an archive segment")
+        (length,) = struct.unpack('<I', f.read(4))
+        return json.loads(f.read(length))
+
+    def segments(self) -> List[SegmentInfo]:
+        """List segments in id order, reading only their headers."""
+        infos = []
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)):
+                continue
+            path = os.path.join(self.directory, name)
+            with open(path, 'rb') as f:
+                header = self._read_header(f)
+            infos.append(SegmentInfo(path, header['rows'], header['first_id'], header['last_id'],
+                                     header['min_timestamp'], header['max_timestamp']))
+        return infos
+
+    def read(self, since: Optional[int] = None, until: Optional[int] = None,
+             chat_id: Optional[int] = None) -> Iterator[ArchivedLink]:
+        """Stream archived rows in id order, one segment in memory at a time.
+
+        since/until bound the timestamp (inclusive/exclusive); segments
+        entirely outside the range are skipped without being decompressed.
+        """
+        last_id = 0
+        for info in self.segments():
+            if since is not None and info.max_timestamp < since:
+                continue
+            if until is not None and info.min_timestamp >= until:
+                continue
+            for row in self._read_segment(info.path):
+                # A segment re-written with a wider range after a crash may overlap the next one
+                if row.id <= last_id:
+                    continue
+                last_id = row.id
+                if since is not None and row.timestamp < since:
+                    continue
+                if until is not None and row.timestamp >= until:
+                    continue
+                if chat_id is not None and row.chat_id != chat_id:
+                    continue
+                yield row
+
+    def _read_segment(self, path: str) -> Iterator[ArchivedLink]:
+        """Decode every column of a segment and yield its rows."""
+        with open(path, 'rb') as f:
+            header = self._read_header(f)
+            rows = header['rows']
+            columns = {name: COLUMNS[name][1](f.read(size), rows) for name, size in header['columns']}
+        canonical_ids = columns['canonical_id']
+        for index in range(rows):
+            yield ArchivedLink(
+                columns['id'][index],
+                columns['user_id'][index],
+                columns['timestamp'][index],
+                columns['link_url'][index],
+                columns['chat_id'][index],
+                canonical_ids[index] or None,
+            )
+
+
+def _parse_date(value: str) -> int:
+    """Parse YYYY-MM-DD (UTC) into epoch seconds."""
+    return int(datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp())
+
+
+def main():
+    """Command line access to an archive directory."""
+    parser = argparse.ArgumentParser(description="Inspect or export archived X link history")
+    parser.add_argument('--dir', default=os.environ.get('ARCHIVE_DIR', 'archive'), help='archive directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help='summarize the segments')
+    export = commands.add_parser('export', help='stream rows as CSV to stdout')
+    export.add_argument('--since', type=_parse_date, help='first day to include (YYYY-MM-DD, UTC)')
+    export.add_argument('--until', type=_parse_date, help='day to stop before (YYYY-MM-DD, UTC)')
+    export.add_argument('--chat', type=int, help='only this chat id')
+    args = parser.parse_args()
+
+    archive = LinkArchive(args.dir)
+    if args.command == 'stats':
+        segments = archive.segments()
+        rows = sum(info.rows for info in segments)
+        size = sum(os.path.getsize(info.path) for info in segments)
+        print(f"{len(segments)} segment(s), {rows} row(s), {size / 1024:.1f} KiB"
+              + (f" ({size / rows:.1f} bytes/row)" if rows else ""))
+        if segments:
+            first = datetime.fromtimestamp(min(info.min_timestamp for info in segments), timezone.utc)
+            last = datetime.fromtimestamp(max(info.max_timestamp for info in segments), timezone.utc)
+            print(f"ids {segments[0].first_id}-{segments[-1].last_id}, {first:%Y-%m-%d} to {last:%Y-%m-%d}")
+    else:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(ArchivedLink._fields)
+        for row in archive.read(args.since, args.until, args.chat):
+            writer.writerow(row)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+"""
+Async facade over the SQLite database for X link moderation bot.
+Batches writes from many handlers into group commits on a dedicated thread.
+"""
+
+import asyncio
+import functools
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from database import Database
+
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class _WriteRequest:
+    """A single queued write: applied inside a batch transaction, resolved after commit."""
+
+    __slots__ = ('apply', 'on_commit', 'future', 'loop')
+
+    def __init__(self, apply: Callable[[sqlite3.Cursor], Any],
+                 on_commit: Optional[Callable[[Any], None]],
+                 future: asyncio.Future, loop: asyncio.AbstractEventLoop):
+        self.apply = apply
+        self.on_commit = on_commit
+        self.future = future
+        self.loop = loop
+
+
+def _resolve(future: asyncio.Future, result: Any = None, error: Optional[BaseException] = None):
+    """Complete a future from the event loop thread, unless it was cancelled."""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class AsyncDatabase:
+    """Non-blocking wrapper around Database.
+
+    Writes go through a queue to a single writer thread that groups them into
+    one transaction per batch (flushed every flush_interval seconds or
+    max_batch requests). With flush_interval 0 the writer never waits: it
+    commits whatever queued up while the previous commit was running, which
+    keeps sequential processing latency low. Reads run on a separate reader
+    thread with its own connection, so they never wait behind a commit.
+    """
+
+    def __init__(self, database: Database, flush_interval: float = 0.0, max_batch: int = 100):
+        """Wrap a Database; call start() before use."""
+        self.db = database
+        self.link_cache = database.link_cache
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue: 'queue.Queue[Any]' = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-reader')
+        # Links inserted by the batch currently being applied, not yet in the cache
+        self._uncommitted: Dict[Tuple[int, int], int] = {}
+
+    def start(self):
+        """Start the writer thread."""
+        if self._writer is not None:
+            return
+        self._writer = threading.Thread(target=self._writer_loop, name='db-writer', daemon=True)
+        self._writer.start()
+
+    async def close(self):
+        """Flush pending writes and stop the writer and reader threads."""
+        if self._writer is not None:
+            self._queue.put(_STOP)
+            await asyncio.get_running_loop().run_in_executor(None, self._writer.join)
+            self._writer = None
+        self._reader.shutdown(wait=True)
+
+    @property
+    def pending_writes(self) -> int:
+        """Number of writes waiting for the writer thread."""
+        return self._queue.qsize()
+
+    # Writer side
+
+    def _writer_loop(self):
+        """Collect queued writes into batches and commit each batch once."""
+        conn = self.db._get_connection()
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0:
+                        item = self._queue.get(timeout=timeout)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._commit_batch(conn, batch)
+
+        self.db.close()
+
+    def _commit_batch(self, conn: sqlite3.Connection, batch: List[_WriteRequest]):
+        """Apply a batch in one transaction, isolating each request in a savepoint."""
+        cursor = conn.cursor()
+        results = []
+        self._uncommitted.clear()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for request in batch:
+                cursor.execute("SAVEPOINT write_request")
+                try:
+                    result = request.apply(cursor)
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO write_request")
+                    cursor.execute("RELEASE write_request")
+                    results.append((None, e))
+                else:
+                    cursor.execute("RELEASE write_request")
+                    results.append((result, None))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Database batch of {len(batch)} write(s) failed: {e}")
+            if conn.in_transaction:
+                conn.rollback()
+            results = [(None, e)] * len(batch)
+
+        for request, (result, error) in zip(batch, results):
+            if error is None and request.on_commit is not None:
+                try:
+                    request.on_commit(result)
+                except Exception as e:
+                    logger.error(f"Post-commit hook failed: {e}")
+            request.loop.call_soon_threadsafe(_resolve, request.future, result, error)
+
+    async def _write(self, apply: Callable[[sqlite3.Cursor], Any],
+                     on_commit: Optional[Callable[[Any], None]] = None) -> Any:
+        """Queue a write for the next group commit and wait until it is durable."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put(_WriteRequest(apply, on_commit, future, loop))
+        return await future
+
+    async def _read(self, method: Callable[..., Any], *args: Any) -> Any:
+        """Run a read on the dedicated reader thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader, functools.partial(method, *args))
+
+    # Public API, mirroring Database
+
+    async def add_links(self, user_id: int, link_urls: List[str], chat_id: int):
+        """Record several X links posted by a user in a single message."""
+        def record(timestamp: int):
+            for _ in link_urls:
+                self.link_cache.record(chat_id, user_id, timestamp)
+
+        await self._write(
+            lambda cursor: self.db._insert_links(cursor, user_id, link_urls, chat_id),
+            record
+        )
+
+    async def add_link(self, user_id: int, link_url: str, chat_id: int):
+        """Record a new X link posted by a user."""
+        await self.add_links(user_id, [link_url], chat_id)
+
+    def _warm_link_window(self, cursor: sqlite3.Cursor, user_id: int, chat_id: int) -> int:
+        """Count a user's window on the writer's transaction, caching it if it is fully committed."""
+        if self._uncommitted.get((chat_id, user_id)):
+            # This batch already wrote for the key; the cache is filled after commit
+            return self.db._count_links(cursor, user_id, chat_id)
+
+        timestamps = self.db._fetch_link_timestamps(cursor, user_id, chat_id)
+        self.link_cache.load(chat_id, user_id, timestamps)
+        return len(timestamps)
+
+    async def reserve_links(self, user_id: int, link_urls: List[str], chat_id: int,
+                            max_links: int) -> Tuple[bool, int]:
+        """Atomically check the weekly quota and record links if they fit.
+
+        Returns (allowed, count_before). Runs on the writer thread, so the
+        check and insert cannot interleave with any other write; the count
+        comes from the cache plus this batch's uncommitted inserts, or from
+        the open transaction on a cache miss.
+        """
+        key = (chat_id, user_id)
+
+        def reserve(cursor: sqlite3.Cursor) -> Tuple[bool, int, int]:
+            cached = self.link_cache.count(chat_id, user_id)
+            if cached is None:
+                current = self._warm_link_window(cursor, user_id, chat_id)
+            else:
+                current = cached + self._uncommitted.get(key, 0)
+            if current + len(link_urls) > max_links:
+                return False, current, 0
+            timestamp = self.db._insert_links(cursor, user_id, link_urls, chat_id)
+            self._uncommitted[key] = self._uncommitted.get(key, 0) + len(link_urls)
+            return True, current, timestamp
+
+        def record(result: Tuple[bool, int, int]):
+            allowed, _, timestamp = result
+            if allowed:
+                for _ in link_urls:
+                    self.link_cache.record(chat_id, user_id, timestamp)
+
+        allowed, current, _ = await self._write(reserve, record)
+        return allowed, current
+
+    async def count_user_links_last_week(self, user_id: int, chat_id: int) -> int:
+        """Count links posted by user in the last 7 days, without a thread hop on cache hits."""
+        cached = self.link_cache.count(chat_id, user_id)
+        if cached is not None:
+            return cached
+        return await self._read(self.db._load_link_window, user_id, chat_id)
+
+    async def find_recent_posts(self, chat_id: int, canonical_ids: Iterable[str],
+                                since: int) -> Dict[str, Tuple[int, int]]:
+        """Get the latest (timestamp, user_id) after since for each post already shared in a chat."""
+        return await self._read(self.db.find_recent_posts, chat_id, list(canonical_ids), since)
+
+    async def get_recent_posts(self, since: int) -> List[Tuple[int, str, int, int]]:
+        """Get (chat_id, canonical_id, timestamp, user_id) for every post shared after since."""
+        return await self._read(self.db.get_recent_posts, since)
+
+    async def reserve_rate(self, user_id: int, link_urls: List[str], chat_id: int,
+                           max_links: int, enforce: bool = True) -> Tuple[bool, int]:
+        """Check the quota against a user's GCRA state and record links if they fit.
+
+        Returns (allowed, links in use before). One UPSERT on the writer
+        thread, whatever the user's history.
+        """
+        return await self._write(
+            lambda cursor: self.db._reserve_rate(cursor, user_id, link_urls, chat_id, max_links, enforce)
+        )
+
+    async def get_rate_usage(self, user_id: int, chat_id: int) -> int:
+        """Get the links counting against a user's quota under the gcra limiter."""
+        return await self._read(self.db.get_rate_usage, user_id, chat_id)
+
+    async def prune_rate_state(self) -> int:
+        """Delete GCRA rows that have fully drained."""
+        return await self._write(self.db._prune_rate_state)
+
+    async def get_user_links_last_week(self, user_id: int, chat_id: int) -> List[sqlite3.Row]:
+        """Get all links posted by user in the last 7 days for a specific chat."""
+        return await self._read(self.db.get_user_links_last_week, user_id, chat_id)
+
+    async def cleanup_old_links(self, days: int = 30) -> int:
+        """Remove link history older than specified days."""
+        return await self._write(
+            lambda cursor: self.db._delete_old_links(cursor, days),
+            lambda deleted: self.db._forget_deleted_links(deleted, days)
+        )
+
+    async def prune_old_links(self, days: int, batch_size: int) -> int:
+        """Delete one bounded chunk of expired link history; returns rows deleted."""
+        return await self._write(
+            lambda cursor: self.db._prune_links_batch(cursor, days, batch_size),
+            lambda deleted: self.db._forget_deleted_links(deleted, days)
+        )
+
+    async def get_archivable_links(self, days: int, batch_size: int) -> List[Tuple[int, int, int, str, int, Optional[str]]]:
+        """Get the next run of expired rows not yet archived, in id order."""
+        return await self._read(self.db.get_archivable_links, days, batch_size)
+
+    async def forget_archived_links(self, first_id: int, last_id: int, days: int) -> int:
+        """Delete link history that has been written to the archive; returns rows deleted."""
+        return await self._write(
+            lambda cursor: self.db._forget_archived_links(cursor, first_id, last_id),
+            lambda deleted: self.db._forget_deleted_links(deleted, days)
+        )
+
+    async def prune_rollups(self, days: int) -> int:
+        """Delete rollups for days that have fallen out of retention."""
+        return await self._write(lambda cursor: self.db._prune_rollups(cursor, days))
+
+    async def record_rollup(self, chat_id: int, user_id: int, links: int):
+        """Count links kept outside link_history (e.g. by the Redis backend) in today's rollup."""
+        await self._write(
+            lambda cursor: self.db._record_rollup(cursor, chat_id, user_id, int(time.time()), links)
+        )
+
+    async def get_top_posters(self, chat_id: int, days: int, limit: int = 10) -> List[Tuple[int, int]]:
+        """Get (user_id, links) for the chat's most active posters over the last days."""
+        return await self._read(self.db.get_top_posters, chat_id, days, limit)
+
+    async def get_daily_links(self, chat_id: int, user_id: int, days: int) -> List[Tuple[int, int]]:
+        """Get (day, links) for a user's active days in the chat over the last days, newest first."""
+        return await self._read(self.db.get_daily_links, chat_id, user_id, days)
+
+    async def run_maintenance(self, vacuum_pages: int = 1000):
+        """Reclaim free pages and refresh query planner statistics on the writer thread."""
+        await self._write(lambda cursor: self.db._run_maintenance(cursor, vacuum_pages))
+
+    async def add_pending_deletion(self, chat_id: int, message_id: int, due_at: float):
+        """Persist a scheduled message deletion."""
+        await self._write(
+            lambda cursor: self.db._add_pending_deletion(cursor, chat_id, message_id, due_at)
+        )
+
+    async def remove_pending_deletions(self, messages: Iterable[Tuple[int, int]]):
+        """Forget scheduled deletions that have been carried out."""
+        messages = list(messages)
+        await self._write(lambda cursor: self.db._remove_pending_deletions(cursor, messages))
+
+    async def set_chat_rule(self, chat_id: int, name: str, value: str, updated_by: Optional[int] = None):
+        """Store a per-chat rule override."""
+        await self._write(
+            lambda cursor: self.db._set_chat_rule(cursor, chat_id, name, value, updated_by)
+        )
+
+    async def reset_chat_rules(self, chat_id: int, name: Optional[str] = None) -> int:
+        """Remove one (or, without a name, all) of a chat's rule overrides."""
+        return await self._write(lambda cursor: self.db._delete_chat_rules(cursor, chat_id, name))
+
+    async def get_chat_rules(self) -> Dict[int, Dict[str, str]]:
+        """Get every chat's rule overrides as {chat_id: {name: value}}."""
+        return await self._read(self.db.get_chat_rules)
+
+    async def get_pending_deletions(self) -> List[Tuple[float, int, int]]:
+        """Get all scheduled deletions as (due_at, chat_id, message_id) tuples."""
+        return await self._read(self.db.get_pending_deletions)
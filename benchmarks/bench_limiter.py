@@ -0,0 +1,103 @@
+"""
+Limiter benchmark: sliding-window row counting vs GCRA state rows.
+Seeds users with a heavy week of link_history, then times quota checks
+(reserve_links through AsyncDatabase) for each limiter mode.
+
+Usage: python benchmarks/bench_limiter.py [--users 200] [--history-per-user 2000] [--checks 5000]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from async_database import AsyncDatabase  # noqa: E402
+from database import LINK_WINDOW_SECONDS, Database  # noqa: E402
+from state import GCRABackend, SQLiteBackend  # noqa: E402
+
+
+CHAT_ID = -1001
+
+
+def seed(path: str, users: int, per_user: int, max_links: int):
+    """Fill link_history with per_user links in the past week for each user,
+    and give each user the equivalent GCRA state."""
+    Database(path).close()
+    conn = sqlite3.connect(path)
+    now = int(time.time())
+    conn.execute("""
+        WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i < ? - 1)
+        INSERT INTO link_history (user_id, timestamp, link_url, chat_id, canonical_id)
+        SELECT i % ?, ? - (i * 7919) % ?, 'https://x.com/u/status/' || i, ?, 'status:' || i
+        FROM seq
+    """, (users * per_user, users, now, LINK_WINDOW_SECONDS - 60, CHAT_ID))
+    interval = LINK_WINDOW_SECONDS / max_links
+    conn.executemany("""
+        INSERT INTO rate_limit_state (chat_id, user_id, tat, emission_interval) VALUES (?, ?, ?, ?)
+    """, [(CHAT_ID, user_id, now + per_user * interval, interval) for user_id in range(users)])
+    conn.commit()
+    conn.close()
+
+
+async def time_checks(backend, checks: int, users: int, max_links: int, concurrency: int, rng: random.Random):
+    """Run checks reservations, concurrency at a time; returns (seconds, allowed, latencies)."""
+    order = [rng.randrange(users) for _ in range(checks)]
+    latencies = []
+    allowed = 0
+
+    async def check(user_id: int):
+        nonlocal allowed
+        started = time.perf_counter()
+        ok, _ = await backend.reserve_links(user_id, ['https://x.com/b/status/1'], CHAT_ID, max_links)
+        latencies.append(time.perf_counter() - started)
+        allowed += ok
+
+    started = time.perf_counter()
+    for index in range(0, checks, concurrency):
+        await asyncio.gather(*(check(user_id) for user_id in order[index:index + concurrency]))
+    return time.perf_counter() - started, allowed, sorted(latencies)
+
+
+async def run(args):
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix='xgate-limiter-'), 'bench.db')
+    started = time.perf_counter()
+    seed(path, args.users, args.history_per_user, args.max_links)
+    print(f"seeded {args.users * args.history_per_user:,} rows for {args.users} users "
+          f"in {time.perf_counter() - started:.1f}s ({path})")
+
+    for mode in ('window', 'gcra'):
+        db = Database(path)
+        async_db = AsyncDatabase(db)
+        async_db.start()
+        backend = GCRABackend(async_db, args.max_links) if mode == 'gcra' else SQLiteBackend(async_db)
+        seconds, allowed, latencies = await time_checks(
+            backend, args.checks, args.users, args.max_links, args.concurrency, random.Random(args.seed)
+        )
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000
+        cache = db.link_cache.stats()
+        print(f"{mode:>6}: {args.checks / seconds:,.0f} checks/s, p50 {p50:.2f} ms, p99 {p99:.2f} ms, "
+              f"{allowed} allowed, link cache hits {cache['hits']} misses {cache['misses']}")
+        await async_db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--history-per-user', type=int, default=2000, help='links each user posted this week')
+    parser.add_argument('--max-links', type=int, default=10_000, help='weekly quota, high enough to allow most checks')
+    parser.add_argument('--checks', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=1, help='reservations in flight at once')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db', help='database path (temporary file if omitted)')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
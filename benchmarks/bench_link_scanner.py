@@ -0,0 +1,81 @@
+"""
+Micro-benchmark for the X link scanner.
+Compares LinkScanner with the previous regex-based extraction on normal and
+adversarial inputs, and checks both agree on the links they find.
+mixed_case takes the scanner's general path; there the old code did less
+work, since it left URLs with uppercase schemes in the context.
+
+Usage: python benchmarks/bench_link_scanner.py [--repeat N]
+"""
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from link_scanner import URL_PATTERN, LinkScanner  # noqa: E402
+
+
+# The extraction used before LinkScanner, kept here as the baseline
+LEGACY_PATTERNS = [
+    r'https?://(?:www\.)?x\.com/\S+(?<![.,?!:;])',
+    r'https?://(?:www\.)?twitter\.com/\S+(?<![.,?!:;])',
+    r'https?://(?:www\.)?vxtwitter\.com/\S+(?<![.,?!:;])',
+    r'https?://(?:www\.)?fxtwitter\.com/\S+(?<![.,?!:;])',
+    r'https?://(?:www\.)?fixupx\.com/\S+(?<![.,?!:;])',
+]
+LEGACY_REGEX = re.compile('|'.join(LEGACY_PATTERNS), re.IGNORECASE)
+
+
+def legacy_scan(text):
+    """Previous implementation: findall, then strip URLs and re-split."""
+    links = LEGACY_REGEX.findall(text)
+    if not links:
+        return links, 0
+    context = ' '.join(re.sub(r'https?://\S+', '', text).split())
+    return links, len(context)
+
+
+CORPUS = {
+    'chatter': "Has anyone tried the new release? The changelog looks pretty good to me " * 2,
+    'compliant': "Interesting thread about SQLite internals, worth a read: https://x.com/someone/status/1234567890",
+    'many_links': ' '.join(f"https://twitter.com/u{i}/status/{i}?s=20," for i in range(20)) + " some context here",
+    'other_urls': "Docs at https://example.com/docs and https://github.com/org/repo, no X links",
+    'nested': "redirect https://t.example/?u=https://fxtwitter.com/a/status/1.",
+    'mixed_case': "Posted at HTTPS://X.com/Someone/status/42 (mirror: ftp://files.example/a) worth a look",
+    'long_prose': ("Long write-up on the incident, with the timeline and what we changed afterwards. " * 12
+                   + "Source: https://x.com/ops/status/99 and notes at https://example.com/postmortem"),
+    'long_token': 'a' * 100_000,
+    'long_url': 'https://x.com/' + 'a' * 100_000,
+    'long_punctuation': 'https://x.com/' + '.' * 50_000,
+    'scheme_storm': 'http://' * 20_000,
+    'almost_x': ' '.join('https://x.co/' + str(i) for i in range(2_000)),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=2000, help='iterations per input')
+    args = parser.parse_args()
+
+    scanner = LinkScanner()
+    print(f"{'input':<18}{'chars':>9}{'legacy µs':>12}{'scanner µs':>12}{'speedup':>9}")
+    for name, text in CORPUS.items():
+        result = scanner.scan(text)
+        legacy_links, _ = legacy_scan(text)
+        # The old code only stripped lowercase schemes from the context
+        expected_context = len(' '.join(URL_PATTERN.sub('', text).split())) if legacy_links else 0
+        assert result.links == legacy_links, f"{name}: link mismatch"
+        assert result.context_length == expected_context, f"{name}: context mismatch"
+
+        repeat = max(1, args.repeat // 500) if len(text) > 10_000 else args.repeat
+        legacy = min(timeit.repeat(lambda: legacy_scan(text), number=repeat, repeat=5)) / repeat * 1e6
+        new = min(timeit.repeat(lambda: scanner.scan(text), number=repeat, repeat=5)) / repeat * 1e6
+        print(f"{name:<18}{len(text):>9}{legacy:>12.1f}{new:>12.1f}{legacy / new:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
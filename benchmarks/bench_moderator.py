@@ -0,0 +1,328 @@
+"""
+Load-test and replay harness for XLinkModerator.handle_message.
+Feeds synthetic updates through the real moderation path with an in-process
+fake Bot and reports throughput, latency percentiles, Telegram API calls and
+SQLite statements per message.
+
+Usage:
+    python benchmarks/bench_moderator.py --messages 5000 --chats 50 --users 500 \
+        --history-rows 200000 --mix chatter=60,compliant=25,no_context=10,rate_limit=5
+
+Add raid=N to the mix to simulate a spam wave of bare links into one chat,
+and repost=N (with --repost flag or block) for posts already shared in the
+chat under a different host or query string.
+With --backend redis, link quotas go through RedisBackend, backed by an
+in-process fake unless --redis-url points at a real server.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timezone
+from itertools import count
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:BENCHMARK')
+
+from telegram import Chat, Message, MessageEntity, Update, User  # noqa: E402
+from telegram.error import RetryAfter  # noqa: E402
+
+from async_database import AsyncDatabase  # noqa: E402
+from bot import XLinkModerator  # noqa: E402
+from config import Config  # noqa: E402
+from database import Database  # noqa: E402
+from metrics import DATABASE_METHODS, Metrics  # noqa: E402
+from state import RedisBackend  # noqa: E402
+from fake_redis import FakeRedis  # noqa: E402
+
+
+BOT_ID = 424242
+URL_RE = re.compile(r'https?://\S+')
+RAID_CHAT = -999
+CONTEXT = "Worth reading, the thread explains the migration plan in detail:"
+
+
+class FakeBot:
+    """In-process stand-in for telegram.Bot that counts API calls.
+
+    With chat_send_limit it also enforces Telegram's per-group flood limit,
+    answering sends beyond that many per minute with RetryAfter (counted
+    as "429").
+    """
+
+    def __init__(self, latency: float = 0.0, chat_send_limit: int = 0):
+        self.latency = latency
+        self.chat_send_limit = chat_send_limit
+        self._sends = defaultdict(deque)
+        self.calls = Counter()
+        self._message_ids = count(10_000_000)
+        self._me = User(BOT_ID, 'X-Gate', is_bot=True, username='xgate_bench_bot')
+
+    async def _call(self, method: str):
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def get_me(self, **kwargs):
+        await self._call('getMe')
+        return self._me
+
+    async def get_chat_member(self, chat_id, user_id, **kwargs):
+        await self._call('getChatMember')
+        return SimpleNamespace(status='administrator', can_delete_messages=True, user=self._me)
+
+    async def get_chat_administrators(self, chat_id, **kwargs):
+        await self._call('getChatAdministrators')
+        return (SimpleNamespace(user=self._me),)
+
+    def _check_flood(self, chat_id):
+        if not self.chat_send_limit:
+            return
+        now = time.monotonic()
+        sent = self._sends[chat_id]
+        while sent and now - sent[0] >= 60:
+            sent.popleft()
+        if len(sent) >= self.chat_send_limit:
+            self.calls['429'] += 1
+            raise RetryAfter(max(1, int(60 - (now - sent[0])) + 1))
+        sent.append(now)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self._check_flood(chat_id)
+        await self._call('sendMessage')
+        message = Message(next(self._message_ids), datetime.now(timezone.utc),
+                          Chat(chat_id, Chat.SUPERGROUP), from_user=self._me, text=text)
+        message.set_bot(self)
+        return message
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        await self._call('editMessageText')
+        return True
+
+    async def delete_message(self, chat_id, message_id, **kwargs):
+        await self._call('deleteMessage')
+        return True
+
+    async def delete_messages(self, chat_id, message_ids, **kwargs):
+        await self._call('deleteMessages')
+        return True
+
+
+class CountingDatabase(Database):
+    """Database that counts the SQL statements executed on every connection."""
+
+    def __init__(self, *args, **kwargs):
+        self.statements = Counter()
+        super().__init__(*args, **kwargs)
+
+    def _get_connection(self) -> sqlite3.Connection:
+        fresh = not hasattr(self.local, 'connection')
+        conn = super()._get_connection()
+        if fresh:
+            conn.set_trace_callback(self._trace)
+        return conn
+
+    def _trace(self, statement: str):
+        self.statements[statement.lstrip().split(None, 1)[0].upper()] += 1
+
+    @property
+    def queries(self) -> int:
+        return sum(self.statements[kind] for kind in ('SELECT', 'INSERT', 'UPDATE', 'DELETE'))
+
+
+def seed_history(db_path: str, rows: int, chats: int, users: int, rng: random.Random):
+    """Fill link_history with rows spread over the last week."""
+    if rows <= 0:
+        return
+    now = int(time.time())
+    conn = sqlite3.connect(db_path)
+    batch = []
+    for i in range(rows):
+        timestamp = now - rng.randrange(7 * 24 * 3600)
+        batch.append((rng.randrange(users), timestamp, f"https://x.com/u/status/{i}", -1000 - rng.randrange(chats)))
+        if len(batch) == 10_000:
+            conn.executemany("INSERT INTO link_history (user_id, timestamp, link_url, chat_id) VALUES (?, ?, ?, ?)", batch)
+            batch.clear()
+    conn.executemany("INSERT INTO link_history (user_id, timestamp, link_url, chat_id) VALUES (?, ?, ?, ?)", batch)
+    conn.commit()
+    conn.close()
+
+
+def make_update(bot: FakeBot, update_id: int, chat_id: int, user_id: int, text: str) -> Update:
+    """Build a group message update the way Telegram would, with url entities."""
+    chat = Chat(chat_id, Chat.SUPERGROUP, title='bench')
+    user = User(user_id, f'user{user_id}', is_bot=False)
+    entities = [MessageEntity(MessageEntity.URL, m.start(), m.end() - m.start()) for m in URL_RE.finditer(text)]
+    message = Message(update_id, datetime.now(timezone.utc), chat, from_user=user, text=text, entities=entities)
+    for obj in (chat, user, message):
+        obj.set_bot(bot)
+    return Update(update_id, message=message)
+
+
+def build_workload(args, bot: FakeBot, max_links: int, rng: random.Random):
+    """Generate (kind, update) pairs according to the configured mix."""
+    kinds, weights = zip(*args.mix.items())
+    fresh_users = count(10_000_000)
+    # Users that start the run already at their weekly quota
+    capped = [(-1000 - rng.randrange(args.chats), 5_000_000 + i) for i in range(max(1, args.users // 10))]
+
+    workload = []
+    for update_id in range(1, args.messages + 1):
+        kind = rng.choices(kinds, weights)[0]
+        chat_id = -1000 - rng.randrange(args.chats)
+        user_id = rng.randrange(args.users)
+        link = f"https://x.com/someone/status/{rng.randrange(10**12)}"
+        if kind == 'chatter':
+            text = "Has anyone tried the new release? The changelog looks good to me."
+        elif kind == 'compliant':
+            user_id = next(fresh_users)
+            text = f"{CONTEXT} {link}"
+        elif kind == 'no_context':
+            text = f"lol {link}"
+        elif kind == 'rate_limit':
+            chat_id, user_id = rng.choice(capped)
+            text = f"{CONTEXT} {link}"
+        elif kind == 'repost':
+            # A handful of popular posts, shared again in another form
+            user_id = next(fresh_users)
+            host = rng.choice(('x.com', 'twitter.com', 'fxtwitter.com'))
+            text = f"{CONTEXT} https://{host}/someone/status/{rng.randrange(20)}?s=20"
+        elif kind == 'raid':
+            # Spam wave: many fresh accounts posting bare links into one chat
+            chat_id, user_id = RAID_CHAT, next(fresh_users)
+            text = f"{link}"
+        else:
+            raise SystemExit(f"Unknown message kind: {kind}")
+        workload.append((kind, make_update(bot, update_id, chat_id, user_id, text)))
+    return workload, capped
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run(args):
+    logging.getLogger().setLevel(args.log_level)
+    rng = random.Random(args.seed)
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='xgate-bench-'), 'bench.db')
+
+    config = Config(config_path=args.config)
+    config.config['rules']['repost'] = args.repost
+    db = CountingDatabase(db_path)
+    seed_history(db_path, args.history_rows, args.chats, args.users, rng)
+
+    bot = FakeBot(latency=args.api_latency, chat_send_limit=args.chat_send_limit)
+    async_db = AsyncDatabase(db, flush_interval=args.flush_interval)
+    metrics = None
+    if args.metrics:
+        # Ephemeral port so runs never collide with a live bot
+        os.environ['METRICS_PORT'] = '0'
+        metrics = Metrics()
+        metrics.instrument_methods(db, DATABASE_METHODS)
+        metrics.instrument_methods(async_db, ['_commit_batch'])
+    async_db.start()
+    state = None
+    if args.backend == 'redis':
+        if args.redis_url:
+            state = RedisBackend(url=args.redis_url, prefix=f"xgate-bench-{os.getpid()}")
+        else:
+            state = RedisBackend(FakeRedis(latency=args.redis_latency))
+    moderator = XLinkModerator(config, async_db, metrics, state)
+    handle_message = metrics.instrument_handler(moderator.handle_message) if metrics else moderator.handle_message
+    application = SimpleNamespace(bot=bot)
+    context = SimpleNamespace(bot=bot)
+    await moderator.post_init(application)
+
+    workload, capped = build_workload(args, bot, config.max_links_per_week, rng)
+    for chat_id, user_id in capped:
+        await moderator.state.add_links(user_id, ['https://x.com/seed/status/0'] * config.max_links_per_week, chat_id)
+
+    bot.calls.clear()
+    db.statements.clear()
+    latencies = {kind: [] for kind in args.mix}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def handle(kind, update):
+        async with semaphore:
+            started = time.perf_counter()
+            await handle_message(update, context)
+            latencies[kind].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handle(kind, update) for kind, update in workload))
+    elapsed = time.perf_counter() - started
+    queries = db.queries
+    api_calls = dict(bot.calls)
+
+    await moderator.post_shutdown(application)
+
+    total = len(workload)
+    all_latencies = [value for values in latencies.values() for value in values]
+    print(f"messages={total} chats={args.chats} users={args.users} history_rows={args.history_rows} "
+          f"concurrency={args.concurrency} api_latency={args.api_latency * 1000:.1f}ms")
+    print(f"throughput: {total / elapsed:,.0f} msg/s ({elapsed:.2f}s)")
+    print(f"latency:    p50={percentile(all_latencies, 0.5) * 1e3:.3f}ms "
+          f"p99={percentile(all_latencies, 0.99) * 1e3:.3f}ms")
+    print(f"{'kind':<12}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for kind, values in latencies.items():
+        print(f"{kind:<12}{len(values):>8}{percentile(values, 0.5) * 1e3:>10.3f}{percentile(values, 0.99) * 1e3:>10.3f}")
+    print(f"Telegram API calls/msg: {sum(api_calls.values()) / total:.3f} {api_calls}")
+    print(f"SQLite queries/msg:     {queries / total:.3f} ({dict(db.statements)})")
+    if args.backend == 'redis':
+        print(f"state: redis ({'fake' if not args.redis_url else args.redis_url}, "
+              f"history rows not seeded into it)")
+    print(f"link cache: {async_db.link_cache.stats()}")
+    print(f"repost index: {moderator.reposts.stats()}")
+    print(f"outbound: {moderator.outbound.retries} retries after 429, "
+          f"{moderator.outbound.dropped} stale warnings dropped")
+    if metrics is not None:
+        exposition = metrics.render()
+        print(f"metrics: {len(exposition.splitlines())} exposition lines")
+
+
+def parse_mix(value: str):
+    mix = {}
+    for part in value.split(','):
+        kind, weight = part.split('=')
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test XLinkModerator.handle_message")
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--history-rows', type=int, default=100_000, help='rows pre-seeded into link_history')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('chatter=60,compliant=25,no_context=10,rate_limit=5'))
+    parser.add_argument('--concurrency', type=int, default=1, help='updates in flight (1 = PTB default)')
+    parser.add_argument('--flush-interval', type=float, default=0.0, help='group-commit window in seconds')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='simulated seconds per API call')
+    parser.add_argument('--chat-send-limit', type=int, default=20,
+                        help='sends per minute per chat before the fake bot answers 429 (0 = unlimited)')
+    parser.add_argument('--config', default='/nonexistent/config.yml', help='config.yml to use (defaults if missing)')
+    parser.add_argument('--db', help='database path (temporary file if omitted)')
+    parser.add_argument('--metrics', action='store_true', help='enable metrics instrumentation to measure its overhead')
+    parser.add_argument('--repost', choices=('off', 'flag', 'block'), default='off', help='repost rule to enforce')
+    parser.add_argument('--backend', choices=('sqlite', 'redis'), default='sqlite', help='link quota state backend')
+    parser.add_argument('--redis-url', help='real Redis server for --backend redis (in-process fake if omitted)')
+    parser.add_argument('--redis-latency', type=float, default=0.0, help='simulated seconds per fake Redis call')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING', help='bot log level during the run')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
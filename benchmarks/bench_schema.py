@@ -0,0 +1,114 @@
+"""
+Schema benchmark for link_history.
+Builds a legacy database (DATETIME strings, user_id/timestamp index) with
+millions of rows, times the rate-limit queries, migrates it with Database,
+and times the same queries against the migrated schema.
+
+Usage: python benchmarks/bench_schema.py [--rows 2000000] [--chats 200] [--users 20000]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database import Database  # noqa: E402
+
+
+LEGACY_SCHEMA = """
+    CREATE TABLE link_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        timestamp DATETIME NOT NULL,
+        link_url TEXT NOT NULL,
+        chat_id INTEGER NOT NULL
+    );
+    CREATE INDEX idx_user_timestamp ON link_history(user_id, timestamp);
+"""
+
+
+def build_legacy_db(path: str, rows: int, chats: int, users: int):
+    """Create a pre-migration database, generating rows inside SQLite."""
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    # Rows spread over 30 days, formatted the way the sqlite3 datetime adapter stored them
+    conn.execute("""
+        WITH RECURSIVE seq(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM seq WHERE i < ?)
+        INSERT INTO link_history (user_id, timestamp, link_url, chat_id)
+        SELECT (i * 7919) % ?,
+               strftime('%Y-%m-%d %H:%M:%f', 'now', '-' || ((i * 104729) % 2592000) || ' seconds') || '+00:00',
+               'https://x.com/u/status/' || i,
+               -1000 - (i * 31) % ?
+        FROM seq
+    """, (rows, users, chats))
+    conn.commit()
+    conn.close()
+
+
+def pick_keys(path: str, count: int):
+    """Sample (chat_id, user_id) pairs that have history."""
+    conn = sqlite3.connect(path)
+    keys = conn.execute(
+        "SELECT chat_id, user_id FROM link_history WHERE id % 997 = 0 LIMIT ?", (count,)
+    ).fetchall()
+    conn.close()
+    return keys
+
+
+def time_queries(conn: sqlite3.Connection, keys, cutoff, repeat: int):
+    """Print the plan and mean latency of the count and fetch queries."""
+    queries = {
+        'count': "SELECT COUNT(*) FROM link_history WHERE chat_id = ? AND user_id = ? AND timestamp > ?",
+        'fetch': "SELECT timestamp FROM link_history WHERE chat_id = ? AND user_id = ? AND timestamp > ?",
+    }
+    for name, sql in queries.items():
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", (*keys[0], cutoff)).fetchall()
+        print(f"  {name} plan: {'; '.join(row[-1] for row in plan)}")
+
+        def run():
+            for chat_id, user_id in keys:
+                conn.execute(sql, (chat_id, user_id, cutoff)).fetchall()
+
+        best = min(timeit.repeat(run, number=1, repeat=repeat))
+        print(f"  {name}: {best / len(keys) * 1e6:.1f} µs/query")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--queries', type=int, default=500, help='distinct keys queried per pass')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--db', help='database path (temporary file if omitted)')
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix='xgate-schema-'), 'bench.db')
+    started = time.perf_counter()
+    build_legacy_db(path, args.rows, args.chats, args.users)
+    print(f"built {args.rows:,} legacy rows in {time.perf_counter() - started:.1f}s ({path})")
+    keys = pick_keys(path, args.queries)
+
+    print("legacy schema (DATETIME text, idx_user_timestamp):")
+    conn = sqlite3.connect(path)
+    cutoff = conn.execute("SELECT strftime('%Y-%m-%d %H:%M:%f', 'now', '-7 days') || '+00:00'").fetchone()[0]
+    time_queries(conn, keys, cutoff, args.repeat)
+    conn.close()
+
+    started = time.perf_counter()
+    Database(path).close()
+    print(f"migrated in {time.perf_counter() - started:.1f}s")
+
+    print("migrated schema (epoch INTEGER, idx_chat_user_timestamp):")
+    conn = sqlite3.connect(path)
+    time_queries(conn, keys, int(time.time()) - 7 * 24 * 3600, args.repeat)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
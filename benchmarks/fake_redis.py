@@ -0,0 +1,131 @@
+"""
+In-process stand-in for a redis.asyncio client, enough for RedisBackend.
+Lets the benchmarks (and ad-hoc checks) run the Redis state backend
+without a server.
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from state import FIND_POSTS_SCRIPT, RESERVE_SCRIPT  # noqa: E402
+
+
+class FakeRedis:
+    """Keeps keys in dicts and runs known Lua scripts as Python equivalents.
+
+    Like a real server it handles one command or script at a time: every
+    call completes without yielding to the event loop, so scripts are
+    atomic with respect to each other. latency adds a simulated round trip
+    before each call.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+        self._zsets = {}
+        self._hashes = {}
+        self._strings = {}
+        self._expiry = {}
+        self._scripts = {RESERVE_SCRIPT: self._reserve, FIND_POSTS_SCRIPT: self._find_posts}
+
+    def register_script(self, script: str):
+        try:
+            handler = self._scripts[script]
+        except KeyError:
+            raise NotImplementedError("FakeRedis cannot run this script") from None
+
+        async def run(keys=(), args=(), client=None):
+            await self._round_trip()
+            return handler(list(keys), [str(arg) for arg in args])
+
+        return run
+
+    async def zcount(self, key, low, high):
+        await self._round_trip()
+        self._expire_if_due(key)
+        return sum(1 for score in self._zsets.get(key, {}).values() if _in_range(score, low, high))
+
+    async def aclose(self):
+        pass
+
+    async def _round_trip(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _expire_if_due(self, key):
+        expires_at = self._expiry.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self._zsets.pop(key, None)
+            self._hashes.pop(key, None)
+            self._strings.pop(key, None)
+            del self._expiry[key]
+
+    def _reserve(self, keys, argv):
+        """Python twin of RESERVE_SCRIPT."""
+        for key in keys:
+            self._expire_if_due(key)
+        if len(keys) > 3 and keys[3] in self._strings:
+            allowed, current = self._strings[keys[3]].split(':', 1)
+            return [int(allowed), int(current)]
+
+        window = self._zsets.setdefault(keys[0], {})
+        now = float(argv[0])
+        start = float(argv[1])
+        for member in [member for member, score in window.items() if score <= start]:
+            del window[member]
+        current = len(window)
+        limit = int(float(argv[2]))
+        ttl = int(float(argv[3]))
+        post_ttl = int(float(argv[4]))
+        links = (len(argv) - 6) // 2
+        allowed = 0
+        if limit < 0 or current + links <= limit:
+            for member in argv[6:6 + links]:
+                window[member] = now
+            self._expiry[keys[0]] = time.time() + ttl
+            posts = self._zsets.setdefault(keys[1], {})
+            posters = self._hashes.setdefault(keys[2], {})
+            for old in [post for post, score in posts.items() if score <= now - post_ttl]:
+                del posts[old]
+                posters.pop(old, None)
+            for canonical_id in argv[6 + links:]:
+                posts[canonical_id] = now
+                posters[canonical_id] = argv[5]
+            self._expiry[keys[1]] = self._expiry[keys[2]] = time.time() + post_ttl
+            allowed = 1
+        if len(keys) > 3:
+            self._strings[keys[3]] = f"{allowed}:{current}"
+            self._expiry[keys[3]] = time.time() + ttl
+        return [allowed, current]
+
+    def _find_posts(self, keys, argv):
+        """Python twin of FIND_POSTS_SCRIPT."""
+        for key in keys:
+            self._expire_if_due(key)
+        posts = self._zsets.get(keys[0], {})
+        posters = self._hashes.get(keys[1], {})
+        found = []
+        for canonical_id in argv[1:]:
+            score = posts.get(canonical_id)
+            if score is not None and score > float(argv[0]):
+                found += [canonical_id, repr(score), posters.get(canonical_id, '0')]
+        return found
+
+
+def _in_range(score, low, high):
+    """Check a score against ZCOUNT-style bounds such as "(123.4" and "+inf"."""
+    def bound(value):
+        value = str(value)
+        exclusive = value.startswith('(')
+        return float(value.lstrip('(')), exclusive
+
+    low_value, low_exclusive = bound(low)
+    high_value, high_exclusive = bound(high)
+    above = score > low_value if low_exclusive else score >= low_value
+    below = score < high_value if high_exclusive else score <= high_value
+    return above and below
@@ -3,80 +3,342 @@ Telegram bot for moderating X/Twitter links in group chats.
 Enforces rate limits and context requirements.
 """
 
-import re
+import asyncio
+import functools
+import html
 import logging
 import os
-from typing import List, Optional
+import secrets
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, FrozenSet, List, Optional, Sequence, Set, Tuple
 from telegram import Update, Message, Chat
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
+    BaseHandler,
     MessageHandler,
     CommandHandler,
     ChatMemberHandler,
     ContextTypes,
+    TypeHandler,
     filters
 )
 from telegram.error import TelegramError
-import asyncio
 
-from database import Database
+from archive import LinkArchive
+from database import DAY_SECONDS, Database
+from export import EXPORT_FORMATS, export_links
+from async_database import AsyncDatabase
 from config import Config
+from cache import ChatMetadataCache, RepostIndex, TTLCache
+from link_scanner import LinkScanner, ScanResult, strip_urls
+from log_setup import TEXT_FORMAT, setup_logging, stop_logging
+from concurrency import KeyedLock
+from scheduler import DeletionBatcher, DeletionScheduler
+from maintenance import RetentionJob
+from metrics import DATABASE_METHODS, InstrumentedRequest, Metrics
+from outbound import OutboundScheduler, Priority
+from raid import RaidGuard
+from recorder import UpdateRecorder
+from state import GCRABackend, RedisBackend, ShardSpec, SQLiteBackend, StateBackend
+from policy import ChatPolicy, ConfigWatcher, PolicyEngine, RULE_PARSERS, parse_rule
 
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 
 class XLinkModerator:
     """Main bot class for X link moderation."""
 
-    # Patterns to detect X/Twitter links
-    X_LINK_PATTERNS = [
-        r'https?://(?:www\.)?x\.com/\S+(?<![.,?!:;])',
-        r'https?://(?:www\.)?twitter\.com/\S+(?<![.,?!:;])',
-        r'https?://(?:www\.)?vxtwitter\.com/\S+(?<![.,?!:;])',
-        r'https?://(?:www\.)?fxtwitter\.com/\S+(?<![.,?!:;])',
-        r'https?://(?:www\.)?fixupx\.com/\S+(?<![.,?!:;])',
-    ]
-
-    def __init__(self, config: Config, database: Database):
-        """Initialize the bot with configuration and database."""
+    # Seconds before bot warnings are cleaned up
+    WARNING_TTL = 10
+    # Largest file a bot may send
+    MAX_DOCUMENT_BYTES = 50 * 1024 * 1024
+
+    def __init__(self, config: Config, database: AsyncDatabase, metrics: Optional[Metrics] = None,
+                 state: Optional[StateBackend] = None, archive: Optional[LinkArchive] = None,
+                 recorder: Optional[UpdateRecorder] = None):
+        """Initialize the bot with configuration and database (link quotas default to SQLite)."""
         self.config = config
         self.db = database
-        self.x_link_regex = re.compile('|'.join(self.X_LINK_PATTERNS), re.IGNORECASE)
+        self.metrics = metrics
+        self.recorder = recorder
+        self.archive = archive
+        # Chats with an /export in progress
+        self._exports: Set[int] = set()
+        if state is None:
+            if config.limiter == 'gcra':
+                state = GCRABackend(database, default_limit=config.max_links_per_week)
+            else:
+                state = SQLiteBackend(database)
+        self.state = state
+        self.shard = ShardSpec(config.shard_count, config.shard_index)
+        self.scanner = LinkScanner()
+        self.policies = PolicyEngine(config)
+        self.config_watcher = ConfigWatcher(config, self.policies.reload)
+        self.chat_cache = ChatMetadataCache()
+        self.reposts = RepostIndex()
+        # Display names for /top, learned from the messages being moderated
+        self.user_names = TTLCache(ttl_seconds=7 * 24 * 3600, max_entries=50000)
+        self.stats_cache = TTLCache(ttl_seconds=config.stats_cache_seconds)
+        self.bot_id: Optional[int] = None
+        self.outbound = OutboundScheduler(
+            global_rate=config.telegram_global_rate,
+            chat_rate_per_minute=config.telegram_chat_rate_per_minute
+        )
+        self.deleter = DeletionBatcher(self.outbound, window=config.delete_batch_window, metrics=metrics)
+        self.deletions = DeletionScheduler(database, self.deleter)
+        self.raids: Optional[RaidGuard] = None
+        if config.raid_enabled:
+            self.raids = RaidGuard(
+                self.outbound, self.deletions,
+                threshold=config.raid_threshold,
+                window=config.raid_window,
+                quiet=config.raid_quiet
+            )
+        self.user_locks = KeyedLock()
+        self.retention = RetentionJob(
+            database,
+            retention_days=config.retention_days,
+            prune_interval=config.prune_interval,
+            batch_size=config.prune_batch_size,
+            maintenance_interval=config.maintenance_interval,
+            archive=archive,
+            state=state
+        )
+
+    async def post_init(self, application: Application):
+        """Resolve the bot's own user id once at startup."""
+        self.outbound.start()
+        self.bot_id = (await self.outbound.submit(Priority.DELETE, application.bot.get_me)).id
+        logger.info(f"Running as bot id {self.bot_id}")
+        self.policies.load(await self.db.get_chat_rules())
+        await self.load_repost_index()
+        self.deleter.start(application.bot)
+        await self.deletions.start(application.bot)
+        self.retention.start()
+        self.config_watcher.start()
+        if self.recorder is not None:
+            self.recorder.start()
+        if self.metrics is not None:
+            self._register_gauges(application)
+            await self.metrics.start_server(self.config.metrics_listen, self.config.metrics_port)
+
+    def _register_gauges(self, application: Application):
+        """Expose queue depths as metrics."""
+        self.metrics.gauge('xgate_db_pending_writes', 'Writes waiting for the database writer', lambda: self.db.pending_writes)
+        self.metrics.gauge('xgate_pending_deletions', 'Messages scheduled for deletion', lambda: self.deletions.pending)
+        self.metrics.gauge('xgate_batched_deletions', 'Deletions waiting for their batch to be sent',
+                           lambda: self.deleter.pending)
+        if self.raids is not None:
+            self.metrics.gauge('xgate_active_raids', 'Chats currently in raid mode', lambda: self.raids.active)
+        self.metrics.gauge('xgate_outbound_pending', 'Telegram calls waiting for the outbound scheduler',
+                           lambda: self.outbound.pending)
+        self.metrics.gauge('xgate_active_user_locks', 'Chat/user pairs being moderated', lambda: len(self.user_locks))
+        update_queue = getattr(application, 'update_queue', None)
+        if update_queue is not None:
+            self.metrics.gauge('xgate_update_queue_size', 'Updates waiting to be processed', update_queue.qsize)
+
+    async def post_shutdown(self, application: Application):
+        """Stop background work and flush pending database writes on shutdown."""
+        if self.metrics is not None:
+            await self.metrics.stop_server()
+        await self.config_watcher.stop()
+        await self.retention.stop()
+        if self.recorder is not None:
+            await self.recorder.stop()
+        # Pending violation deletes can still queue warnings and start raids
+        await self.deleter.stop()
+        if self.raids is not None:
+            await self.raids.stop()
+        await self.deletions.stop()
+        await self.outbound.stop()
+        # Warnings sent while draining were scheduled for deletion; wait for those writes
+        await self.deletions.stop()
+        await self.state.close()
+        await self.db.close()
+
+    async def load_repost_index(self):
+        """Fill the repost index with every post shared within the longest repost window."""
+        window = self.policies.max_repost_window()
+        if not window:
+            return
+        since = int(time.time()) - window
+        shares = await self.state.recent_posts(since)
+        if shares is None:
+            # Earlier posts are looked up in the state backend as needed
+            logger.info("Repost detection checks earlier posts in the state backend")
+            return
+        self.reposts.load(shares, since)
+        logger.info(f"Loaded {self.reposts.stats()['entries']} recently shared post(s) for repost detection")
+
+    async def find_repost(self, chat_id: int, canonical_ids: Sequence[str],
+                          window: int) -> Optional[Tuple[int, int]]:
+        """Get (timestamp, user_id) of the latest earlier share of any of these posts within window seconds."""
+        since = int(time.time()) - window
+        found, unknown = self.reposts.check(chat_id, canonical_ids, since)
+        if unknown:
+            # Evicted from memory, a Bloom false positive, or older than the index covers
+            stored = await self.state.find_posts(chat_id, unknown, since)
+            for canonical_id, (timestamp, user_id) in stored.items():
+                self.reposts.record(chat_id, canonical_id, timestamp, user_id)
+                found[canonical_id] = (timestamp, user_id)
+        if self.metrics is not None:
+            self.metrics.repost_lookups.inc('memory', amount=len(canonical_ids) - len(unknown))
+            if unknown:
+                self.metrics.repost_lookups.inc('backend', amount=len(unknown))
+        return max(found.values(), default=None)
+
+    def send(self, chat_id: int, call: Callable[[], Awaitable[Message]],
+             delete_after: Optional[float] = None) -> asyncio.Future:
+        """Queue a message send through the outbound scheduler; handlers need not await it.
+
+        With delete_after, the sent message is deleted again after that many
+        seconds, and it is dropped if it cannot be sent within that time.
+        """
+        future = self.outbound.submit(Priority.WARNING, call, chat_id=chat_id, max_delay=delete_after)
+        future.add_done_callback(functools.partial(self._message_sent, delete_after))
+        return future
+
+    def _message_sent(self, delete_after: Optional[float], future: asyncio.Future):
+        """Log a failed send, or schedule deletion of a sent message."""
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            logger.error("Failed to send message: %s", error)
+            return
+        if delete_after is not None:
+            sent = future.result()
+            self.deletions.schedule(sent.chat_id, sent.message_id, delete_after)
+
+    def _remove_violation(self, message: Message, warning_text: str):
+        """Queue a violating message for deletion; the warning follows once it is gone.
+
+        The delete is batched with others in the same chat and runs ahead of
+        any queued warnings, so handlers do not wait for it.
+        """
+        future = self.deleter.delete(message.chat_id, message.message_id, Priority.DELETE)
+        future.add_done_callback(functools.partial(self._violation_removed, message, warning_text))
+
+    def _violation_removed(self, message: Message, warning_text: str, future: asyncio.Future):
+        """Warn the user about a deleted message, or log why it could not be deleted."""
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            logger.error("Failed to delete message: %s", error)
+            return
+
+        # During a burst the user is listed in one shared summary instead
+        if self.raids is not None and self.raids.absorb(message):
+            return
+
+        # Send warning, deleted again later without holding up other updates
+        self.send(
+            message.chat_id,
+            lambda: message.chat.send_message(warning_text, parse_mode='HTML'),
+            delete_after=self.WARNING_TTL
+        )
+
+    def reply(self, message: Message, text: str, **kwargs) -> asyncio.Future:
+        """Queue a reply to a message."""
+        return self.send(message.chat_id, lambda: message.reply_text(text, **kwargs))
 
     def extract_x_links(self, text: str) -> List[str]:
         """Extract all X/Twitter links from text."""
+        return self.scanner.scan(text).links
+
+    def scan_message(self, message: Message) -> ScanResult:
+        """Find X links in a message's text or media caption.
+
+        Uses the url/text_link entities Telegram already parsed (including
+        hidden links); regex scanning is only a fallback for messages that
+        arrive without any entities.
+        """
+        if message.text is not None:
+            text, entities = message.text, message.entities
+        else:
+            text, entities = message.caption, message.caption_entities
+
         if not text:
-            return []
-        return self.x_link_regex.findall(text)
+            return ScanResult([], 0)
+        if not entities:
+            return self.scanner.scan(text)
+        return self.scanner.scan_entities(text, entities)
 
     def get_text_without_links(self, text: str) -> str:
         """Remove all URLs from text to get context."""
         if not text:
             return ""
-        # Remove all URLs (not just X links)
-        url_pattern = r'https?://\S+'
-        text_without_urls = re.sub(url_pattern, '', text)
-        # Clean up extra whitespace
-        return ' '.join(text_without_urls.split())
+        # Remove all URLs (not just X links) and clean up extra whitespace
+        return strip_urls(text)
 
-    async def check_bot_permissions(self, chat: Chat, bot_id: int) -> bool:
+    async def get_bot_member(self, chat: Chat, force_refresh: bool = False):
+        """Get the bot's own ChatMember for a chat, using the metadata cache."""
+        if not force_refresh:
+            member = self.chat_cache.get_bot_member(chat.id)
+            if member is not None:
+                return member
+
+        async def fetch():
+            if self.bot_id is None:
+                self.bot_id = (await self.outbound.submit(Priority.DELETE, chat.get_bot().get_me)).id
+            return await self.outbound.submit(
+                Priority.DELETE, lambda: chat.get_member(self.bot_id), chat_id=chat.id, send=False
+            )
+
+        return await self.chat_cache.load_bot_member(chat.id, fetch)
+
+    async def get_admin_ids(self, chat: Chat, force_refresh: bool = False) -> FrozenSet[int]:
+        """Get the user ids of a chat's administrators, using the metadata cache."""
+        if not force_refresh:
+            admin_ids = self.chat_cache.get_admin_ids(chat.id)
+            if admin_ids is not None:
+                return admin_ids
+
+        async def fetch():
+            administrators = await self.outbound.submit(
+                Priority.DELETE, chat.get_administrators, chat_id=chat.id, send=False
+            )
+            return [admin.user.id for admin in administrators]
+
+        return await self.chat_cache.load_admin_ids(chat.id, fetch)
+
+    async def check_bot_permissions(self, chat: Chat, force_refresh: bool = False) -> bool:
         """Check if bot has admin permissions to delete messages."""
         try:
-            member = await chat.get_member(bot_id)
+            member = await self.get_bot_member(chat, force_refresh)
             return member.can_delete_messages if hasattr(member, 'can_delete_messages') else False
         except TelegramError as e:
             logger.error(f"Error checking bot permissions: {e}")
             return False
 
+    async def is_chat_admin(self, message: Message) -> bool:
+        """Check if a message was sent by an administrator of its chat."""
+        # Anonymous admins post on behalf of the group itself
+        if message.sender_chat is not None and message.sender_chat.id == message.chat.id:
+            return True
+        if message.from_user is None:
+            return False
+        try:
+            return message.from_user.id in await self.get_admin_ids(message.chat)
+        except TelegramError as e:
+            logger.error(f"Error checking admin status: {e}")
+            return False
+
+    async def skip_other_shards(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Stop processing updates from chats another worker owns."""
+        chat = update.effective_chat
+        if chat is not None and not self.shard.owns(chat.id):
+            raise ApplicationHandlerStop
+
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle incoming messages and check for X links."""
         message = update.message
-        if not message or not message.text:
+        if not message or not (message.text or message.caption):
             return
 
         # Only moderate group chats, not DMs
@@ -85,23 +347,43 @@ class XLinkModerator:
 
         chat_id = message.chat.id
         user_id = message.from_user.id
-        text = message.text
 
-        # Extract X links
-        x_links = self.extract_x_links(text)
+        # Extract X links (text or caption) and measure context in a single pass
+        if self.metrics is None:
+            scan = self.scan_message(message)
+        else:
+            started = time.perf_counter()
+            scan = self.scan_message(message)
+            self.metrics.scan_seconds.observe(time.perf_counter() - started)
+        x_links = scan.links
         if not x_links:
             return
 
-        logger.info(f"Found {len(x_links)} X link(s) from user {user_id} in chat {chat_id}")
+        logger.info("Found %d X link(s) from user %d in chat %d", len(x_links), user_id, chat_id,
+                    extra={'event': 'link_found'})
+        if self.recorder is not None:
+            self.recorder.record(chat_id, user_id, int(message.date.timestamp()), len(x_links),
+                                 scan.context_length, scan.canonical_ids)
+
+        # Serialize messages from the same user in the same chat, even in concurrent mode
+        async with self.user_locks.hold((chat_id, user_id)):
+            await self._moderate_links(message, scan)
+
+    async def _moderate_links(self, message: Message, scan: ScanResult):
+        """Enforce permissions, context and rate limit rules for a message with X links."""
+        chat_id = message.chat.id
+        user_id = message.from_user.id
+        x_links = scan.links
+        policy = self.policies.for_chat(chat_id)
 
         # Check if bot has permission to delete messages
-        bot_id = (await context.bot.get_me()).id
-        has_permission = await self.check_bot_permissions(message.chat, bot_id)
+        has_permission = await self.check_bot_permissions(message.chat)
 
         if not has_permission:
-            logger.warning(f"Bot lacks delete permissions in chat {chat_id}")
+            logger.warning("Bot lacks delete permissions in chat %d", chat_id, extra={'event': 'missing_permissions'})
             # Send helpful setup instructions
-            await message.reply_text(
+            self.reply(
+                message,
                 "⚠️ **I need admin permissions to moderate links!**\n\n"
                 "**Quick fix:**\n"
                 "1. Tap the group name at the top\n"
@@ -115,129 +397,268 @@ class XLinkModerator:
             return
 
         # Check context requirement
-        if self.config.require_context:
-            context_text = self.get_text_without_links(text)
-            if len(context_text) < self.config.min_context_length:
-                await self._handle_no_context_violation(message)
+        if policy.lacks_context(scan.context_length):
+            await self._handle_no_context_violation(message, policy)
+            return
+
+        # Check for posts already shared in this chat
+        reposted = None
+        if policy.repost != 'off':
+            reposted = await self.find_repost(chat_id, scan.canonical_ids, policy.repost_window)
+            if reposted is not None and policy.repost == 'block':
+                await self._handle_repost_violation(message, policy, reposted[0])
                 return
 
-        # Check rate limit
-        current_count = self.db.count_user_links_last_week(user_id, chat_id)
-        
-        links_to_process = x_links if self.config.count_per_link else [x_links[0]]
+        # Check rate limit and record the links as one atomic reservation
+        links_to_process = x_links[:policy.counted_links(len(x_links))]
         new_count = len(links_to_process)
 
-        if current_count + new_count > self.config.max_links_per_week:
-            await self._handle_rate_limit_violation(message, user_id)
+        allowed, current_count = await self.state.reserve_links(
+            user_id, links_to_process, chat_id, policy.max_links_per_week, message_id=message.message_id
+        )
+        if not allowed:
+            await self._handle_rate_limit_violation(message, user_id, policy)
             return
 
-        # Links are allowed - record them
-        for link in links_to_process:
-            self.db.add_link(user_id, link, chat_id)
-            
-        remaining = self.config.max_links_per_week - (current_count + new_count)
+        remaining = policy.max_links_per_week - (current_count + new_count)
+        if self.metrics is not None:
+            self.metrics.links_allowed.inc(amount=new_count)
+
+        self.user_names.set(user_id, message.from_user.full_name)
+        if not isinstance(self.state, SQLiteBackend):
+            # link_history is not written, so keep the /top rollups current here
+            await self.db.record_rollup(chat_id, user_id, new_count)
+
+        # The same posts the state backend just recorded with the counted links
+        now = int(time.time())
+        for canonical_id in set(scan.canonical_ids[:new_count]):
+            self.reposts.record(chat_id, canonical_id, now, user_id)
+        if reposted is not None:
+            note = policy.repost_message.format(ago=format_age(now - reposted[0]))
+            self.send(chat_id, lambda: message.reply_text(note), delete_after=self.WARNING_TTL)
 
         # Warn if approaching limit
         if remaining <= 1 and remaining >= 0:
-            warning_msg = self.config.approaching_limit_message.format(remaining=remaining)
-            warning = await message.reply_text(warning_msg)
-            # Delete warning after 10 seconds
-            await asyncio.sleep(10)
-            try:
-                await warning.delete()
-            except TelegramError:
-                pass
-
-        logger.info(f"User {user_id} posted {new_count} link(s). {remaining} remaining this week.")
-
-    async def _handle_rate_limit_violation(self, message: Message, user_id: int):
-        """Handle rate limit violation."""
-        logger.info(f"Rate limit violation by user {user_id}")
+            warning_msg = policy.approaching_limit_message.format(remaining=remaining)
+            self.send(chat_id, lambda: message.reply_text(warning_msg), delete_after=self.WARNING_TTL)
 
-        # Delete the message
-        try:
-            await message.delete()
-        except TelegramError as e:
-            logger.error(f"Failed to delete message: {e}")
-            return
+        logger.info("User %d posted %d link(s). %d remaining this week.", user_id, new_count, remaining,
+                    extra={'event': 'link_allowed'})
 
-        # Send warning
-        warning_text = self.config.rate_limit_message.format(
-            max=self.config.max_links_per_week
-        )
-        warning = await message.chat.send_message(
-            f"{message.from_user.mention_html()}: {warning_text}",
-            parse_mode='HTML'
-        )
+    async def _handle_rate_limit_violation(self, message: Message, user_id: int, policy: ChatPolicy):
+        """Handle rate limit violation."""
+        logger.info("Rate limit violation by user %d", user_id, extra={'event': 'violation'})
+        if self.metrics is not None:
+            self.metrics.violations.inc('rate_limit')
 
-        # Delete warning after 10 seconds
-        await asyncio.sleep(10)
-        try:
-            await warning.delete()
-        except TelegramError:
-            pass
+        warning_text = f"{message.from_user.mention_html()}: {policy.rate_limit_text}"
+        self._remove_violation(message, warning_text)
 
-    async def _handle_no_context_violation(self, message: Message):
-        """Handle missing context violation."""
-        logger.info(f"No context violation by user {message.from_user.id}")
+    async def _handle_repost_violation(self, message: Message, policy: ChatPolicy, shared_at: int):
+        """Handle a post that was already shared in the chat."""
+        logger.info("Repost by user %d", message.from_user.id, extra={'event': 'violation'})
+        if self.metrics is not None:
+            self.metrics.violations.inc('repost')
 
-        # Delete the message
-        try:
-            await message.delete()
-        except TelegramError as e:
-            logger.error(f"Failed to delete message: {e}")
-            return
+        ago = format_age(time.time() - shared_at)
+        warning_text = f"{message.from_user.mention_html()}: {policy.repost_message.format(ago=ago)}"
+        self._remove_violation(message, warning_text)
 
-        # Send warning
-        warning_text = self.config.no_context_message.format(
-            min=self.config.min_context_length
-        )
-        warning = await message.chat.send_message(
-            f"{message.from_user.mention_html()}: {warning_text}",
-            parse_mode='HTML'
-        )
+    async def _handle_no_context_violation(self, message: Message, policy: ChatPolicy):
+        """Handle missing context violation."""
+        logger.info("No context violation by user %d", message.from_user.id, extra={'event': 'violation'})
+        if self.metrics is not None:
+            self.metrics.violations.inc('no_context')
 
-        # Delete warning after 10 seconds
-        await asyncio.sleep(10)
-        try:
-            await warning.delete()
-        except TelegramError:
-            pass
+        warning_text = f"{message.from_user.mention_html()}: {policy.no_context_text}"
+        self._remove_violation(message, warning_text)
 
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command."""
-        await update.message.reply_text(
+        policy = self.policies.for_chat(update.message.chat.id)
+        self.reply(
+            update.message,
             "👋 X Link Moderator Bot\n\n"
             f"Rules:\n"
-            f"• Max {self.config.max_links_per_week} X links per week\n"
-            f"• Links must have {self.config.min_context_length}+ characters of context\n\n"
+            f"• Max {policy.max_links_per_week} X links per week\n"
+            f"• Links must have {policy.min_context_length}+ characters of context\n\n"
             "Make me an admin with 'Delete Messages' permission to activate moderation."
         )
 
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /stats command - show user's current stats."""
         if update.message.chat.type not in ['group', 'supergroup']:
-            await update.message.reply_text("This command only works in group chats.")
+            self.reply(update.message, "This command only works in group chats.")
             return
 
         user_id = update.message.from_user.id
         chat_id = update.message.chat.id
-        count = self.db.count_user_links_last_week(user_id, chat_id)
-        remaining = max(0, self.config.max_links_per_week - count)
+        max_links = self.policies.for_chat(chat_id).max_links_per_week
+        count = await self.state.count_links(user_id, chat_id)
+        remaining = max(0, max_links - count)
 
-        await update.message.reply_text(
+        self.reply(
+            update.message,
             f"📊 Your Stats:\n"
-            f"• Links posted this week: {count}/{self.config.max_links_per_week}\n"
+            f"• Links posted this week: {count}/{max_links}\n"
             f"• Remaining: {remaining}"
         )
 
+    def mention(self, user_id: int) -> str:
+        """HTML mention of a user by the last name seen for them."""
+        name = self.user_names.get(user_id) or f"user {user_id}"
+        return f'<a href="tg://user?id={user_id}">{html.escape(name)}</a>'
+
+    def parse_days(self, args: Optional[List[str]], default: int = 7) -> Optional[int]:
+        """Parse an optional number of days, between 1 and the retention period."""
+        if not args:
+            return default
+        try:
+            days = int(args[0])
+        except ValueError:
+            return None
+        return days if 1 <= days <= self.config.retention_days else None
+
+    async def top_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /top [days] - show the chat's most active X link posters."""
+        message = update.message
+        if message.chat.type not in ['group', 'supergroup']:
+            self.reply(message, "This command only works in group chats.")
+            return
+
+        days = self.parse_days(context.args)
+        if days is None:
+            self.reply(message, f"Usage: /top [days], with days from 1 to {self.config.retention_days}")
+            return
+
+        key = ('top', message.chat_id, days)
+        text = self.stats_cache.get(key)
+        if text is None:
+            top = await self.db.get_top_posters(message.chat_id, days)
+            if not top:
+                text = f"No X links posted in the last {days} day(s)."
+            else:
+                lines = [f"{rank}. {self.mention(user_id)}: {links}" for rank, (user_id, links) in enumerate(top, 1)]
+                text = f"🏆 Top X link posters, last {days} day(s):\n" + "\n".join(lines)
+            self.stats_cache.set(key, text)
+
+        self.reply(message, text, parse_mode='HTML')
+
+    async def history_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /history [days] - show daily link counts (admins can reply to see another user's)."""
+        message = update.message
+        if message.chat.type not in ['group', 'supergroup']:
+            self.reply(message, "This command only works in group chats.")
+            return
+
+        days = self.parse_days(context.args)
+        if days is None:
+            self.reply(message, f"Usage: /history [days], with days from 1 to {self.config.retention_days}")
+            return
+
+        user = message.from_user
+        target = message.reply_to_message.from_user if message.reply_to_message else None
+        if target is not None and target.id != user.id:
+            if not await self.is_chat_admin(message):
+                self.reply(message, "❌ Only chat administrators can see other users' history.")
+                return
+            user = target
+
+        key = ('history', message.chat_id, user.id, days)
+        text = self.stats_cache.get(key)
+        if text is None:
+            daily = await self.db.get_daily_links(message.chat_id, user.id, days)
+            name = html.escape(user.full_name)
+            if not daily:
+                text = f"📅 {name} posted no X links in the last {days} day(s)."
+            else:
+                lines = [
+                    f"• {datetime.fromtimestamp(day * DAY_SECONDS, timezone.utc):%Y-%m-%d}: {links}"
+                    for day, links in daily
+                ]
+                total = sum(links for _, links in daily)
+                text = f"📅 {name}: {total} X link(s) in the last {days} day(s)\n" + "\n".join(lines)
+            self.stats_cache.set(key, text)
+
+        self.reply(message, text, parse_mode='HTML')
+
+    async def export_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /export [csv|jsonl] [days] - send the chat's link history as a gzip file (admins only).
+
+        Replying to someone's message exports only their links. Rows are
+        streamed from the database to a temporary file on a worker thread,
+        so memory stays bounded and other updates keep being handled.
+        """
+        message = update.message
+        if message.chat.type not in ['group', 'supergroup']:
+            self.reply(message, "This command only works in group chats.")
+            return
+        if not await self.is_chat_admin(message):
+            self.reply(message, "❌ Only chat administrators can export link history.")
+            return
+        if not isinstance(self.state, SQLiteBackend):
+            self.reply(message, "❌ Link history is not kept in this bot's database when quotas are shared "
+                                "through Redis, so there is nothing to export.")
+            return
+
+        fmt, days = 'csv', None
+        for arg in context.args or []:
+            if arg.lower() in EXPORT_FORMATS:
+                fmt = arg.lower()
+            elif arg.isdigit() and int(arg) >= 1:
+                days = int(arg)
+            else:
+                self.reply(message, f"Usage: /export [{'|'.join(EXPORT_FORMATS)}] [days]")
+                return
+
+        chat_id = message.chat_id
+        if chat_id in self._exports:
+            self.reply(message, "⏳ An export for this chat is already running.")
+            return
+        target = message.reply_to_message.from_user if message.reply_to_message else None
+        user_id = target.id if target is not None else None
+        since = int(time.time()) - days * DAY_SECONDS if days is not None else None
+
+        self._exports.add(chat_id)
+        try:
+            with tempfile.TemporaryFile() as output:
+                rows = await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+                    export_links, self.db.db, output, fmt, chat_id, user_id, since, None, self.archive
+                ))
+                size = output.tell()
+                if rows == 0:
+                    self.reply(message, "No X links recorded for that selection.")
+                    return
+                if size > self.MAX_DOCUMENT_BYTES:
+                    self.reply(message, f"❌ The export is {size / 1024 / 1024:.0f} MB, over Telegram's 50 MB limit. "
+                                        "Pick fewer days, or run export.py on the server.")
+                    return
+
+                scope = f"user {user_id}" if user_id is not None else "this chat"
+                period = f"the last {days} day(s)" if days is not None else "all kept history"
+                filename = f"x-links-{chat_id}-{datetime.now(timezone.utc):%Y%m%d}.{fmt}.gz"
+
+                async def send():
+                    # Rewind on every attempt, so a retried upload sends the whole file
+                    output.seek(0)
+                    return await message.reply_document(
+                        output, filename=filename, caption=f"📦 {rows} X link record(s) from {scope}, {period}"
+                    )
+
+                await self.outbound.submit(Priority.WARNING, send, chat_id=chat_id)
+        except TelegramError as e:
+            logger.error(f"Failed to send export for chat {chat_id}: {e}")
+        finally:
+            self._exports.discard(chat_id)
+
     async def diagnose_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /diagnose command - check if bot is configured correctly."""
         chat = update.message.chat
 
         # Check if it's a group
         if chat.type not in ['group', 'supergroup']:
-            await update.message.reply_text(
+            self.reply(
+                update.message,
                 "❌ This bot only works in groups!\n\n"
                 "Please add me to a group first."
             )
@@ -245,10 +666,10 @@ class XLinkModerator:
 
         report = "🔍 **Diagnostic Report**\n\n"
 
-        # Check bot permissions
+        # Check bot permissions (always refresh so fixes show up immediately)
         try:
-            bot_id = (await context.bot.get_me()).id
-            member = await chat.get_member(bot_id)
+            member = await self.get_bot_member(chat, force_refresh=True)
+            self.chat_cache.invalidate_admins(chat.id)
 
             if member.status in ['administrator']:
                 if hasattr(member, 'can_delete_messages') and member.can_delete_messages:
@@ -269,25 +690,131 @@ class XLinkModerator:
 
         # Check database
         try:
-            test_count = self.db.count_user_links_last_week(update.message.from_user.id, chat.id)
+            test_count = await self.state.count_links(update.message.from_user.id, chat.id)
             report += "✅ Database is working\n"
+            cache_stats = self.db.link_cache.stats()
+            report += (
+                f"✅ Rate-limit cache: {cache_stats['hits']} hits, "
+                f"{cache_stats['misses']} misses, {cache_stats['entries']} entries\n"
+            )
+            chat_stats = self.chat_cache.stats()
+            report += (
+                f"✅ Chat metadata cache: {chat_stats['hits']} hits, "
+                f"{chat_stats['misses']} misses ({chat_stats['joined']} joined a lookup in flight)\n"
+            )
         except Exception as e:
             report += f"❌ Database error: {e}\n"
 
         # Show current settings
         report += f"\n⚙️ **Current Settings:**\n"
-        report += f"• Max links per week: {self.config.max_links_per_week}\n"
-        report += f"• Context required: {'Yes' if self.config.require_context else 'No'}\n"
-        if self.config.require_context:
-            report += f"• Min context length: {self.config.min_context_length} chars\n"
-        report += f"• Count each link: {'Yes' if self.config.count_per_link else 'No (one per message)'}\n"
+        report += self.format_policy(self.policies.for_chat(chat.id))
 
         # Test link detection
         report += f"\n🧪 **Test Link Detection:**\n"
         report += "Try posting this test link with context:\n"
         report += "`This is interesting: https://x.com/test/status/123`\n"
 
-        await update.message.reply_text(report, parse_mode='Markdown')
+        self.reply(update.message, report, parse_mode='Markdown')
+
+    def format_policy(self, policy: ChatPolicy) -> str:
+        """Describe a chat's effective rules, marking the ones overridden for the chat."""
+        def mark(name: str) -> str:
+            return " (chat override)" if name in policy.overridden else ""
+
+        text = f"• Max links per week: {policy.max_links_per_week}{mark('max_links_per_week')}\n"
+        text += f"• Context required: {'Yes' if policy.require_context else 'No'}{mark('require_context')}\n"
+        if policy.require_context:
+            text += f"• Min context length: {policy.min_context_length} chars{mark('min_context_length')}\n"
+        text += (
+            f"• Count each link: {'Yes' if policy.count_per_link else 'No (one per message)'}"
+            f"{mark('count_per_link')}\n"
+        )
+        if policy.repost == 'off':
+            text += f"• Reposts: allowed{mark('repost')}\n"
+        else:
+            action = 'blocked' if policy.repost == 'block' else 'flagged'
+            text += (
+                f"• Reposts: {action} within {policy.repost_window // 3600}h"
+                f"{mark('repost')}{mark('repost_window_hours')}\n"
+            )
+        return text
+
+    async def rules_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /rules command - show the rules in effect for this chat."""
+        chat = update.message.chat
+        if chat.type not in ['group', 'supergroup']:
+            self.reply(update.message, "This command only works in group chats.")
+            return
+
+        self.reply(
+            update.message,
+            "📜 Rules for this chat:\n" + self.format_policy(self.policies.for_chat(chat.id))
+        )
+
+    async def setrule_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /setrule <name> <value> - override a rule for this chat (admins only)."""
+        message = update.message
+        if message.chat.type not in ['group', 'supergroup']:
+            self.reply(message, "This command only works in group chats.")
+            return
+        if not await self.is_chat_admin(message):
+            self.reply(message, "❌ Only chat administrators can change the rules.")
+            return
+
+        if len(context.args or []) != 2:
+            self.reply(
+                message,
+                "Usage: /setrule <name> <value>\n"
+                f"Rules: {', '.join(RULE_PARSERS)}"
+            )
+            return
+
+        name, value = context.args
+        try:
+            parse_rule(name, value)
+        except ValueError as e:
+            self.reply(message, f"❌ {e}")
+            return
+
+        chat_id = message.chat.id
+        await self.db.set_chat_rule(chat_id, name, value, message.from_user.id if message.from_user else None)
+        overrides = self.policies.overrides(chat_id)
+        overrides[name] = value
+        self.policies.set_overrides(chat_id, overrides)
+        logger.info(f"Chat {chat_id} set rule {name}={value}")
+
+        self.reply(
+            message,
+            "✅ Rule updated.\n" + self.format_policy(self.policies.for_chat(chat_id))
+        )
+
+    async def resetrule_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /resetrule [name] - drop one or all of this chat's overrides (admins only)."""
+        message = update.message
+        if message.chat.type not in ['group', 'supergroup']:
+            self.reply(message, "This command only works in group chats.")
+            return
+        if not await self.is_chat_admin(message):
+            self.reply(message, "❌ Only chat administrators can change the rules.")
+            return
+
+        name = context.args[0] if context.args else None
+        if name is not None and name not in RULE_PARSERS:
+            self.reply(message, f"❌ Unknown rule {name!r} (choose from {', '.join(RULE_PARSERS)})")
+            return
+
+        chat_id = message.chat.id
+        await self.db.reset_chat_rules(chat_id, name)
+        overrides = self.policies.overrides(chat_id)
+        if name is None:
+            overrides.clear()
+        else:
+            overrides.pop(name, None)
+        self.policies.set_overrides(chat_id, overrides)
+        logger.info(f"Chat {chat_id} reset rule {name or '(all)'}")
+
+        heading = "✅ Back to the default rules.\n" if name is None else f"✅ {name} reset to the default.\n"
+        self.reply(message, heading + self.format_policy(self.policies.for_chat(chat_id)))
 
     async def my_chat_member_updated(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle bot being added to or removed from a group."""
@@ -295,31 +822,125 @@ class XLinkModerator:
         old_status = status_change.old_chat_member.status
         new_status = status_change.new_chat_member.status
 
+        # Our own membership changed, so cached permissions are stale
+        chat_id = update.effective_chat.id
+        self.chat_cache.invalidate(chat_id)
+        if new_status in ['member', 'administrator', 'restricted']:
+            self.chat_cache.set_bot_member(chat_id, status_change.new_chat_member)
+
         # Bot was added to group
         if old_status not in ['member', 'administrator'] and new_status in ['member', 'administrator']:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=(
-                    "👋 **Thanks for adding X-Gate!**\n\n"
-                    "**Quick Setup (30 seconds):**\n"
-                    "1. Make me an admin\n"
-                    "2. Enable 'Delete Messages' permission\n"
-                    "3. Done! I'll start moderating X links\n\n"
-                    "**Commands:**\n"
-                    "• /start - View rules\n"
-                    "• /stats - Check your usage\n"
-                    "• /diagnose - Test configuration\n\n"
-                    "**Default Rules:**\n"
-                    f"• Max {self.config.max_links_per_week} X links per week per user\n"
-                    f"• Links must have {self.config.min_context_length}+ characters of context\n\n"
-                    "Type /diagnose to verify I'm set up correctly!"
-                ),
-                parse_mode='Markdown'
+            policy = self.policies.for_chat(chat_id)
+            welcome = (
+                "👋 **Thanks for adding X-Gate!**\n\n"
+                "**Quick Setup (30 seconds):**\n"
+                "1. Make me an admin\n"
+                "2. Enable 'Delete Messages' permission\n"
+                "3. Done! I'll start moderating X links\n\n"
+                "**Commands:**\n"
+                "• /start - View rules\n"
+                "• /stats - Check your usage\n"
+                "• /top - Most active posters\n"
+                "• /export - Download link history (admins)\n"
+                "• /diagnose - Test configuration\n"
+                "• /rules - Show this chat's rules\n\n"
+                "**Default Rules:**\n"
+                f"• Max {policy.max_links_per_week} X links per week per user\n"
+                f"• Links must have {policy.min_context_length}+ characters of context\n\n"
+                "Type /diagnose to verify I'm set up correctly!"
             )
+            self.send(
+                chat_id,
+                lambda: context.bot.send_message(chat_id=chat_id, text=welcome, parse_mode='Markdown')
+            )
+
+    async def chat_member_updated(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle member status changes so the cached admin roster stays accurate."""
+        status_change = update.chat_member
+        admin_statuses = ['administrator', 'creator']
+        old_status = status_change.old_chat_member.status
+        new_status = status_change.new_chat_member.status
+
+        if old_status in admin_statuses or new_status in admin_statuses:
+            self.chat_cache.invalidate_admins(update.effective_chat.id)
+
+
+def format_age(seconds: float) -> str:
+    """Describe a duration the way the repost message uses it, e.g. "3 hours"."""
+    minutes = max(1, int(seconds // 60))
+    if minutes < 60:
+        return f"{minutes} minute{'s' if minutes != 1 else ''}"
+    hours = minutes // 60
+    if hours < 48:
+        return f"{hours} hour{'s' if hours != 1 else ''}"
+    return f"{hours // 24} days"
+
+
+def allowed_updates_for(application: Application, pre_filters: Sequence[BaseHandler] = ()) -> List[str]:
+    """Build the narrowest allowed_updates list that covers the registered handlers.
+
+    pre_filters are handlers that only drop updates the others asked for
+    (like the shard filter), so they don't widen the list.
+    """
+    allowed = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if any(handler is pre_filter for pre_filter in pre_filters):
+                continue
+            if isinstance(handler, ChatMemberHandler):
+                if handler.chat_member_types in (ChatMemberHandler.MY_CHAT_MEMBER, ChatMemberHandler.ANY_CHAT_MEMBER):
+                    allowed.add(Update.MY_CHAT_MEMBER)
+                if handler.chat_member_types in (ChatMemberHandler.CHAT_MEMBER, ChatMemberHandler.ANY_CHAT_MEMBER):
+                    allowed.add(Update.CHAT_MEMBER)
+            elif isinstance(handler, (MessageHandler, CommandHandler)):
+                # Handlers read update.message, so edits and channel posts are not needed
+                allowed.add(Update.MESSAGE)
+            else:
+                # Unknown handler type: don't risk filtering out its updates
+                return Update.ALL_TYPES
+    return sorted(allowed)
+
+
+def add_handlers(application: Application, moderator: XLinkModerator, config: Config,
+                 metrics: Optional[Metrics] = None) -> List[str]:
+    """Register the moderator's handlers; returns the allowed_updates list they need."""
+    # Handlers are timed when metrics are enabled
+    timed = metrics.instrument_handler if metrics is not None else (lambda callback: callback)
+    pre_filters = []
+    if config.shard_count > 1:
+        # Runs before every other handler group
+        shard_filter = TypeHandler(Update, moderator.skip_other_shards)
+        application.add_handler(shard_filter, group=-1)
+        pre_filters.append(shard_filter)
+        logger.info(f"Handling chats in shard {config.shard_index} of {config.shard_count}")
+    application.add_handler(CommandHandler("start", timed(moderator.start_command)))
+    application.add_handler(CommandHandler("stats", timed(moderator.stats_command)))
+    application.add_handler(CommandHandler("top", timed(moderator.top_command)))
+    application.add_handler(CommandHandler("history", timed(moderator.history_command)))
+    application.add_handler(CommandHandler("export", timed(moderator.export_command)))
+    application.add_handler(CommandHandler("diagnose", timed(moderator.diagnose_command)))
+    application.add_handler(CommandHandler("rules", timed(moderator.rules_command)))
+    application.add_handler(CommandHandler("setrule", timed(moderator.setrule_command)))
+    application.add_handler(CommandHandler("resetrule", timed(moderator.resetrule_command)))
+    application.add_handler(
+        MessageHandler((filters.TEXT | filters.CAPTION) & ~filters.COMMAND, timed(moderator.handle_message))
+    )
+    # Handle bot being added to groups
+    application.add_handler(
+        ChatMemberHandler(timed(moderator.my_chat_member_updated), ChatMemberHandler.MY_CHAT_MEMBER)
+    )
+    # Keep the cached admin roster in sync with promotions/demotions
+    application.add_handler(
+        ChatMemberHandler(timed(moderator.chat_member_updated), ChatMemberHandler.CHAT_MEMBER)
+    )
+    return allowed_updates_for(application, pre_filters)
 
 
 def main():
     """Main function to run the bot."""
+    # Plain stderr logging until the configuration says otherwise
+    logging.basicConfig(format=TEXT_FORMAT, level=logging.INFO)
+    log_listener = None
     try:
         # Load environment variables from .env file if it exists
         from dotenv import load_dotenv
@@ -327,38 +948,85 @@ def main():
 
         # Load configuration
         config = Config()
+        # Log output is written by a background thread from here on
+        log_listener = setup_logging(config)
         logger.info("Configuration loaded successfully")
 
         # Initialize database (support env variable for Railway)
         db_path = os.environ.get('DB_PATH', 'bot_data.db')
-        db = Database(db_path)
+        db = Database(db_path, pragmas=config.sqlite_pragmas)
         logger.info(f"Database initialized successfully at {db_path}")
 
-        # Clean up old links on startup
-        deleted = db.cleanup_old_links(days=30)
-        if deleted > 0:
-            logger.info(f"Cleaned up {deleted} old link records")
+        # Initialize bot (database writes are group-committed off the event loop)
+        # Concurrent mode has enough writes in flight to make a short batching window worthwhile
+        async_db = AsyncDatabase(db, flush_interval=0.005 if config.concurrent_updates else 0.0)
 
-        # Initialize bot
-        moderator = XLinkModerator(config, db)
+        # Metrics are opt-in; when disabled nothing below is wrapped
+        metrics = Metrics() if config.metrics_enabled else None
+        if metrics is not None:
+            metrics.instrument_methods(db, DATABASE_METHODS)
+            metrics.instrument_methods(async_db, ['_commit_batch'])
+
+        async_db.start()
+
+        # Link quotas stay in SQLite unless several workers need to share them
+        state = None
+        if config.state_backend == 'redis':
+            state = RedisBackend(url=config.redis_url, prefix=config.state_key_prefix,
+                                 post_window=config.retention_days * 24 * 3600)
+            logger.info(f"Sharing link quotas through Redis at {config.redis_url}")
+        # Expired history goes to compressed segments instead of being deleted
+        archive = None
+        if config.archive_enabled:
+            archive_dir = config.archive_dir or os.path.join(os.path.dirname(os.path.abspath(db_path)), 'archive')
+            archive = LinkArchive(archive_dir)
+            logger.info(f"Archiving expired link history to {archive_dir}")
+        recorder = None
+        if config.recorder_enabled:
+            recorder_path = config.recorder_path or os.path.join(os.path.dirname(os.path.abspath(db_path)), 'updates.xgr')
+            recorder = UpdateRecorder(recorder_path)
+            logger.info(f"Recording messages with X links to {recorder_path}")
+        moderator = XLinkModerator(config, async_db, metrics, state, archive, recorder)
 
         # Create application
-        application = Application.builder().token(config.bot_token).build()
-
-        # Add handlers
-        application.add_handler(CommandHandler("start", moderator.start_command))
-        application.add_handler(CommandHandler("stats", moderator.stats_command))
-        application.add_handler(CommandHandler("diagnose", moderator.diagnose_command))
-        application.add_handler(
-            MessageHandler(filters.TEXT & ~filters.COMMAND, moderator.handle_message)
+        # Sequential by default; concurrent mode still serializes per (chat, user)
+        concurrent_updates = config.max_concurrent_updates if config.concurrent_updates else False
+
+        builder = (
+            Application.builder()
+            .token(config.bot_token)
+            .concurrent_updates(concurrent_updates)
+            .post_init(moderator.post_init)
+            .post_shutdown(moderator.post_shutdown)
         )
-        # Handle bot being added to groups
-        application.add_handler(ChatMemberHandler(moderator.my_chat_member_updated, ChatMemberHandler.MY_CHAT_MEMBER))
+        if config.api_base_url:
+            # e.g. a local fake Bot API server for testing
+            builder = builder.base_url(config.api_base_url)
+        if metrics is not None:
+            # Same pool size the builder would use for its default request object
+            builder = builder.request(InstrumentedRequest(metrics, connection_pool_size=256))
+        application = builder.build()
+
+        allowed_updates = add_handlers(application, moderator, config, metrics)
 
         logger.info("Bot started successfully. Press Ctrl+C to stop.")
 
         # Run the bot
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if config.webhook_enabled:
+            secret_token = config.webhook_secret_token or secrets.token_urlsafe(32)
+            webhook_url = f"{config.webhook_url.rstrip('/')}/{config.webhook_path}"
+            logger.info(f"Receiving updates via webhook at {webhook_url} (listening on {config.webhook_listen}:{config.webhook_port})")
+            application.run_webhook(
+                listen=config.webhook_listen,
+                port=config.webhook_port,
+                url_path=config.webhook_path,
+                webhook_url=webhook_url,
+                secret_token=secret_token,
+                max_connections=config.webhook_max_connections,
+                allowed_updates=allowed_updates
+            )
+        else:
+            application.run_polling(allowed_updates=allowed_updates)
 
     except FileNotFoundError as e:
         logger.error(f"Configuration error: {e}")
@@ -366,6 +1034,8 @@ def main():
         logger.error(f"Configuration validation error: {e}")
     except Exception as e:
         logger.error(f"Unexpected error: {e}", exc_info=True)
+    finally:
+        stop_logging(log_listener)
 
 
 if __name__ == '__main__':
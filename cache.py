@@ -0,0 +1,430 @@
+"""
+In-memory caches for X link moderation bot.
+Keeps hot per-user and per-chat state out of SQLite and the Telegram API.
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+
+class _WindowEntry:
+    """Recent link timestamps for a single (chat_id, user_id) pair."""
+
+    __slots__ = ('timestamps', 'loaded_at')
+
+    def __init__(self, timestamps: Deque[float], loaded_at: float):
+        self.timestamps = timestamps
+        self.loaded_at = loaded_at
+
+
+class LinkWindowCache:
+    """Thread-safe LRU cache of sliding-window link timestamps per (chat_id, user_id).
+
+    Entries are warmed lazily from link_history and kept exact: if a user has
+    more timestamps in the window than fit in the bounded deque, the entry is
+    dropped and callers fall back to the database. Warming is a two-step
+    begin_load()/load() so a database read that raced with a concurrent
+    record() never installs a stale window.
+    """
+
+    def __init__(
+        self,
+        window_seconds: float = 7 * 24 * 3600,
+        max_entries: int = 10000,
+        ttl_seconds: float = 3600,
+        max_timestamps: int = 256,
+    ):
+        """Create an empty cache with LRU and TTL limits."""
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_timestamps = max_timestamps
+        self._entries: 'OrderedDict[Tuple[int, int], _WindowEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._seq = 0
+        self._loads_in_flight = 0
+        self._dirty: Dict[Tuple[int, int], int] = {}
+
+    def count(self, chat_id: int, user_id: int, now: Optional[float] = None) -> Optional[int]:
+        """Return the number of links in the window, or None on a cache miss."""
+        if now is None:
+            now = time.time()
+        key = (chat_id, user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry.loaded_at > self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            cutoff = now - self.window_seconds
+            timestamps = entry.timestamps
+            while timestamps and timestamps[0] <= cutoff:
+                timestamps.popleft()
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return len(timestamps)
+
+    def begin_load(self) -> int:
+        """Mark the start of a database read; pass the token to load() or cancel_load()."""
+        with self._lock:
+            self._loads_in_flight += 1
+            return self._seq
+
+    def cancel_load(self):
+        """Abandon a load started with begin_load()."""
+        with self._lock:
+            self._finish_load()
+
+    def _finish_load(self):
+        """Release a load slot; must be called with the lock held."""
+        self._loads_in_flight -= 1
+        if self._loads_in_flight == 0:
+            self._dirty.clear()
+
+    def load(self, chat_id: int, user_id: int, timestamps: Iterable[float],
+             now: Optional[float] = None, token: Optional[int] = None):
+        """Warm the cache with timestamps read from the database."""
+        if now is None:
+            now = time.time()
+        ordered = sorted(timestamps)
+        key = (chat_id, user_id)
+
+        with self._lock:
+            if token is not None:
+                stale = self._dirty.get(key, -1) >= token
+                self._finish_load()
+                if stale:
+                    return
+            if len(ordered) > self.max_timestamps:
+                return
+            self._entries[key] = _WindowEntry(deque(ordered, maxlen=self.max_timestamps), now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record(self, chat_id: int, user_id: int, timestamp: float):
+        """Append a newly stored link to a cached window, if one is loaded."""
+        key = (chat_id, user_id)
+        with self._lock:
+            if self._loads_in_flight:
+                self._dirty[key] = self._seq
+                self._seq += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if len(entry.timestamps) >= self.max_timestamps:
+                # The window would no longer be exact; let the database answer
+                del self._entries[key]
+                return
+            entry.timestamps.append(timestamp)
+
+    def invalidate(self, chat_id: int, user_id: int):
+        """Drop the cached window for a single user in a chat."""
+        with self._lock:
+            self._entries.pop((chat_id, user_id), None)
+
+    def clear(self):
+        """Drop every cached window."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and current size for inspection."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+            }
+
+
+class _ChatEntry:
+    """Cached Telegram metadata for a single chat."""
+
+    __slots__ = ('bot_member', 'bot_member_at', 'admin_ids', 'admin_ids_at')
+
+    def __init__(self):
+        self.bot_member: Any = None
+        self.bot_member_at = 0.0
+        self.admin_ids: Optional[FrozenSet[int]] = None
+        self.admin_ids_at = 0.0
+
+
+class ChatMetadataCache:
+    """LRU cache with TTL for the bot's own chat membership and each chat's admin roster.
+
+    load_bot_member() and load_admin_ids() keep one lookup in flight per
+    chat: callers that miss while it runs await the same future instead
+    of sending their own request.
+
+    Only used from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, ttl_seconds: float = 300, max_chats: int = 10000):
+        """Create an empty cache with LRU and TTL limits."""
+        self.ttl_seconds = ttl_seconds
+        self.max_chats = max_chats
+        self._entries: 'OrderedDict[int, _ChatEntry]' = OrderedDict()
+        # (kind, chat_id) -> lookup in flight
+        self._pending: Dict[Tuple[str, int], asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.joined = 0
+
+    def _entry(self, chat_id: int) -> _ChatEntry:
+        """Get or create the entry for a chat, evicting the least recently used."""
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            entry = _ChatEntry()
+            self._entries[chat_id] = entry
+            while len(self._entries) > self.max_chats:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(chat_id)
+        return entry
+
+    def _fresh(self, stored_at: float) -> bool:
+        """Check if a value stored at the given time is still within the TTL."""
+        return time.monotonic() - stored_at <= self.ttl_seconds
+
+    def get_bot_member(self, chat_id: int) -> Any:
+        """Return the bot's cached ChatMember for a chat, or None on a miss."""
+        entry = self._entries.get(chat_id)
+        if entry is None or entry.bot_member is None or not self._fresh(entry.bot_member_at):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(chat_id)
+        self.hits += 1
+        return entry.bot_member
+
+    def set_bot_member(self, chat_id: int, member: Any):
+        """Store the bot's ChatMember for a chat."""
+        entry = self._entry(chat_id)
+        entry.bot_member = member
+        entry.bot_member_at = time.monotonic()
+
+    def get_admin_ids(self, chat_id: int) -> Optional[FrozenSet[int]]:
+        """Return the cached admin user ids for a chat, or None on a miss."""
+        entry = self._entries.get(chat_id)
+        if entry is None or entry.admin_ids is None or not self._fresh(entry.admin_ids_at):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(chat_id)
+        self.hits += 1
+        return entry.admin_ids
+
+    def set_admin_ids(self, chat_id: int, admin_ids: Iterable[int]):
+        """Store the admin user ids for a chat."""
+        entry = self._entry(chat_id)
+        entry.admin_ids = frozenset(admin_ids)
+        entry.admin_ids_at = time.monotonic()
+
+    def load_bot_member(self, chat_id: int, fetch: Callable[[], Awaitable[Any]]) -> Awaitable[Any]:
+        """Fetch and store the bot's ChatMember, joining a lookup already in flight for the chat."""
+        return self._load(('bot_member', chat_id), fetch, lambda member: self.set_bot_member(chat_id, member))
+
+    def load_admin_ids(self, chat_id: int,
+                       fetch: Callable[[], Awaitable[Iterable[int]]]) -> Awaitable[FrozenSet[int]]:
+        """Fetch and store a chat's admin ids, joining a lookup already in flight for the chat."""
+        async def fetch_ids() -> FrozenSet[int]:
+            return frozenset(await fetch())
+
+        return self._load(('admin_ids', chat_id), fetch_ids, lambda admin_ids: self.set_admin_ids(chat_id, admin_ids))
+
+    def _load(self, key: Tuple[str, int], fetch: Callable[[], Awaitable[Any]],
+              store: Callable[[Any], None]) -> Awaitable[Any]:
+        """Start (or join) the lookup for key; its result is stored unless invalidated meanwhile."""
+        future = self._pending.get(key)
+        if future is not None:
+            self.joined += 1
+        else:
+            future = asyncio.ensure_future(fetch())
+            self._pending[key] = future
+
+            def done(finished: asyncio.Future):
+                if self._pending.get(key) is not finished:
+                    # Invalidated while in flight; the result may already be stale
+                    if not finished.cancelled():
+                        finished.exception()
+                    return
+                del self._pending[key]
+                if not finished.cancelled() and finished.exception() is None:
+                    store(finished.result())
+
+            future.add_done_callback(done)
+        # A caller that gives up must not cancel the lookup for everyone else
+        return asyncio.shield(future)
+
+    def invalidate_admins(self, chat_id: int):
+        """Forget the admin roster for a chat."""
+        self._pending.pop(('admin_ids', chat_id), None)
+        entry = self._entries.get(chat_id)
+        if entry is not None:
+            entry.admin_ids = None
+
+    def invalidate(self, chat_id: int):
+        """Forget everything cached for a chat."""
+        self._pending.pop(('bot_member', chat_id), None)
+        self._pending.pop(('admin_ids', chat_id), None)
+        self._entries.pop(chat_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and current size for inspection."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'joined': self.joined,
+            'entries': len(self._entries),
+        }
+
+
+class TTLCache:
+    """Small LRU cache whose entries expire ttl_seconds after being stored.
+
+    Only used from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 1000):
+        """Create an empty cache; a ttl of 0 disables it."""
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Any, Tuple[float, Any]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any) -> Any:
+        """Return the cached value, or None on a miss."""
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() >= entry[0]:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Any, value: Any):
+        """Store a value, evicting the least recently used entries over max_entries."""
+        if self.ttl_seconds <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Any):
+        """Drop a single entry."""
+        self._entries.pop(key, None)
+
+
+class RepostIndex:
+    """Recently shared posts per chat, answering most repost checks from memory.
+
+    An LRU maps (chat_id, canonical_id) to the latest share as (timestamp,
+    user_id). Behind it, a Bloom filter remembers every post recorded since
+    covered_since, so a post that is new to a chat (the common case) is
+    answered without touching SQLite. Only posts evicted from the LRU,
+    Bloom false positives and windows reaching back before covered_since
+    need a database lookup. Once more than capacity posts have been added
+    the filter is cleared and coverage starts over.
+
+    Only used from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, max_entries: int = 100000, bloom_bits: int = 1 << 24, hashes: int = 7):
+        """Create an empty index; nothing is covered until load() or the first record()."""
+        self.max_entries = max_entries
+        self.bloom_bits = bloom_bits
+        self.hashes = hashes
+        # About 1% false positives at this fill
+        self.capacity = bloom_bits // 10
+        self._entries: 'OrderedDict[Tuple[int, str], Tuple[int, int]]' = OrderedDict()
+        self._bloom = bytearray(bloom_bits // 8)
+        self._added = 0
+        self.covered_since = time.time()
+        self.hits = 0
+        self.filtered = 0
+        self.misses = 0
+
+    def _positions(self, chat_id: int, canonical_id: str) -> Iterable[int]:
+        """Bit positions of a post, by double hashing one 64-bit hash."""
+        value = hash((chat_id, canonical_id)) & 0xFFFFFFFFFFFFFFFF
+        first, step = value & 0xFFFFFFFF, (value >> 32) | 1
+        return [(first + i * step) % self.bloom_bits for i in range(self.hashes)]
+
+    def _maybe_seen(self, chat_id: int, canonical_id: str) -> bool:
+        bloom = self._bloom
+        return all(bloom[bit >> 3] & (1 << (bit & 7)) for bit in self._positions(chat_id, canonical_id))
+
+    def check(self, chat_id: int, canonical_ids: Iterable[str],
+              since: float) -> Tuple[Dict[str, Tuple[int, int]], List[str]]:
+        """Look up posts shared in a chat after since.
+
+        Returns (found, unknown): the latest (timestamp, user_id) of each post
+        known to have been shared, and the ids only the database can settle.
+        """
+        found: Dict[str, Tuple[int, int]] = {}
+        unknown: List[str] = []
+        covered = since >= self.covered_since
+        for canonical_id in canonical_ids:
+            key = (chat_id, canonical_id)
+            entry = self._entries.get(key)
+            if entry is not None:
+                # The LRU always holds the latest share, so an old entry means "not recently"
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if entry[0] > since:
+                    found[canonical_id] = entry
+            elif covered and not self._maybe_seen(chat_id, canonical_id):
+                self.filtered += 1
+            else:
+                self.misses += 1
+                unknown.append(canonical_id)
+        return found, unknown
+
+    def record(self, chat_id: int, canonical_id: str, timestamp: int, user_id: int):
+        """Remember a share of a post (or a newer share found in the database)."""
+        key = (chat_id, canonical_id)
+        current = self._entries.get(key)
+        if current is None or timestamp >= current[0]:
+            self._entries[key] = (timestamp, user_id)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+        if self._added >= self.capacity:
+            # Too full to be useful; only vouch for posts recorded from now on
+            self._bloom = bytearray(self.bloom_bits // 8)
+            self._added = 0
+            self.covered_since = time.time()
+        bloom = self._bloom
+        for bit in self._positions(chat_id, canonical_id):
+            bloom[bit >> 3] |= 1 << (bit & 7)
+        self._added += 1
+
+    def load(self, shares: Iterable[Tuple[int, str, int, int]], since: float):
+        """Rebuild from (chat_id, canonical_id, timestamp, user_id) rows covering everything after since."""
+        self._entries.clear()
+        self._bloom = bytearray(self.bloom_bits // 8)
+        self._added = 0
+        # record() moves this up to "now" if the filter overflows while loading
+        self.covered_since = since
+        for chat_id, canonical_id, timestamp, user_id in shares:
+            self.record(chat_id, canonical_id, timestamp, user_id)
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/filtered/miss counters and current size for inspection."""
+        return {
+            'hits': self.hits,
+            'filtered': self.filtered,
+            'misses': self.misses,
+            'entries': len(self._entries),
+        }
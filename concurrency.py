@@ -0,0 +1,40 @@
+"""
+Concurrency helpers for X link moderation bot.
+Keeps per-key ordering when updates are processed concurrently.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, List
+
+
+class KeyedLock:
+    """A set of FIFO asyncio locks, one per key, created on demand.
+
+    Locks are reference counted and dropped as soon as nobody holds or waits
+    on them, so memory stays proportional to the number of active keys.
+    """
+
+    def __init__(self):
+        """Create an empty lock table."""
+        self._locks: Dict[Hashable, List] = {}
+
+    def __len__(self) -> int:
+        """Number of keys currently held or waited on."""
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        """Hold the lock for a key; waiters are served in arrival order."""
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = [asyncio.Lock(), 0]
+            self._locks[key] = entry
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
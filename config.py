@@ -3,6 +3,7 @@ Configuration loader and validator for X link moderation bot.
 Loads settings from config.yml file.
 """
 
+import logging
 import os
 import yaml
 from typing import Dict, Any
@@ -35,12 +36,73 @@ class Config:
                 'max_links_per_week': 3,
                 'require_context': True,
                 'min_context_length': 30,
-                'count_per_link': True
+                'count_per_link': True,
+                'repost': 'off',
+                'repost_window_hours': 24
             },
             'messages': {
                 'rate_limit': "⚠️ You've hit your weekly limit ({max} X links per week)",
                 'no_context': "⚠️ X links require context (minimum {min} characters)",
-                'approaching_limit': "ℹ️ You have {remaining} X link(s) remaining this week"
+                'approaching_limit': "ℹ️ You have {remaining} X link(s) remaining this week",
+                'repost': "🔁 This post was already shared here {ago} ago"
+            },
+            'performance': {
+                'concurrent_updates': False,
+                'max_concurrent_updates': 256,
+                'telegram_global_rate': 30,
+                'telegram_chat_rate_per_minute': 20,
+                'delete_batch_window_ms': 100,
+                'stats_cache_seconds': 30
+            },
+            'raid': {
+                'enabled': True,
+                'threshold': 5,
+                'window_seconds': 10,
+                'quiet_seconds': 30
+            },
+            'database': {
+                'retention_days': 30,
+                'prune_interval_minutes': 60,
+                'prune_batch_size': 5000,
+                'maintenance_interval_hours': 24,
+                'archive_enabled': False,
+                'archive_dir': '',
+                'synchronous': 'NORMAL',
+                'cache_size_mb': 16,
+                'mmap_size_mb': 64,
+                'busy_timeout_ms': 5000
+            },
+            'state': {
+                'backend': 'sqlite',
+                'limiter': 'window',
+                'redis_url': 'redis://localhost:6379/0',
+                'key_prefix': 'xgate',
+                'shard_count': 1,
+                'shard_index': 0
+            },
+            'recorder': {
+                'enabled': False,
+                'path': ''
+            },
+            'metrics': {
+                'enabled': False,
+                'listen': '127.0.0.1',
+                'port': 9090
+            },
+            'logging': {
+                'level': 'INFO',
+                'format': 'text',
+                'sample_every': {},
+                'max_per_second': 0
+            },
+            'webhook': {
+                'enabled': False,
+                'url': '',
+                'listen': '0.0.0.0',
+                'port': 8443,
+                'path': 'telegram',
+                'secret_token': '',
+                'max_connections': 40
             }
         }
 
@@ -56,21 +118,16 @@ class Config:
         if 'telegram' not in config:
             config['telegram'] = defaults['telegram']
 
-        # Merge rules section
-        if 'rules' not in config:
-            config['rules'] = defaults['rules']
-        else:
-            for key, value in defaults['rules'].items():
-                if key not in config['rules']:
-                    config['rules'][key] = value
-
-        # Merge messages section
-        if 'messages' not in config:
-            config['messages'] = defaults['messages']
-        else:
-            for key, value in defaults['messages'].items():
-                if key not in config['messages']:
-                    config['messages'][key] = value
+        # Merge remaining sections key by key
+        for section, section_defaults in defaults.items():
+            if section == 'telegram':
+                continue
+            if section not in config:
+                config[section] = section_defaults
+            else:
+                for key, value in section_defaults.items():
+                    if key not in config[section]:
+                        config[section][key] = value
 
         return config
 
@@ -88,11 +145,115 @@ class Config:
                 "Get your token from: https://t.me/BotFather\n"
             )
 
+        if self.retention_days < 7:
+            raise ValueError(
+                "\n❌ database.retention_days must be at least 7!\n\n"
+                "The weekly link limit needs a full week of history\n"
+            )
+
+        if str(self.config['database']['synchronous']).upper() not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+            raise ValueError(
+                "\n❌ database.synchronous must be one of OFF, NORMAL, FULL or EXTRA\n"
+            )
+
+        for name in ('max_links_per_week', 'min_context_length', 'repost_window_hours'):
+            value = self.config['rules'][name]
+            try:
+                valid = int(str(value).strip()) >= 0
+            except ValueError:
+                valid = False
+            if not valid:
+                raise ValueError(
+                    f"\n❌ rules.{name} must be a whole number of 0 or more, not {value!r}\n"
+                )
+
+        for name in ('require_context', 'count_per_link'):
+            value = self.config['rules'][name]
+            if not isinstance(value, bool):
+                raise ValueError(
+                    f"\n❌ rules.{name} must be true or false, not {value!r}\n"
+                )
+
+        if self.repost_rule not in ('off', 'flag', 'block'):
+            raise ValueError(
+                "\n❌ rules.repost must be off, flag or block\n"
+            )
+
+        # Placeholders each message may use
+        placeholders = {'rate_limit': 'max', 'no_context': 'min', 'approaching_limit': 'remaining', 'repost': 'ago'}
+        for name, placeholder in placeholders.items():
+            try:
+                str(self.config['messages'][name]).format(**{placeholder: 0})
+            except (AttributeError, IndexError, KeyError, ValueError) as e:
+                raise ValueError(
+                    f"\n❌ messages.{name} is not a valid template ({e!r})\n\n"
+                    f"The only placeholder it may use is {{{placeholder}}}\n"
+                )
+
+        if self.state_backend not in ('sqlite', 'redis'):
+            raise ValueError(
+                "\n❌ state.backend must be sqlite or redis\n"
+            )
+
+        if self.limiter not in ('window', 'gcra'):
+            raise ValueError(
+                "\n❌ state.limiter must be window or gcra\n"
+            )
+
+        if self.limiter == 'gcra' and self.state_backend != 'sqlite':
+            raise ValueError(
+                "\n❌ state.limiter gcra needs state.backend sqlite\n"
+            )
+
+        if self.shard_count < 1 or not 0 <= self.shard_index < self.shard_count:
+            raise ValueError(
+                "\n❌ state.shard_index must be between 0 and state.shard_count - 1!\n\n"
+                "Give every worker the same shard_count and its own shard_index\n"
+                "(or export SHARD_INDEX)\n"
+            )
+
+        if self.shard_count > 1 and not self.webhook_enabled:
+            raise ValueError(
+                "\n❌ state.shard_count above 1 needs webhook mode!\n\n"
+                "Only one worker can poll for a bot's updates; enable webhook\n"
+                "and deliver every update to all shards\n"
+            )
+
+        if self.log_format not in ('text', 'json'):
+            raise ValueError(
+                "\n❌ logging.format must be text or json\n"
+            )
+
+        if not isinstance(logging.getLevelName(self.log_level), int):
+            raise ValueError(
+                "\n❌ logging.level must be DEBUG, INFO, WARNING, ERROR or CRITICAL\n"
+            )
+
+        try:
+            sample_every = self.log_sample_every
+        except (AttributeError, TypeError, ValueError):
+            sample_every = None
+        if sample_every is None or any(every < 1 for every in sample_every.values()):
+            raise ValueError(
+                "\n❌ logging.sample_every must map event names to whole numbers of 1 or more\n"
+            )
+
+        if self.webhook_enabled and not self.webhook_url:
+            raise ValueError(
+                "\n❌ Webhook mode is enabled but no public URL is set!\n\n"
+                "Set webhook.url in config.yml or export TELEGRAM_WEBHOOK_URL\n"
+            )
+
     @property
     def bot_token(self) -> str:
         """Get Telegram bot token (supports env variable override)."""
         return os.environ.get('TELEGRAM_BOT_TOKEN') or self.config['telegram']['bot_token']
 
+    @property
+    def api_base_url(self) -> str:
+        """Get Bot API base URL override (empty for the official server)."""
+        return os.environ.get('TELEGRAM_API_BASE_URL') or str(self.config['telegram'].get('base_url', '') or '')
+
     @property
     def max_links_per_week(self) -> int:
         """Get maximum links allowed per week."""
@@ -111,7 +272,19 @@ class Config:
     @property
     def count_per_link(self) -> bool:
         """Check if each link counts individually."""
-        return self.config['rules'].get('count_per_link', True)
+        return bool(self.config['rules']['count_per_link'])
+
+    @property
+    def repost_rule(self) -> str:
+        """Get what happens to a post already shared in the chat: off, flag or block."""
+        value = self.config['rules']['repost']
+        # YAML reads a bare off as False
+        return 'off' if value is False else str(value).lower()
+
+    @property
+    def repost_window_hours(self) -> int:
+        """Get how far back a post counts as already shared."""
+        return int(self.config['rules']['repost_window_hours'])
 
     @property
     def rate_limit_message(self) -> str:
@@ -128,7 +301,218 @@ class Config:
         """Get approaching limit warning message."""
         return str(self.config['messages']['approaching_limit'])
 
+    @property
+    def repost_message(self) -> str:
+        """Get message shown for a repost ({ago} is the time since it was shared)."""
+        return str(self.config['messages']['repost'])
+
+    @property
+    def concurrent_updates(self) -> bool:
+        """Check if updates from different chats are processed concurrently."""
+        return bool(self.config['performance']['concurrent_updates'])
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        """Get maximum number of updates processed at the same time in concurrent mode."""
+        return int(self.config['performance']['max_concurrent_updates'])
+
+    @property
+    def telegram_global_rate(self) -> float:
+        """Get maximum messages sent per second across all chats."""
+        return float(self.config['performance']['telegram_global_rate'])
+
+    @property
+    def telegram_chat_rate_per_minute(self) -> float:
+        """Get maximum messages sent per minute into a single chat."""
+        return float(self.config['performance']['telegram_chat_rate_per_minute'])
+
+    @property
+    def delete_batch_window(self) -> float:
+        """Get seconds to collect deletions in a chat before sending them as one request."""
+        return int(self.config['performance']['delete_batch_window_ms']) / 1000
+
+    @property
+    def stats_cache_seconds(self) -> float:
+        """Get how long /top and /history replies are reused (0 = always query)."""
+        return float(self.config['performance']['stats_cache_seconds'])
+
+    @property
+    def raid_enabled(self) -> bool:
+        """Check if violation bursts are summarized instead of warned one by one."""
+        return bool(self.config['raid']['enabled'])
+
+    @property
+    def raid_threshold(self) -> int:
+        """Get number of violations within the raid window that starts raid mode."""
+        return int(self.config['raid']['threshold'])
+
+    @property
+    def raid_window(self) -> float:
+        """Get length in seconds of the window violations are counted over."""
+        return float(self.config['raid']['window_seconds'])
+
+    @property
+    def raid_quiet(self) -> float:
+        """Get seconds without violations after which raid mode ends."""
+        return float(self.config['raid']['quiet_seconds'])
+
+    @property
+    def retention_days(self) -> int:
+        """Get number of days link history is kept."""
+        return int(self.config['database']['retention_days'])
+
+    @property
+    def prune_interval(self) -> float:
+        """Get seconds between background retention pruning runs."""
+        return float(self.config['database']['prune_interval_minutes']) * 60
+
+    @property
+    def prune_batch_size(self) -> int:
+        """Get maximum rows deleted per pruning chunk."""
+        return int(self.config['database']['prune_batch_size'])
+
+    @property
+    def archive_enabled(self) -> bool:
+        """Check if expired link history is archived instead of deleted."""
+        return bool(self.config['database']['archive_enabled'])
+
+    @property
+    def archive_dir(self) -> str:
+        """Get the archive directory, empty for one next to the database (supports ARCHIVE_DIR env variable)."""
+        return os.environ.get('ARCHIVE_DIR') or str(self.config['database']['archive_dir'] or '')
+
+    @property
+    def maintenance_interval(self) -> float:
+        """Get seconds between incremental vacuum / optimize runs."""
+        return float(self.config['database']['maintenance_interval_hours']) * 3600
+
+    @property
+    def sqlite_pragmas(self) -> Dict[str, Any]:
+        """Get per-connection SQLite tuning as PRAGMA name -> value."""
+        database = self.config['database']
+        return {
+            'synchronous': str(database['synchronous']).upper(),
+            'cache_size': -int(float(database['cache_size_mb']) * 1024),
+            'mmap_size': int(float(database['mmap_size_mb']) * 1024 * 1024),
+            'busy_timeout': int(database['busy_timeout_ms']),
+        }
+
+    @property
+    def recorder_enabled(self) -> bool:
+        """Check if messages with X links are logged for simulate.py."""
+        return bool(self.config['recorder']['enabled'])
+
+    @property
+    def recorder_path(self) -> str:
+        """Get the update log path, empty for one next to the database (supports RECORDER_PATH env variable)."""
+        return os.environ.get('RECORDER_PATH') or str(self.config['recorder']['path'] or '')
+
+    @property
+    def metrics_enabled(self) -> bool:
+        """Check if the Prometheus /metrics endpoint is served."""
+        return bool(self.config['metrics']['enabled'])
+
+    @property
+    def metrics_listen(self) -> str:
+        """Get address the metrics HTTP server binds to."""
+        return str(self.config['metrics']['listen'])
+
+    @property
+    def limiter(self) -> str:
+        """Get how the weekly quota is enforced: window (exact) or gcra (constant cost)."""
+        return str(self.config['state']['limiter']).lower()
+
+    @property
+    def state_backend(self) -> str:
+        """Get where link quota state is kept: sqlite or redis."""
+        return str(self.config['state']['backend']).lower()
+
+    @property
+    def redis_url(self) -> str:
+        """Get Redis server URL for the redis backend (supports REDIS_URL env variable)."""
+        return os.environ.get('REDIS_URL') or self.config['state']['redis_url']
+
+    @property
+    def state_key_prefix(self) -> str:
+        """Get prefix for every key the redis backend writes."""
+        return str(self.config['state']['key_prefix'])
+
+    @property
+    def shard_count(self) -> int:
+        """Get number of workers that split chats between them."""
+        return int(os.environ.get('SHARD_COUNT') or self.config['state']['shard_count'])
+
+    @property
+    def shard_index(self) -> int:
+        """Get this worker's shard, 0 to shard_count - 1 (supports SHARD_INDEX env variable)."""
+        return int(os.environ.get('SHARD_INDEX') or self.config['state']['shard_index'])
+
+    @property
+    def metrics_port(self) -> int:
+        """Get port the metrics HTTP server listens on (supports METRICS_PORT env variable)."""
+        return int(os.environ.get('METRICS_PORT') or self.config['metrics']['port'])
+
+    @property
+    def log_level(self) -> str:
+        """Get the minimum log level (supports LOG_LEVEL env variable)."""
+        return (os.environ.get('LOG_LEVEL') or str(self.config['logging']['level'])).upper()
+
+    @property
+    def log_format(self) -> str:
+        """Get the log output format: text or json (supports LOG_FORMAT env variable)."""
+        return (os.environ.get('LOG_FORMAT') or str(self.config['logging']['format'])).lower()
+
+    @property
+    def log_sample_every(self) -> Dict[str, int]:
+        """Get event type -> keep one in N of its log lines."""
+        return {str(event): int(every) for event, every in (self.config['logging']['sample_every'] or {}).items()}
+
+    @property
+    def log_max_per_second(self) -> float:
+        """Get the cap on log lines per second for each event type (0 for none)."""
+        return float(self.config['logging']['max_per_second'])
+
+    @property
+    def webhook_enabled(self) -> bool:
+        """Check if updates are received via webhook instead of long polling."""
+        return bool(self.config['webhook']['enabled'])
+
+    @property
+    def webhook_url(self) -> str:
+        """Get public base URL Telegram should deliver updates to (supports env variable override)."""
+        return os.environ.get('TELEGRAM_WEBHOOK_URL') or str(self.config['webhook']['url'] or '')
+
+    @property
+    def webhook_listen(self) -> str:
+        """Get address the local webhook HTTP server binds to."""
+        return str(self.config['webhook']['listen'])
+
+    @property
+    def webhook_port(self) -> int:
+        """Get port the local webhook HTTP server listens on (supports PORT env variable)."""
+        return int(os.environ.get('PORT') or self.config['webhook']['port'])
+
+    @property
+    def webhook_path(self) -> str:
+        """Get URL path the webhook is served under."""
+        return str(self.config['webhook']['path']).strip('/')
+
+    @property
+    def webhook_secret_token(self) -> str:
+        """Get secret token Telegram must echo back (supports env variable override)."""
+        return os.environ.get('TELEGRAM_WEBHOOK_SECRET') or str(self.config['webhook']['secret_token'] or '')
+
+    @property
+    def webhook_max_connections(self) -> int:
+        """Get maximum simultaneous webhook connections Telegram may open."""
+        return int(self.config['webhook']['max_connections'])
+
     def reload(self):
-        """Reload configuration from file."""
-        self.config = self._load_config()
-        self._validate_config()
+        """Reload configuration from file, keeping the current settings if the new ones are invalid."""
+        previous = self.config
+        try:
+            self.config = self._load_config()
+            self._validate_config()
+        except Exception:
+            self.config = previous
+            raise
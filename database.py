@@ -3,33 +3,133 @@ Database operations for X link moderation bot.
 Handles SQLite database initialization and link tracking.
 """
 
+import logging
+import math
 import sqlite3
-from datetime import datetime, timedelta, timezone
-from typing import List, Optional
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 import threading
+import urllib.parse
+
+from cache import LinkWindowCache
+from link_scanner import canonical_link
+
+
+logger = logging.getLogger(__name__)
+
+# Length of the rate-limit window
+LINK_WINDOW_SECONDS = 7 * 24 * 3600
+DAY_SECONDS = 24 * 3600
+
+# Per-connection tuning applied to every connection (see Config.sqlite_pragmas)
+DEFAULT_PRAGMAS: Dict[str, Any] = {
+    'synchronous': 'NORMAL',     # Durable with WAL except for the last commits on power loss
+    'cache_size': -16000,        # Negative means KiB: 16 MB page cache
+    'mmap_size': 64 * 1024 * 1024,
+    'busy_timeout': 5000,        # Milliseconds to wait for a lock held by another connection
+    'temp_store': 'MEMORY',
+}
+
+
+def window_start(seconds: int = LINK_WINDOW_SECONDS) -> int:
+    """Epoch second at which a window of the given length, ending now, starts."""
+    return int(time.time()) - seconds
 
 
 class Database:
     """Thread-safe SQLite database handler for link tracking."""
 
-    def __init__(self, db_path: str = "bot_data.db"):
-        """Initialize database connection and create tables if needed."""
+    # Rows copied per committed chunk when a migration rewrites a table
+    MIGRATION_BATCH_ROWS = 50000
+
+    def __init__(self, db_path: str = "bot_data.db", link_cache: Optional[LinkWindowCache] = None,
+                 pragmas: Optional[Dict[str, Any]] = None, read_only: bool = False):
+        """Initialize database connection and create tables if needed.
+
+        With read_only, the file is opened with SQLite's mode=ro and left
+        exactly as it is: no migrations run, and every write fails.
+        """
         self.db_path = db_path
+        self.read_only = read_only
         self.local = threading.local()
-        self._init_db()
+        self.link_cache = link_cache if link_cache is not None else LinkWindowCache()
+        self.pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        if not read_only:
+            self._init_db()
 
     def _get_connection(self) -> sqlite3.Connection:
         """Get thread-local database connection."""
         if not hasattr(self.local, 'connection'):
-            self.local.connection = sqlite3.connect(self.db_path)
+            if self.read_only:
+                uri = f"file:{urllib.parse.quote(self.db_path)}?mode=ro"
+                self.local.connection = sqlite3.connect(uri, uri=True)
+            else:
+                self.local.connection = sqlite3.connect(self.db_path)
             self.local.connection.row_factory = sqlite3.Row
+            for name, value in self.pragmas.items():
+                self.local.connection.execute(f"PRAGMA {name}={value}")
         return self.local.connection
 
     def _init_db(self):
-        """Create tables if they don't exist."""
+        """Bring the schema up to date by applying pending migrations in order."""
         conn = self._get_connection()
         cursor = conn.cursor()
 
+        # Lets the retention job hand freed pages back with incremental_vacuum.
+        # Only takes effect on a new database; migration 8 converts older files.
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+
+        # WAL lets readers run alongside the group-commit writer
+        cursor.execute("PRAGMA journal_mode=WAL")
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                applied_at INTEGER NOT NULL
+            )
+        """)
+        conn.commit()
+
+        cursor.execute("SELECT MAX(version) AS version FROM schema_migrations")
+        current = cursor.fetchone()['version'] or 0
+
+        for version, migrate in self._migrations():
+            if version <= current:
+                continue
+            logger.info(f"Applying database migration {version}: {migrate.__doc__}")
+            try:
+                # The version is recorded in the migration's final transaction
+                migrate(conn)
+                cursor.execute("""
+                    INSERT INTO schema_migrations (version, applied_at) VALUES (?, ?)
+                """, (version, int(time.time())))
+                conn.commit()
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+
+    def _migrations(self) -> List[Tuple[int, Callable[[sqlite3.Connection], None]]]:
+        """All schema migrations as (version, function), oldest first.
+
+        A migration may commit intermediate work, but must leave its final
+        step uncommitted so it lands atomically with its version row.
+        """
+        return [
+            (1, self._migrate_initial_schema),
+            (2, self._migrate_epoch_timestamps),
+            (3, self._migrate_chat_rules),
+            (4, self._migrate_canonical_ids),
+            (5, self._migrate_link_rollups),
+            (6, self._migrate_archive_state),
+            (7, self._migrate_rate_limit_state),
+            (8, self._migrate_incremental_vacuum),
+        ]
+
+    def _migrate_initial_schema(self, conn: sqlite3.Connection):
+        """Create the original tables (no-op for databases that predate migrations)."""
+        cursor = conn.cursor()
+
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS link_history (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -45,66 +145,590 @@ class Database:
             ON link_history(user_id, timestamp)
         """)
 
+        # Warning messages waiting to be deleted (survives restarts)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS pending_deletions (
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                due_at REAL NOT NULL,
+                PRIMARY KEY (chat_id, message_id)
+            )
+        """)
+
+    def _migrate_epoch_timestamps(self, conn: sqlite3.Connection):
+        """Store timestamps as integer epoch seconds with a (chat_id, user_id, timestamp) index."""
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS link_history_v2 (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                timestamp INTEGER NOT NULL,
+                link_url TEXT NOT NULL,
+                chat_id INTEGER NOT NULL
+            )
+        """)
         conn.commit()
 
+        # Copy in committed chunks; after a crash we resume from the last copied id
+        while True:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) AS last_id FROM link_history_v2")
+            last_id = cursor.fetchone()['last_id']
+            cursor.execute("""
+                INSERT INTO link_history_v2 (id, user_id, timestamp, link_url, chat_id)
+                SELECT id, user_id, CAST(strftime('%s', timestamp) AS INTEGER), link_url, chat_id
+                FROM link_history
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+            """, (last_id, self.MIGRATION_BATCH_ROWS))
+            copied = cursor.rowcount
+            conn.commit()
+            if copied < self.MIGRATION_BATCH_ROWS:
+                break
+            logger.info(f"Migrated link history up to id {last_id + copied}")
+
+        # Swap tables atomically, picking up anything written since the last chunk
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("""
+            INSERT INTO link_history_v2 (id, user_id, timestamp, link_url, chat_id)
+            SELECT id, user_id, CAST(strftime('%s', timestamp) AS INTEGER), link_url, chat_id
+            FROM link_history
+            WHERE id > (SELECT COALESCE(MAX(id), 0) FROM link_history_v2)
+        """)
+        cursor.execute("DROP TABLE link_history")
+        cursor.execute("ALTER TABLE link_history_v2 RENAME TO link_history")
+        # Covers every rate-limit query: equality on chat and user, range on time
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_chat_user_timestamp
+            ON link_history(chat_id, user_id, timestamp)
+        """)
+
+    def _migrate_chat_rules(self, conn: sqlite3.Connection):
+        """Add per-chat rule overrides."""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS chat_rules (
+                chat_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                value TEXT NOT NULL,
+                updated_by INTEGER,
+                updated_at INTEGER NOT NULL,
+                PRIMARY KEY (chat_id, name)
+            )
+        """)
+
+    def _migrate_canonical_ids(self, conn: sqlite3.Connection):
+        """Add canonical post ids to link history for repost detection."""
+        cursor = conn.cursor()
+        columns = [row['name'] for row in cursor.execute("PRAGMA table_info(link_history)")]
+        if 'canonical_id' not in columns:
+            cursor.execute("ALTER TABLE link_history ADD COLUMN canonical_id TEXT")
+
+        # Backfill in committed chunks; the last one lands with the version row
+        conn.create_function('canonical_link', 1, canonical_link, deterministic=True)
+        last_id = 0
+        while True:
+            cursor.execute("""
+                SELECT MAX(id) AS last_id, COUNT(*) AS rows FROM (
+                    SELECT id FROM link_history WHERE id > ? ORDER BY id LIMIT ?
+                )
+            """, (last_id, self.MIGRATION_BATCH_ROWS))
+            chunk = cursor.fetchone()
+            if not chunk['rows']:
+                break
+            cursor.execute("""
+                UPDATE link_history SET canonical_id = canonical_link(link_url)
+                WHERE id > ? AND id <= ? AND canonical_id IS NULL
+            """, (last_id, chunk['last_id']))
+            last_id = chunk['last_id']
+            if chunk['rows'] < self.MIGRATION_BATCH_ROWS:
+                break
+            conn.commit()
+            logger.info(f"Backfilled canonical ids up to id {last_id}")
+
+        # Repost lookups: equality on chat and post, range on time
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_chat_canonical_timestamp
+            ON link_history(chat_id, canonical_id, timestamp)
+        """)
+
+    def _migrate_link_rollups(self, conn: sqlite3.Connection):
+        """Add per (chat, user, day) link counts for /top and /history."""
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS link_rollups (
+                chat_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                links INTEGER NOT NULL,
+                PRIMARY KEY (chat_id, user_id, day)
+            ) WITHOUT ROWID
+        """)
+        # No second index: a leaderboard reads one chat's rows through the
+        # primary key, at most users x retention days, and every insert stays a single b-tree write
+        cursor.execute("""
+            INSERT OR REPLACE INTO link_rollups (chat_id, user_id, day, links)
+            SELECT chat_id, user_id, timestamp / ?, COUNT(*)
+            FROM link_history
+            GROUP BY chat_id, user_id, timestamp / ?
+        """, (DAY_SECONDS, DAY_SECONDS))
+
+    def _migrate_archive_state(self, conn: sqlite3.Connection):
+        """Add bookkeeping for the link history archive."""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS archive_state (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        """)
+
+    def _migrate_rate_limit_state(self, conn: sqlite3.Connection):
+        """Add one GCRA state row per (chat, user) for the gcra limiter."""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limit_state (
+                chat_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                tat REAL NOT NULL,
+                emission_interval REAL NOT NULL,
+                PRIMARY KEY (chat_id, user_id)
+            ) WITHOUT ROWID
+        """)
+
+    def _migrate_incremental_vacuum(self, conn: sqlite3.Connection):
+        """Switch databases created before auto_vacuum was set to incremental mode.
+
+        The pragma only applies to an existing file after a full VACUUM,
+        which rewrites the whole database once (needing as much free disk
+        space again) and cannot run inside a transaction. Running it twice
+        is harmless, so a crash before the version row is recorded only
+        means the check is repeated.
+        """
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return
+        if conn.in_transaction:
+            conn.commit()
+        logger.info("Rewriting the database once so freed pages can be returned to the OS")
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+
+    def _insert_links(self, cursor: sqlite3.Cursor, user_id: int,
+                      link_urls: Iterable[str], chat_id: int) -> int:
+        """Insert links and bump the day's rollup without committing; returns the stored epoch timestamp."""
+        now = int(time.time())
+        rows = [(user_id, now, link_url, chat_id, canonical_link(link_url)) for link_url in link_urls]
+        cursor.executemany("""
+            INSERT INTO link_history (user_id, timestamp, link_url, chat_id, canonical_id)
+            VALUES (?, ?, ?, ?, ?)
+        """, rows)
+        self._record_rollup(cursor, chat_id, user_id, now, len(rows))
+        return now
+
+    def _record_rollup(self, cursor: sqlite3.Cursor, chat_id: int, user_id: int,
+                       timestamp: int, links: int):
+        """Add links to a user's count for the day of timestamp, without committing."""
+        cursor.execute("""
+            INSERT INTO link_rollups (chat_id, user_id, day, links) VALUES (?, ?, ?, ?)
+            ON CONFLICT (chat_id, user_id, day) DO UPDATE SET links = links + excluded.links
+        """, (chat_id, user_id, timestamp // DAY_SECONDS, links))
+
     def add_link(self, user_id: int, link_url: str, chat_id: int):
         """Record a new X link posted by a user."""
         conn = self._get_connection()
         cursor = conn.cursor()
 
-        cursor.execute("""
-            INSERT INTO link_history (user_id, timestamp, link_url, chat_id)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, datetime.now(timezone.utc), link_url, chat_id))
+        timestamp = self._insert_links(cursor, user_id, [link_url], chat_id)
 
         conn.commit()
+        self.link_cache.record(chat_id, user_id, timestamp)
+
+    def _count_links(self, cursor: sqlite3.Cursor, user_id: int, chat_id: int) -> int:
+        """Count a user's last-week links on the given cursor, bypassing the cache."""
+        cursor.execute("""
+            SELECT COUNT(*) as count FROM link_history
+            WHERE chat_id = ? AND user_id = ? AND timestamp > ?
+        """, (chat_id, user_id, window_start()))
+
+        result = cursor.fetchone()
+        return result['count'] if result else 0
+
+    def reserve_links(self, user_id: int, link_urls: List[str], chat_id: int,
+                      max_links: int) -> Tuple[bool, int]:
+        """Atomically check the weekly quota and record links if they fit.
+
+        Returns (allowed, count_before). The count and insert run in one
+        IMMEDIATE transaction, so concurrent callers cannot both pass.
+        """
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            current = self._count_links(cursor, user_id, chat_id)
+            if current + len(link_urls) > max_links:
+                conn.rollback()
+                return False, current
+            timestamp = self._insert_links(cursor, user_id, link_urls, chat_id)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        for _ in link_urls:
+            self.link_cache.record(chat_id, user_id, timestamp)
+        return True, current
+
+    def _reserve_rate(self, cursor: sqlite3.Cursor, user_id: int, link_urls: List[str], chat_id: int,
+                      max_links: int, enforce: bool = True,
+                      window: int = LINK_WINDOW_SECONDS) -> Tuple[bool, int]:
+        """Check and update a user's GCRA state in one statement, without committing.
+
+        The state is a theoretical arrival time (tat): each link pushes it
+        window / max_links seconds into the future, and links fit while tat
+        stays within one window of now. This allows max_links links in a
+        burst and then one more every window / max_links seconds, using a
+        single row per user however much they post. The interval is stored
+        with the row, so a changed limit rescales the links already in use.
+        Allowed links are still recorded in link_history (for rollups,
+        reposts and the archive), but never counted.
+
+        Returns (allowed, links in use before this message).
+        """
+        now = time.time()
+        row = None
+        if max_links > 0:
+            cursor.execute("""
+                INSERT INTO rate_limit_state (chat_id, user_id, tat, emission_interval)
+                SELECT :chat_id, :user_id, :now + :links * :interval, :interval
+                WHERE :links <= :capacity
+                ON CONFLICT (chat_id, user_id) DO UPDATE SET
+                    tat = :now + ((MAX(tat, :now) - :now) / emission_interval + :links) * :interval,
+                    emission_interval = :interval
+                WHERE (MAX(tat, :now) - :now) / emission_interval + :links <= :capacity
+                RETURNING tat
+            """, {
+                'chat_id': chat_id, 'user_id': user_id, 'now': now, 'links': len(link_urls),
+                'interval': window / max_links,
+                # Slack for float rounding, far below one link
+                'capacity': max_links + 1e-6 if enforce else 1e18,
+            })
+            row = cursor.fetchone()
+        if row is None:
+            return False, self._rate_usage(cursor, user_id, chat_id, now)
+
+        self._insert_links(cursor, user_id, link_urls, chat_id)
+        return True, max(0, math.ceil((row[0] - now) * max_links / window - len(link_urls) - 1e-6))
+
+    def _rate_usage(self, cursor: sqlite3.Cursor, user_id: int, chat_id: int, now: float) -> int:
+        """Get the whole links a user's GCRA state has in use at now."""
+        cursor.execute("""
+            SELECT tat, emission_interval FROM rate_limit_state WHERE chat_id = ? AND user_id = ?
+        """, (chat_id, user_id))
+
+        row = cursor.fetchone()
+        if row is None or row['tat'] <= now:
+            return 0
+        return math.ceil((row['tat'] - now) / row['emission_interval'] - 1e-6)
+
+    def get_rate_usage(self, user_id: int, chat_id: int) -> int:
+        """Get the links counting against a user's quota under the gcra limiter."""
+        return self._rate_usage(self._get_connection().cursor(), user_id, chat_id, time.time())
+
+    def _prune_rate_state(self, cursor: sqlite3.Cursor) -> int:
+        """Delete GCRA rows that have fully drained, without committing."""
+        cursor.execute("""
+            DELETE FROM rate_limit_state WHERE tat < ?
+        """, (time.time(),))
+
+        return cursor.rowcount
 
     def get_user_links_last_week(self, user_id: int, chat_id: int) -> List[sqlite3.Row]:
         """Get all links posted by user in the last 7 days for a specific chat."""
         conn = self._get_connection()
         cursor = conn.cursor()
 
-        seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
-
         cursor.execute("""
             SELECT * FROM link_history
-            WHERE user_id = ? AND chat_id = ? AND timestamp > ?
+            WHERE chat_id = ? AND user_id = ? AND timestamp > ?
             ORDER BY timestamp DESC
-        """, (user_id, chat_id, seven_days_ago))
+        """, (chat_id, user_id, window_start()))
 
         return cursor.fetchall()
 
     def count_user_links_last_week(self, user_id: int, chat_id: int) -> int:
-        """Count number of links posted by user in last 7 days for a specific chat."""
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        """Count number of links posted by user in last 7 days for a specific chat.
 
-        seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
+        Served from the in-memory sliding-window cache when possible; a miss
+        warms the cache from link_history.
+        """
+        cached = self.link_cache.count(chat_id, user_id)
+        if cached is not None:
+            return cached
+        return self._load_link_window(user_id, chat_id)
 
+    def _fetch_link_timestamps(self, cursor: sqlite3.Cursor, user_id: int, chat_id: int) -> List[int]:
+        """Read a user's last-week link timestamps (epoch seconds) on the given cursor."""
         cursor.execute("""
-            SELECT COUNT(*) as count FROM link_history
-            WHERE user_id = ? AND chat_id = ? AND timestamp > ?
-        """, (user_id, chat_id, seven_days_ago))
+            SELECT timestamp FROM link_history
+            WHERE chat_id = ? AND user_id = ? AND timestamp > ?
+        """, (chat_id, user_id, window_start()))
 
-        result = cursor.fetchone()
-        return result['count'] if result else 0
+        return [row[0] for row in cursor.fetchall()]
 
-    def cleanup_old_links(self, days: int = 30):
-        """Remove link history older than specified days."""
-        conn = self._get_connection()
-        cursor = conn.cursor()
+    def _load_link_window(self, user_id: int, chat_id: int) -> int:
+        """Read a user's last-week timestamps from disk, warm the cache and return the count."""
+        token = self.link_cache.begin_load()
+        try:
+            cursor = self._get_connection().cursor()
+            timestamps = self._fetch_link_timestamps(cursor, user_id, chat_id)
+        except Exception:
+            self.link_cache.cancel_load()
+            raise
+
+        self.link_cache.load(chat_id, user_id, timestamps, token=token)
+        return len(timestamps)
+
+    def find_recent_posts(self, chat_id: int, canonical_ids: Iterable[str],
+                          since: int) -> Dict[str, Tuple[int, int]]:
+        """Get the latest (timestamp, user_id) after since for each post already shared in a chat."""
+        canonical_ids = list(canonical_ids)
+        if not canonical_ids:
+            return {}
+        cursor = self._get_connection().cursor()
+        placeholders = ', '.join('?' * len(canonical_ids))
+        # The bare user_id comes from the row holding MAX(timestamp)
+        cursor.execute(f"""
+            SELECT canonical_id, MAX(timestamp) AS timestamp, user_id FROM link_history
+            WHERE chat_id = ? AND canonical_id IN ({placeholders}) AND timestamp > ?
+            GROUP BY canonical_id
+        """, (chat_id, *canonical_ids, since))
 
-        cutoff_date = datetime.now(timezone.utc) - timedelta(days=days)
+        return {row['canonical_id']: (row['timestamp'], row['user_id']) for row in cursor.fetchall()}
 
+    def get_recent_posts(self, since: int) -> List[Tuple[int, str, int, int]]:
+        """Get (chat_id, canonical_id, timestamp, user_id) for every post shared after since, oldest first."""
+        cursor = self._get_connection().cursor()
+        cursor.execute("""
+            SELECT chat_id, canonical_id, timestamp, user_id FROM link_history
+            WHERE timestamp > ? AND canonical_id IS NOT NULL
+            ORDER BY id
+        """, (since,))
+
+        return [tuple(row) for row in cursor.fetchall()]
+
+    def get_top_posters(self, chat_id: int, days: int, limit: int = 10) -> List[Tuple[int, int]]:
+        """Get (user_id, links) for the chat's most active posters over the last days (today included)."""
+        cursor = self._get_connection().cursor()
+        cursor.execute("""
+            SELECT user_id, SUM(links) AS links FROM link_rollups
+            WHERE chat_id = ? AND day > ?
+            GROUP BY user_id
+            ORDER BY links DESC, user_id
+            LIMIT ?
+        """, (chat_id, int(time.time()) // DAY_SECONDS - days, limit))
+
+        return [(row['user_id'], row['links']) for row in cursor.fetchall()]
+
+    def get_daily_links(self, chat_id: int, user_id: int, days: int) -> List[Tuple[int, int]]:
+        """Get (day, links) for a user's active days in the chat over the last days, newest first."""
+        cursor = self._get_connection().cursor()
+        cursor.execute("""
+            SELECT day, links FROM link_rollups
+            WHERE chat_id = ? AND user_id = ? AND day > ?
+            ORDER BY day DESC
+        """, (chat_id, user_id, int(time.time()) // DAY_SECONDS - days))
+
+        return [(row['day'], row['links']) for row in cursor.fetchall()]
+
+    def _prune_rollups(self, cursor: sqlite3.Cursor, days: int) -> int:
+        """Delete rollups for days that have fallen out of retention, without committing."""
+        cursor.execute("""
+            DELETE FROM link_rollups WHERE day < ?
+        """, (window_start(days * DAY_SECONDS) // DAY_SECONDS,))
+
+        return cursor.rowcount
+
+    def _delete_old_links(self, cursor: sqlite3.Cursor, days: int) -> int:
+        """Delete link history older than specified days without committing."""
         cursor.execute("""
             DELETE FROM link_history
             WHERE timestamp < ?
-        """, (cutoff_date,))
+        """, (window_start(days * DAY_SECONDS),))
 
-        conn.commit()
+        return cursor.rowcount
+
+    def _forget_deleted_links(self, deleted: int, days: int):
+        """Drop cached windows if a cleanup removed rows inside the rate-limit window."""
+        if deleted > 0 and days * DAY_SECONDS < self.link_cache.window_seconds:
+            self.link_cache.clear()
+
+    def _prune_links_batch(self, cursor: sqlite3.Cursor, days: int, batch_size: int) -> int:
+        """Delete expired rows among the oldest batch_size rows, without committing.
+
+        Rows are inserted in time order, so walking the rowid from the start
+        finds expired rows without an index on timestamp; a batch that deletes
+        fewer than batch_size rows has reached the retention boundary.
+        """
+        cursor.execute("""
+            DELETE FROM link_history
+            WHERE id IN (SELECT id FROM link_history ORDER BY id LIMIT ?)
+              AND timestamp < ?
+        """, (batch_size, window_start(days * DAY_SECONDS)))
+
+        return cursor.rowcount
+
+    def iter_link_history(self, chat_id: Optional[int] = None, user_id: Optional[int] = None,
+                          since: Optional[int] = None, until: Optional[int] = None,
+                          chunk_size: int = 5000) -> Iterator[List[Tuple[int, int, int, str, int, Optional[str]]]]:
+        """Stream link history in id order, chunk_size rows at a time.
+
+        Yields lists of (id, user_id, timestamp, link_url, chat_id,
+        canonical_id) tuples, fetched incrementally from one cursor, so
+        memory stays bounded however many rows match. Run it on its own
+        thread: the read holds a WAL snapshot open but never blocks writers.
+        """
+        conditions, params = [], []
+        for column, operator, value in (('chat_id', '=', chat_id), ('user_id', '=', user_id),
+                                        ('timestamp', '>=', since), ('timestamp', '<', until)):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        cursor = self._get_connection().cursor()
+        cursor.execute(f"""
+            SELECT id, user_id, timestamp, link_url, chat_id, canonical_id
+            FROM link_history {where} ORDER BY id
+        """, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [tuple(row) for row in rows]
+        finally:
+            cursor.close()
+
+    def get_archived_through(self) -> int:
+        """Get the highest link_history id already moved to the archive (0 if none)."""
+        cursor = self._get_connection().cursor()
+        cursor.execute("SELECT value FROM archive_state WHERE name = 'archived_through'")
+        row = cursor.fetchone()
+        return row['value'] if row else 0
+
+    def get_archivable_links(self, days: int, batch_size: int) -> List[Tuple[int, int, int, str, int, Optional[str]]]:
+        """Get the next run of expired rows not yet archived, in id order.
+
+        Returns (id, user_id, timestamp, link_url, chat_id, canonical_id)
+        tuples. Like pruning, this walks the rowid and stops at the first
+        row still inside retention, so the result is always a contiguous id
+        range that _forget_archived_links can delete exactly.
+        """
+        cursor = self._get_connection().cursor()
+        cursor.execute("""
+            SELECT id, user_id, timestamp, link_url, chat_id, canonical_id
+            FROM link_history WHERE id > ? ORDER BY id LIMIT ?
+        """, (self.get_archived_through(), batch_size))
+
+        cutoff = window_start(days * DAY_SECONDS)
+        rows = []
+        for row in cursor.fetchall():
+            if row['timestamp'] >= cutoff:
+                break
+            rows.append(tuple(row))
+        return rows
+
+    def _forget_archived_links(self, cursor: sqlite3.Cursor, first_id: int, last_id: int) -> int:
+        """Delete an archived id range and advance the archive mark, without committing."""
+        cursor.execute("""
+            DELETE FROM link_history WHERE id BETWEEN ? AND ?
+        """, (first_id, last_id))
         deleted = cursor.rowcount
+        cursor.execute("""
+            INSERT INTO archive_state (name, value) VALUES ('archived_through', ?)
+            ON CONFLICT (name) DO UPDATE SET value = excluded.value
+        """, (last_id,))
+
+        return deleted
+
+    def _run_maintenance(self, cursor: sqlite3.Cursor, vacuum_pages: int):
+        """Return up to vacuum_pages free pages to the OS and refresh planner statistics."""
+        cursor.execute("PRAGMA freelist_count")
+        free_pages = min(cursor.fetchone()[0], vacuum_pages)
+        # sqlite3 steps a pragma only once, which frees a single page
+        for _ in range(free_pages):
+            cursor.execute("PRAGMA incremental_vacuum(1)")
+        # Bounded ANALYZE of tables whose statistics look stale
+        cursor.execute("PRAGMA analysis_limit=400")
+        cursor.execute("PRAGMA optimize")
+
+    def cleanup_old_links(self, days: int = 30):
+        """Remove link history older than specified days."""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        deleted = self._delete_old_links(cursor, days)
+
+        conn.commit()
+        self._forget_deleted_links(deleted, days)
         return deleted
 
+    def _add_pending_deletion(self, cursor: sqlite3.Cursor, chat_id: int,
+                              message_id: int, due_at: float):
+        """Persist a scheduled message deletion without committing."""
+        cursor.execute("""
+            INSERT OR REPLACE INTO pending_deletions (chat_id, message_id, due_at)
+            VALUES (?, ?, ?)
+        """, (chat_id, message_id, due_at))
+
+    def _remove_pending_deletions(self, cursor: sqlite3.Cursor,
+                                  messages: Iterable[Tuple[int, int]]):
+        """Forget scheduled deletions that have been carried out, without committing."""
+        cursor.executemany("""
+            DELETE FROM pending_deletions
+            WHERE chat_id = ? AND message_id = ?
+        """, list(messages))
+
+    def get_pending_deletions(self) -> List[Tuple[float, int, int]]:
+        """Get all scheduled deletions as (due_at, chat_id, message_id) tuples."""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            SELECT due_at, chat_id, message_id FROM pending_deletions
+        """)
+
+        return [(row['due_at'], row['chat_id'], row['message_id']) for row in cursor.fetchall()]
+
+    def _set_chat_rule(self, cursor: sqlite3.Cursor, chat_id: int, name: str,
+                       value: str, updated_by: Optional[int]):
+        """Store a per-chat rule override without committing."""
+        cursor.execute("""
+            INSERT OR REPLACE INTO chat_rules (chat_id, name, value, updated_by, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (chat_id, name, value, updated_by, int(time.time())))
+
+    def _delete_chat_rules(self, cursor: sqlite3.Cursor, chat_id: int, name: Optional[str] = None) -> int:
+        """Remove one or all of a chat's rule overrides without committing."""
+        if name is None:
+            cursor.execute("DELETE FROM chat_rules WHERE chat_id = ?", (chat_id,))
+        else:
+            cursor.execute("DELETE FROM chat_rules WHERE chat_id = ? AND name = ?", (chat_id, name))
+        return cursor.rowcount
+
+    def get_chat_rules(self) -> Dict[int, Dict[str, str]]:
+        """Get every chat's rule overrides as {chat_id: {name: value}}."""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            SELECT chat_id, name, value FROM chat_rules
+        """)
+
+        rules: Dict[int, Dict[str, str]] = {}
+        for row in cursor.fetchall():
+            rules.setdefault(row['chat_id'], {})[row['name']] = row['value']
+        return rules
+
     def close(self):
         """Close database connection."""
         if hasattr(self.local, 'connection'):
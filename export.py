@@ -0,0 +1,129 @@
+"""
+Link history export for X link moderation bot.
+Streams link history (and optionally the archive) into a gzip CSV or JSON
+lines file with bounded memory; used by /export and from the command line.
+
+Usage: python export.py [--db bot_data.db] [--chat ID] [--user ID] [--since 2024-01-01]
+                        [--until 2024-02-01] [--format csv|jsonl] [--archive DIR] -o links.csv.gz
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime, timezone
+from typing import BinaryIO, Iterator, List, Optional, Sequence
+
+from archive import LinkArchive
+from database import Database
+
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+# Columns of an exported row; time is the timestamp as ISO 8601 (UTC)
+EXPORT_FIELDS = ('id', 'chat_id', 'user_id', 'timestamp', 'time', 'link_url', 'canonical_id')
+
+
+def _iter_archive(archive: LinkArchive, chat_id: Optional[int], user_id: Optional[int],
+                  since: Optional[int], until: Optional[int], chunk_size: int) -> Iterator[List[Sequence]]:
+    """Stream matching archived rows in chunks shaped like Database.iter_link_history's."""
+    chunk = []
+    for row in archive.read(since, until, chat_id):
+        if user_id is not None and row.user_id != user_id:
+            continue
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def export_links(database: Database, output: BinaryIO, fmt: str = 'csv',
+                 chat_id: Optional[int] = None, user_id: Optional[int] = None,
+                 since: Optional[int] = None, until: Optional[int] = None,
+                 archive: Optional[LinkArchive] = None, chunk_size: int = 5000) -> int:
+    """Write matching link history to output as gzip CSV or JSON lines; returns rows written.
+
+    Archived rows, if an archive is given, come first since they are the
+    oldest. Blocking: call it from a worker thread when inside the bot.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format {fmt!r} (choose from {', '.join(EXPORT_FORMATS)})")
+
+    sources = []
+    if archive is not None:
+        sources.append(_iter_archive(archive, chat_id, user_id, since, until, chunk_size))
+    sources.append(database.iter_link_history(chat_id, user_id, since, until, chunk_size))
+
+    written = 0
+    # A crash while archiving can leave a chunk both archived and live; export it once
+    last_id = 0
+    with gzip.GzipFile(fileobj=output, mode='wb', compresslevel=6) as compressed:
+        text = io.TextIOWrapper(compressed, encoding='utf-8', newline='')
+        writer = csv.writer(text) if fmt == 'csv' else None
+        if writer is not None:
+            writer.writerow(EXPORT_FIELDS)
+        for source in sources:
+            for chunk in source:
+                for row_id, row_user_id, timestamp, link_url, row_chat_id, canonical_id in chunk:
+                    if row_id <= last_id:
+                        continue
+                    last_id = row_id
+                    time_text = datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+                    values = (row_id, row_chat_id, row_user_id, timestamp, time_text, link_url, canonical_id)
+                    if writer is not None:
+                        writer.writerow(values)
+                    else:
+                        text.write(json.dumps(dict(zip(EXPORT_FIELDS, values)), ensure_ascii=False))
+                        text.write('\n')
+                    written += 1
+        text.flush()
+        text.detach()
+    return written
+
+
+def _parse_date(value: str) -> int:
+    """Parse YYYY-MM-DD (UTC) into epoch seconds."""
+    return int(datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp())
+
+
+def main():
+    """Export link history from the command line."""
+    parser = argparse.ArgumentParser(description="Export X link history as gzip CSV or JSON lines")
+    parser.add_argument('--db', default=os.environ.get('DB_PATH', 'bot_data.db'), help='bot database')
+    parser.add_argument('--chat', type=int, help='only this chat id')
+    parser.add_argument('--user', type=int, help='only this user id')
+    parser.add_argument('--since', type=_parse_date, help='first day to include (YYYY-MM-DD, UTC)')
+    parser.add_argument('--until', type=_parse_date, help='day to stop before (YYYY-MM-DD, UTC)')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument('--archive', help='also include rows from this archive directory')
+    parser.add_argument('-o', '--output', help='output file (default: stdout)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        sys.exit(f"❌ Database not found: {args.db}")
+    # Read-only, so exporting from a running bot's database never migrates or writes it
+    database = Database(args.db, read_only=True)
+    archive = LinkArchive(args.archive) if args.archive else None
+    try:
+        if args.output:
+            with open(args.output, 'wb') as output:
+                rows = export_links(database, output, args.format, args.chat, args.user,
+                                    args.since, args.until, archive)
+        else:
+            rows = export_links(database, sys.stdout.buffer, args.format, args.chat, args.user,
+                                args.since, args.until, archive)
+    except sqlite3.OperationalError as e:
+        sys.exit(f"❌ Cannot read {args.db}: {e}\n"
+                 f"Start the bot once with this database to bring its schema up to date")
+    finally:
+        database.close()
+    print(f"Exported {rows} link record(s)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+Link scanning for X link moderation bot.
+Finds X/Twitter links and measures the remaining context in a single pass.
+"""
+
+import re
+from typing import Any, Iterable, List, Optional, Tuple
+
+
+# Hosts treated as X/Twitter links; a leading "www." is accepted for each
+X_DOMAINS = (
+    'x.com',
+    'twitter.com',
+    'vxtwitter.com',
+    'fxtwitter.com',
+    'fixupx.com',
+)
+
+# Characters dropped from the end of a link ("see https://x.com/a/status/1.")
+TRAILING_PUNCTUATION = '.,?!:;'
+
+# Telegram MessageEntity types that carry a link
+URL_ENTITY = 'url'
+TEXT_LINK_ENTITY = 'text_link'
+
+# Any URL-looking token; everything it matches is excluded from context
+URL_PATTERN = re.compile(r'https?://\S+', re.IGNORECASE)
+
+# "https" or "http" in any case, spelled out so the scanning regex needs no
+# IGNORECASE flag ("s" also folds to U+017F under IGNORECASE)
+HTTPS_SCHEME = '[hH][tT][tT][pP][sS\u017f]'
+HTTP_SCHEME = '[hH][tT][tT][pP]'
+
+# Host and path of a single post: <host>/<user>/status/<id>, <host>/i/web/status/<id>, <host>/i/status/<id>
+STATUS_LINK = re.compile(r'[^/]*/(?:[^/?#]+/status(?:es)?|i(?:/web)?/status)/(\d+)', re.IGNORECASE)
+
+
+def compile_x_link_pattern(domains: Iterable[str]) -> str:
+    """Build the regex source for the part of an X link after "https://" from a domain table."""
+    hosts = '|'.join(re.escape(domain) for domain in sorted(domains, key=len, reverse=True))
+    punctuation = re.escape(TRAILING_PUNCTUATION)
+    return rf'(?:www\.)?(?:{hosts})/\S+(?<![{punctuation}])'
+
+
+class ScanResult:
+    """X links found in a message and the length of the text around all URLs.
+
+    context_length is only computed when at least one X link is found.
+    canonical_ids are worked out on first use, since only repost checks and
+    the update recorder need them.
+    """
+
+    __slots__ = ('links', 'context_length', '_canonical_ids')
+
+    def __init__(self, links: List[str], context_length: int):
+        self.links = links
+        self.context_length = context_length
+        self._canonical_ids: Optional[Tuple[str, ...]] = None
+
+    @property
+    def canonical_ids(self) -> Tuple[str, ...]:
+        """canonical_link() of each link, in order."""
+        if self._canonical_ids is None:
+            self._canonical_ids = tuple(canonical_link(link) for link in self.links)
+        return self._canonical_ids
+
+
+def strip_urls(text: str) -> str:
+    """Remove all URLs from text and collapse whitespace."""
+    return ' '.join(URL_PATTERN.sub('', text).split())
+
+
+def canonical_link(url: str) -> str:
+    """Reduce an X link to a key shared by every way of writing it.
+
+    Posts become "status:<id>" whatever the host, username or query string
+    (x.com/a/status/1, twitter.com/b/status/1?s=20, fxtwitter.com/a/status/1/photo/1);
+    anything else becomes "path:" plus its lowercased path.
+    """
+    rest = url.split('://', 1)[-1]
+    match = STATUS_LINK.match(rest)
+    if match is not None:
+        return 'status:' + match.group(1)
+    slash = rest.find('/')
+    path = rest[slash:] if slash >= 0 else '/'
+    path = path.split('?', 1)[0].split('#', 1)[0]
+    return 'path:' + (path.rstrip('/').lower() or '/')
+
+
+class LinkScanner:
+    """X link scanner driven by a domain table.
+
+    No regex here carries a global IGNORECASE flag: with it, the regex
+    engine tries the pattern at every character instead of jumping to the
+    next literal "http" or "://", and that search dominates the cost on
+    ordinary messages.
+
+    When every "://" in a message follows a lowercase "http" or "https" (the
+    usual case), links come from one findall and, only if there are any,
+    the context from one sub, both with a literal "http" prefix. Anything
+    else (other schemes, "HTTPS://") goes through one combined regex that
+    starts at the literal "://", checks the scheme in a lookbehind, and
+    splits the text into the context between URLs and, for each URL token,
+    either an X link or the rest of some other URL. Both give the same
+    links and context length.
+    """
+
+    def __init__(self, domains: Iterable[str] = X_DOMAINS):
+        """Compile the domain table into the scanning regexes."""
+        x_link = compile_x_link_pattern(domains)
+        self.x_link_regex = re.compile(rf'https?://{x_link}', re.IGNORECASE)
+        # Finds a "://" after anything but a lowercase "http" or "https"
+        self._other_scheme_regex = re.compile(r'://(?<!http://)(?<!https://)')
+        # Exact only when every scheme in the text is lowercase
+        self._lowercase_x_link_regex = re.compile(rf'https?://(?i:{x_link})')
+        self._lowercase_url_regex = re.compile(r'https?://\S+')
+        # split() yields [context, https scheme, http scheme, x_link, other_url, context, ...];
+        # one of the schemes is None, and so is one of x_link and other_url
+        self._split_regex = re.compile(
+            rf'://(?:(?<=({HTTPS_SCHEME})://)|(?<=({HTTP_SCHEME})://))(?:((?i:{x_link}))\S*|(\S+))'
+        )
+
+    def scan(self, text: str) -> ScanResult:
+        """Extract X links and the context length left after removing every URL."""
+        # Cheap prefilter: most chatter has no URL at all
+        if not text or '://' not in text:
+            return ScanResult([], 0)
+        if self._other_scheme_regex.search(text) is None:
+            return self._scan_lowercase(text)
+        return self._scan_any(text)
+
+    def _scan_lowercase(self, text: str) -> ScanResult:
+        """scan() for text whose every "://" follows a lowercase "http" or "https"."""
+        links = self._lowercase_x_link_regex.findall(text)
+        if not links:
+            return ScanResult([], 0)
+        return ScanResult(links, len(' '.join(self._lowercase_url_regex.sub('', text).split())))
+
+    def _scan_any(self, text: str) -> ScanResult:
+        """scan() for any text, in a single pass."""
+        parts = self._split_regex.split(text)
+        https_schemes = parts[1::5]
+        http_schemes = parts[2::5]
+        links = []
+        for https, http, x_link, other_url in zip(https_schemes, http_schemes, parts[3::5], parts[4::5]):
+            if x_link is not None:
+                links.append((https or http) + '://' + x_link)
+            elif '://' in other_url:
+                # An X link may also be embedded later in a non-X URL token
+                nested = self.x_link_regex.search(other_url)
+                if nested is not None:
+                    links.append(nested.group())
+
+        if not links:
+            return ScanResult([], 0)
+
+        # The lookbehind left each URL's scheme at the end of the context before it
+        context = [
+            piece[:-len(https or http)] for piece, https, http in zip(parts[::5], https_schemes, http_schemes)
+        ]
+        context.append(parts[-1])
+        context_length = len(' '.join(''.join(context).split()))
+        return ScanResult(links, context_length)
+
+    def match_link(self, url: str) -> Optional[str]:
+        """Return url (minus trailing punctuation) if it is an X link, else None.
+
+        Telegram also marks scheme-less text such as "x.com/a/status/1" as a
+        URL, so those are checked as if they started with https://.
+        """
+        if '://' not in url:
+            url = 'https://' + url
+        match = self.x_link_regex.match(url)
+        return match.group() if match is not None else None
+
+    def scan_entities(self, text: str, entities: Iterable[Any]) -> ScanResult:
+        """Extract X links from Telegram url/text_link entities instead of regex-scanning text.
+
+        Entity offsets are in UTF-16 code units, so slicing happens on the
+        UTF-16 encoding of the text. Visible URLs are removed from the
+        context; the anchor text of hidden text_link links stays.
+        """
+        links = []
+        encoded = None
+        pieces = []
+        position = 0
+        for entity in entities:
+            if entity.type == TEXT_LINK_ENTITY:
+                link = self.match_link(entity.url)
+            elif entity.type == URL_ENTITY:
+                if encoded is None:
+                    encoded = text.encode('utf-16-le')
+                start = entity.offset * 2
+                end = (entity.offset + entity.length) * 2
+                link = self.match_link(encoded[start:end].decode('utf-16-le'))
+                pieces.append(encoded[position:start])
+                position = end
+            else:
+                continue
+            if link is not None:
+                links.append(link)
+
+        if not links:
+            return ScanResult([], 0)
+
+        if encoded is None:
+            context = text
+        else:
+            pieces.append(encoded[position:])
+            context = b''.join(pieces).decode('utf-16-le')
+        return ScanResult(links, len(' '.join(context.split())))
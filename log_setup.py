@@ -0,0 +1,128 @@
+"""
+Logging setup for X link moderation bot.
+Hands log records to a background thread for formatting and output, with
+optional JSON lines and sampling of high-volume events.
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, Mapping, Optional
+
+from config import Config
+
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue records without formatting them first.
+
+    The stock QueueHandler renders the message on the calling thread; here
+    that is left to the listener. Log only immutable values (ids, counts,
+    strings) as arguments, since they are formatted later on another thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, event and exception."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        event = getattr(record, 'event', None)
+        if event is not None:
+            entry['event'] = event
+        if getattr(record, 'sampled', 1) > 1:
+            entry['sampled'] = record.sampled
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class EventSampler(logging.Filter):
+    """Thin out records tagged with an event type (extra={'event': ...}).
+
+    sample_every keeps one record in N per event type; max_per_second then
+    caps what is left, per event type. Records without an event, and
+    warnings or worse, always pass. A kept record carries how many it
+    stands for in record.sampled. Runs on the thread that logs (usually
+    the event loop) before anything is queued, so dropped records cost
+    only this check; keep it cheap and never block in it.
+    """
+
+    def __init__(self, sample_every: Mapping[str, int], max_per_second: float = 0):
+        """Sample per event type; max_per_second 0 means no cap."""
+        super().__init__()
+        self.sample_every = {event: max(1, int(every)) for event, every in sample_every.items()}
+        self.max_per_second = max_per_second
+        self._seen: Dict[str, int] = {}
+        # event -> [second, records kept in that second]
+        self._second: Dict[str, list] = {}
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, 'event', None)
+        if event is None or record.levelno >= logging.WARNING:
+            return True
+
+        seen = self._seen.get(event, 0) + 1
+        self._seen[event] = seen
+        every = self.sample_every.get(event, 1)
+        if seen % every:
+            self.dropped += 1
+            return False
+
+        if self.max_per_second > 0:
+            now = int(time.monotonic())
+            window = self._second.get(event)
+            if window is None or window[0] != now:
+                window = self._second[event] = [now, 0]
+            if window[1] >= self.max_per_second:
+                self.dropped += 1
+                return False
+            window[1] += 1
+
+        record.sampled = every
+        return True
+
+
+def setup_logging(config: Config, stream=None) -> logging.handlers.QueueListener:
+    """Route all logging through a queue to a listener thread; returns the started listener.
+
+    Call stop() on the listener at exit to write out queued records.
+    """
+    output = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    output.setFormatter(JsonFormatter() if config.log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    log_queue: 'queue.SimpleQueue[logging.LogRecord]' = queue.SimpleQueue()
+    handler = _DeferredQueueHandler(log_queue)
+    if config.log_sample_every or config.log_max_per_second > 0:
+        handler.addFilter(EventSampler(config.log_sample_every, config.log_max_per_second))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(config.log_level)
+
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def stop_logging(listener: Optional[logging.handlers.QueueListener]):
+    """Flush and stop a listener from setup_logging, if any."""
+    if listener is not None:
+        listener.stop()
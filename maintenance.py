@@ -0,0 +1,116 @@
+"""
+Background database maintenance for X link moderation bot.
+Prunes (or archives) expired link history in small chunks and keeps SQLite tidy.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from archive import LinkArchive
+from async_database import AsyncDatabase
+from state import StateBackend
+
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionJob:
+    """Periodic task that enforces the link history retention period.
+
+    Every prune_interval seconds it deletes expired rows in chunks of
+    batch_size, each chunk its own short write so moderation writes are never
+    stuck behind a large DELETE. After a prune it runs an incremental vacuum
+    and PRAGMA optimize at most once per maintenance_interval seconds.
+
+    With an archive, each chunk is first written to a compressed segment
+    file and only then deleted, together with advancing the archived-through
+    mark. A crash in between re-archives the same rows into the same
+    segment name on the next run, so nothing is lost or counted twice.
+
+    With a state backend, each pass ends with its cleanup() for quota
+    state kept outside link_history.
+    """
+
+    def __init__(self, database: AsyncDatabase, retention_days: int = 30,
+                 prune_interval: float = 3600, batch_size: int = 5000,
+                 maintenance_interval: float = 86400, archive: Optional[LinkArchive] = None,
+                 state: Optional[StateBackend] = None):
+        """Create an idle job; call start() from within the event loop."""
+        self.db = database
+        self.archive = archive
+        self.state = state
+        self.retention_days = retention_days
+        self.prune_interval = prune_interval
+        self.batch_size = batch_size
+        self.maintenance_interval = maintenance_interval
+        self.last_pruned = 0
+        self._last_maintenance = time.monotonic()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def start(self):
+        """Start the background task; the first prune runs right away."""
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the task after the chunk in progress, if any."""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+    async def _run(self):
+        """Prune, then sleep until the next interval or until stopped."""
+        while not self._stopping:
+            try:
+                await self.prune()
+                if time.monotonic() - self._last_maintenance >= self.maintenance_interval:
+                    await self.db.run_maintenance()
+                    self._last_maintenance = time.monotonic()
+            except Exception as e:
+                logger.error(f"Database maintenance failed: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.prune_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def prune(self) -> int:
+        """Delete (or archive) all expired link history, one chunk at a time; returns rows removed."""
+        total = 0
+        while not self._stopping:
+            if self.archive is not None:
+                deleted = await self._archive_chunk()
+            else:
+                deleted = await self.db.prune_old_links(self.retention_days, self.batch_size)
+            total += deleted
+            if deleted < self.batch_size:
+                break
+            # Give queued handler writes a turn between chunks
+            await asyncio.sleep(0)
+
+        self.last_pruned = total
+        if total > 0:
+            action = 'Archived' if self.archive is not None else 'Pruned'
+            logger.info(f"{action} {total} link record(s) older than {self.retention_days} days")
+        # One row per chat, user and day (or active user), so a single statement stays short
+        if not self._stopping:
+            await self.db.prune_rollups(self.retention_days)
+            if self.state is not None:
+                await self.state.cleanup()
+        return total
+
+    async def _archive_chunk(self) -> int:
+        """Move one chunk of expired rows into an archive segment; returns rows removed."""
+        rows = await self.db.get_archivable_links(self.retention_days, self.batch_size)
+        if not rows:
+            return 0
+        # Compression and fsync happen off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.archive.write_segment, rows)
+        await self.db.forget_archived_links(rows[0][0], rows[-1][0], self.retention_days)
+        return len(rows)
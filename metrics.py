@@ -0,0 +1,312 @@
+"""
+Prometheus metrics for X link moderation bot.
+Collects handler, database and Telegram API timings and serves them as text.
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from telegram.request import HTTPXRequest
+
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from a cache hit up to a slow Telegram call
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Deletion batch sizes, up to Telegram's 100 ids per deleteMessages call
+DELETE_BATCH_BUCKETS = (1, 2, 5, 10, 25, 50, 100)
+
+# Database methods timed when metrics are enabled; these cover every query
+DATABASE_METHODS = (
+    '_insert_links',
+    '_count_links',
+    '_fetch_link_timestamps',
+    '_load_link_window',
+    'get_user_links_last_week',
+    '_delete_old_links',
+    '_prune_links_batch',
+    '_prune_rollups',
+    'get_archivable_links',
+    '_forget_archived_links',
+    '_record_rollup',
+    '_reserve_rate',
+    'get_rate_usage',
+    '_prune_rate_state',
+    'get_top_posters',
+    'get_daily_links',
+    '_run_maintenance',
+    '_add_pending_deletion',
+    '_remove_pending_deletions',
+    'get_pending_deletions',
+    'find_recent_posts',
+    'get_recent_posts',
+    '_set_chat_rule',
+    '_delete_chat_rules',
+    'get_chat_rules',
+)
+
+
+def _escape(value: Any) -> str:
+    """Escape a label value for the text exposition format."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    """Render a Prometheus label set such as {method="sendMessage"}."""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1):
+        """Add amount to the series for the given label values."""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        """Render this counter's series."""
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, labels)} {value}" for labels, value in values]
+
+
+class Histogram:
+    """Histogram with fixed buckets and optional labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.buckets = buckets
+        # Per label set: [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        """Record one observation for the given label values."""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = [[0] * (len(self.buckets) + 1), 0.0]
+                self._series[labels] = series
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self) -> List[str]:
+        """Render cumulative buckets, sum and count for every series."""
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        lines = []
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                rendered = _format_labels(self.label_names, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{rendered} {cumulative}")
+            rendered = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{rendered} {total}")
+            lines.append(f"{self.name}_count{rendered} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time."""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+
+    def samples(self) -> List[str]:
+        """Render the current value."""
+        try:
+            return [f"{self.name} {self.read()}"]
+        except Exception as e:
+            logger.debug(f"Could not read gauge {self.name}: {e}")
+            return []
+
+
+class Metrics:
+    """All bot metrics plus the /metrics HTTP server.
+
+    Nothing here runs unless metrics are enabled: handlers, database methods
+    and the Telegram request object are only wrapped when a Metrics instance
+    exists, and the bot skips its counters when it has none.
+    """
+
+    def __init__(self):
+        """Create the metric families."""
+        self._metrics: List[Any] = []
+        self.handler_seconds = self._add(Histogram(
+            'xgate_handler_seconds', 'Update handler latency', ['handler']))
+        self.handler_errors = self._add(Counter(
+            'xgate_handler_errors_total', 'Update handlers that raised', ['handler']))
+        self.scan_seconds = self._add(Histogram(
+            'xgate_scan_seconds', 'Time spent finding X links in a message'))
+        self.db_seconds = self._add(Histogram(
+            'xgate_db_seconds', 'Database method latency', ['method']))
+        self.db_errors = self._add(Counter(
+            'xgate_db_errors_total', 'Database methods that raised', ['method']))
+        self.api_seconds = self._add(Histogram(
+            'xgate_telegram_api_seconds', 'Telegram Bot API request latency', ['method']))
+        self.api_calls = self._add(Counter(
+            'xgate_telegram_api_calls_total', 'Telegram Bot API requests', ['method']))
+        self.api_errors = self._add(Counter(
+            'xgate_telegram_api_errors_total', 'Failed Telegram Bot API requests', ['method', 'error']))
+        self.violations = self._add(Counter(
+            'xgate_violations_total', 'Messages removed for breaking a rule', ['rule']))
+        self.links_allowed = self._add(Counter(
+            'xgate_links_allowed_total', 'X links that passed moderation'))
+        self.repost_lookups = self._add(Counter(
+            'xgate_repost_lookups_total', 'Repost checks per link, by where they were answered', ['source']))
+        self.message_deletes = self._add(Counter(
+            'xgate_message_deletes_total', 'Messages deleted, by request mode and outcome', ['mode', 'result']))
+        self.delete_batch_size = self._add(Histogram(
+            'xgate_delete_batch_size', 'Messages per deletion batch', buckets=DELETE_BATCH_BUCKETS))
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, read: Callable[[], float]):
+        """Register a gauge read on every scrape, e.g. a queue depth."""
+        self._add(Gauge(name, documentation, read))
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    # Instrumentation
+
+    def instrument_handler(self, callback: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        """Wrap a handler callback to record its latency and errors."""
+        name = callback.__name__
+
+        @functools.wraps(callback)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            except Exception:
+                self.handler_errors.inc(name)
+                raise
+            finally:
+                self.handler_seconds.observe(time.perf_counter() - started, name)
+
+        return timed
+
+    def instrument_methods(self, obj: Any, names: Iterable[str]):
+        """Replace methods on an object with timed wrappers recorded under xgate_db_seconds."""
+        for name in names:
+            method = getattr(obj, name)
+            label = name.lstrip('_')
+
+            def timed(*args, _method=method, _label=label, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return _method(*args, **kwargs)
+                except Exception:
+                    self.db_errors.inc(_label)
+                    raise
+                finally:
+                    self.db_seconds.observe(time.perf_counter() - started, _label)
+
+            setattr(obj, name, functools.wraps(method)(timed))
+
+    # HTTP server
+
+    async def start_server(self, host: str, port: int):
+        """Serve GET /metrics on host:port."""
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    async def stop_server(self):
+        """Stop the HTTP server."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answer a single HTTP request and close the connection."""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain headers; the request body is never needed
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, content_type, body = '200 OK', 'text/plain; version=0.0.4; charset=utf-8', self.render()
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain; charset=utf-8', 'Not Found\n'
+
+            payload = body.encode('utf-8')
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode('latin-1') + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records count, latency and errors per Bot API method."""
+
+    def __init__(self, metrics: Metrics, **kwargs: Any):
+        """Create the request object; kwargs are passed to HTTPXRequest."""
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    async def do_request(self, url: str, method: str, *args: Any, **kwargs: Any) -> Tuple[int, bytes]:
+        """Time the HTTP round trip of a single Bot API call."""
+        api_method = url.rsplit('/', 1)[-1]
+        self.metrics.api_calls.inc(api_method)
+        started = time.perf_counter()
+        try:
+            status, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            self.metrics.api_errors.inc(api_method, type(e).__name__)
+            raise
+        finally:
+            self.metrics.api_seconds.observe(time.perf_counter() - started, api_method)
+
+        if status >= 400:
+            self.metrics.api_errors.inc(api_method, str(status))
+        return status, payload
@@ -0,0 +1,281 @@
+"""
+Outbound Telegram request scheduling for X link moderation bot.
+Paces Bot API calls to Telegram's flood limits, most important calls first.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from telegram.error import RetryAfter
+
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Dispatch order of queued calls; lower values go first."""
+
+    DELETE = 0    # Removing violating messages (and the lookups that decide it)
+    WARNING = 1   # Warnings and command replies
+    CLEANUP = 2   # Deleting our own expired warnings
+
+
+class TokenBucket:
+    """Classic token bucket: rate tokens per second, bursting up to capacity."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # Set when Telegram answers 429 for this bucket's scope
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        """Consume a token; call only after delay() returned 0."""
+        self.tokens -= 1
+
+    @property
+    def idle(self) -> bool:
+        """True if the bucket is full and unblocked, i.e. equivalent to a new one."""
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity and time.monotonic() >= self.blocked_until
+
+
+class _Job:
+    """A queued API call and the future its caller waits on."""
+
+    __slots__ = ('priority', 'call', 'chat_id', 'send', 'future', 'deadline', 'attempts')
+
+    def __init__(self, priority: Priority, call: Callable[[], Awaitable[Any]],
+                 chat_id: Optional[int], send: bool, future: asyncio.Future, deadline: Optional[float]):
+        self.priority = priority
+        self.call = call
+        self.chat_id = chat_id
+        # Whether the call posts into chat_id and so spends flood tokens
+        self.send = send and chat_id is not None
+        self.future = future
+        self.deadline = deadline
+        self.attempts = 0
+
+
+class OutboundScheduler:
+    """Single dispatcher for every Bot API call the moderator makes.
+
+    Calls are queued per Priority and dispatched strictly in priority
+    order. Message sends are paced by a global bucket (Telegram allows
+    about 30 messages per second) and a per-chat bucket (about 20 per
+    minute in a group); a send whose chat is out of tokens is skipped over
+    so other chats are not held up. Deletes and lookups are not token
+    limited, but still queue behind higher priorities once max_in_flight
+    calls are running. A RetryAfter (429) on a call about a chat pauses
+    just that chat; only chat-less calls pause everything. Either way the
+    call is retried automatically.
+    """
+
+    def __init__(self, global_rate: float = 30, chat_rate_per_minute: float = 20,
+                 max_in_flight: int = 32, max_retries: int = 3, max_chat_buckets: int = 10000):
+        """Create an idle scheduler; call start() from within the event loop."""
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate_per_minute / 60
+        self.chat_capacity = chat_rate_per_minute
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.max_chat_buckets = max_chat_buckets
+        self._queues: List[Deque[_Job]] = [deque() for _ in Priority]
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.retries = 0
+        self.dropped = 0
+
+    @property
+    def pending(self) -> int:
+        """Number of calls waiting to be dispatched."""
+        return sum(len(queue) for queue in self._queues)
+
+    def start(self):
+        """Start the dispatcher task."""
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, drain_timeout: float = 2.0):
+        """Give queued calls up to drain_timeout seconds, then cancel whatever is left."""
+        if self._task is None:
+            return
+        deadline = time.monotonic() + drain_timeout
+        while (self.pending or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        for queue in self._queues:
+            while queue:
+                queue.popleft().future.cancel()
+
+    def submit(self, priority: Priority, call: Callable[[], Awaitable[Any]],
+               chat_id: Optional[int] = None, max_delay: Optional[float] = None,
+               send: bool = True) -> asyncio.Future:
+        """Queue a Bot API call and return a future for its result.
+
+        call is a zero-argument function returning the awaitable, so retries
+        can issue it again. Pass chat_id for every call about a chat, so a
+        RetryAfter pauses only that chat. Calls that send a message into the
+        chat are also subject to the flood limits; pass send=False for the
+        rest (deletes, lookups). A call still queued after max_delay seconds
+        is cancelled instead of sent late.
+        """
+        future = asyncio.get_running_loop().create_future()
+        now = time.monotonic()
+        deadline = now + max_delay if max_delay is not None else None
+        job = _Job(priority, call, chat_id, send, future, deadline)
+
+        # Fast path: nothing of equal or higher priority is waiting, so skip the queue
+        if self._task is not None and self._can_dispatch_now(job, now):
+            self._dispatch(job)
+        else:
+            self._queues[priority].append(job)
+            self._wakeup.set()
+        return future
+
+    def _can_dispatch_now(self, job: _Job, now: float) -> bool:
+        """Check whether a new job may bypass the queue, taking its tokens if so."""
+        if self._in_flight >= self.max_in_flight or now < self._paused_until:
+            return False
+        if any(self._queues[priority] for priority in range(job.priority + 1)):
+            return False
+        if self._delay(job, now) > 0:
+            return False
+        if job.send:
+            self._chat_bucket(job.chat_id).take()
+            self.global_bucket.take()
+        return True
+
+    def _delay(self, job: _Job, now: float) -> float:
+        """Seconds until a job's chat is unpaused and, for sends, has tokens."""
+        if job.chat_id is None:
+            return 0.0
+        bucket = self._chat_bucket(job.chat_id)
+        if job.send:
+            return max(bucket.delay(now), self.global_bucket.delay(now))
+        return max(0.0, bucket.blocked_until - now)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        """Get a chat's send bucket, forgetting idle buckets when there are too many."""
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.max_chat_buckets:
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items() if not value.idle
+                }
+            bucket = TokenBucket(self.chat_rate, self.chat_capacity)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _dispatch_ready(self, now: float) -> Optional[float]:
+        """Dispatch every job that may run now; return seconds until the next one could."""
+        wait: Optional[float] = None
+
+        def later(delay: float):
+            nonlocal wait
+            wait = delay if wait is None else min(wait, delay)
+
+        if now < self._paused_until:
+            return self._paused_until - now
+
+        for queue in self._queues:
+            index = 0
+            while index < len(queue):
+                if self._in_flight >= self.max_in_flight:
+                    return wait
+                job = queue[index]
+                if job.future.done() or (job.deadline is not None and now > job.deadline):
+                    del queue[index]
+                    if not job.future.done():
+                        self.dropped += 1
+                        job.future.cancel()
+                    continue
+
+                delay = self._delay(job, now)
+                if delay > 0:
+                    # Wake up in time to drop the job if it expires first
+                    later(delay if job.deadline is None else min(delay, job.deadline - now))
+                    index += 1
+                    continue
+                if job.send:
+                    self._chat_bucket(job.chat_id).take()
+                    self.global_bucket.take()
+
+                del queue[index]
+                self._dispatch(job)
+        return wait
+
+    def _dispatch(self, job: _Job):
+        """Start a job's call in its own task."""
+        self._in_flight += 1
+        job.attempts += 1
+        task = asyncio.ensure_future(job.call())
+        task.add_done_callback(lambda done: self._finish(job, done))
+
+    def _finish(self, job: _Job, task: asyncio.Future):
+        """Resolve a job's future, or requeue it after a RetryAfter."""
+        self._in_flight -= 1
+        self._wakeup.set()
+        if job.future.done():
+            return
+        if task.cancelled():
+            job.future.cancel()
+            return
+
+        error = task.exception()
+        if isinstance(error, RetryAfter) and job.attempts <= self.max_retries:
+            retry_after = error.retry_after
+            delay = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+            until = time.monotonic() + delay
+            if job.chat_id is not None:
+                bucket = self._chat_bucket(job.chat_id)
+                bucket.blocked_until = max(bucket.blocked_until, until)
+            else:
+                self._paused_until = max(self._paused_until, until)
+            logger.warning(f"Flood limit hit, retrying in {delay:.0f}s (chat {job.chat_id})")
+            self.retries += 1
+            # Retry ahead of anything queued later at the same priority
+            self._queues[job.priority].appendleft(job)
+        elif error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(task.result())
+
+    async def _run(self):
+        """Dispatch jobs as tokens and in-flight slots allow."""
+        while not self._stopping:
+            self._wakeup.clear()
+            wait = self._dispatch_ready(time.monotonic())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
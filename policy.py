@@ -0,0 +1,287 @@
+"""
+Per-chat moderation policy for X link moderation bot.
+Compiles global rules and per-chat overrides into immutable snapshots.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Callable, Dict, Mapping, NamedTuple, Optional
+
+from config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_bool(value: Any) -> bool:
+    """Parse a rule value given as a bool or as on/off text."""
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('1', 'true', 'yes', 'on'):
+        return True
+    if text in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError(f"expected on/off, got {value!r}")
+
+
+def _parse_count(value: Any) -> int:
+    """Parse a non-negative integer rule value."""
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        raise ValueError(f"expected a whole number, got {value!r}") from None
+    if number < 0:
+        raise ValueError(f"expected a number of 0 or more, got {value!r}")
+    return number
+
+
+# What happens to a post already shared in the chat
+REPOST_MODES = ('off', 'flag', 'block')
+
+
+def _parse_repost(value: Any) -> str:
+    """Parse the repost rule: off, flag or block."""
+    if value is False:
+        return 'off'
+    text = str(value).strip().lower()
+    if text not in REPOST_MODES:
+        raise ValueError(f"expected one of {', '.join(REPOST_MODES)}, got {value!r}")
+    return text
+
+
+# Rules a chat may override, with the parser for each value
+RULE_PARSERS: Dict[str, Callable[[Any], Any]] = {
+    'max_links_per_week': _parse_count,
+    'require_context': _parse_bool,
+    'min_context_length': _parse_count,
+    'count_per_link': _parse_bool,
+    'repost': _parse_repost,
+    'repost_window_hours': _parse_count,
+}
+
+
+def parse_rule(name: str, value: Any) -> Any:
+    """Validate a rule name and parse its value; raises ValueError if either is invalid."""
+    parser = RULE_PARSERS.get(name)
+    if parser is None:
+        raise ValueError(f"unknown rule {name!r} (choose from {', '.join(RULE_PARSERS)})")
+    try:
+        return parser(value)
+    except ValueError as e:
+        raise ValueError(f"invalid value for {name}: {e}") from None
+
+
+class ChatPolicy(NamedTuple):
+    """Effective rules for one chat, with warning texts formatted up front."""
+
+    max_links_per_week: int
+    require_context: bool
+    min_context_length: int
+    count_per_link: bool
+    repost: str
+    repost_window: int
+    rate_limit_text: str
+    no_context_text: str
+    approaching_limit_message: str
+    repost_message: str
+    overridden: frozenset
+
+    @classmethod
+    def compile(cls, config: Config, overrides: Optional[Mapping[str, Any]] = None) -> 'ChatPolicy':
+        """Build a snapshot from the global config and a chat's stored overrides."""
+        rules = {
+            'max_links_per_week': config.max_links_per_week,
+            'require_context': config.require_context,
+            'min_context_length': config.min_context_length,
+            'count_per_link': config.count_per_link,
+            'repost': config.repost_rule,
+            'repost_window_hours': config.repost_window_hours,
+        }
+        for name, value in (overrides or {}).items():
+            try:
+                rules[name] = parse_rule(name, value)
+            except ValueError as e:
+                logger.warning(f"Ignoring stored chat rule: {e}")
+
+        return cls(
+            max_links_per_week=rules['max_links_per_week'],
+            require_context=rules['require_context'],
+            min_context_length=rules['min_context_length'],
+            count_per_link=rules['count_per_link'],
+            repost=rules['repost'],
+            repost_window=rules['repost_window_hours'] * 3600,
+            rate_limit_text=config.rate_limit_message.format(max=rules['max_links_per_week']),
+            no_context_text=config.no_context_message.format(min=rules['min_context_length']),
+            approaching_limit_message=config.approaching_limit_message,
+            repost_message=config.repost_message,
+            overridden=frozenset(name for name in (overrides or {}) if name in RULE_PARSERS),
+        )
+
+    def lacks_context(self, context_length: int) -> bool:
+        """Check whether the text around a message's links is too short."""
+        return self.require_context and context_length < self.min_context_length
+
+    def counted_links(self, link_count: int) -> int:
+        """Number of a message's links that count against the weekly quota."""
+        return link_count if self.count_per_link else min(link_count, 1)
+
+    def over_quota(self, links_in_window: int, counted: int) -> bool:
+        """Check whether counted more links would exceed the weekly quota."""
+        return links_in_window + counted > self.max_links_per_week
+
+
+def decide(policy: ChatPolicy, context_length: int, link_count: int,
+           links_in_window: int, reposted: bool) -> Optional[str]:
+    """Name the rule a message with X links breaks, or None if it is allowed.
+
+    Applies the checks in the order XLinkModerator does: context, then
+    reposts, then the weekly quota. reposted says whether one of its posts
+    was shared in the chat within the policy's repost window. The result
+    matches the violations metric labels (no_context, repost, rate_limit).
+    """
+    if policy.lacks_context(context_length):
+        return 'no_context'
+    if reposted and policy.repost == 'block':
+        return 'repost'
+    if policy.over_quota(links_in_window, policy.counted_links(link_count)):
+        return 'rate_limit'
+    return None
+
+
+class PolicyEngine:
+    """Lookup table of compiled ChatPolicy snapshots.
+
+    Chats without overrides share the default snapshot. Every change builds
+    a new table and swaps it in with a single assignment, so a handler that
+    already fetched a policy keeps a consistent view while others see the
+    new rules on their next lookup.
+    """
+
+    def __init__(self, config: Config):
+        """Compile the global rules; per-chat overrides are added with load()."""
+        self.config = config
+        self._overrides: Dict[int, Dict[str, Any]] = {}
+        self._default = ChatPolicy.compile(config)
+        self._policies: Dict[int, ChatPolicy] = {}
+
+    def for_chat(self, chat_id: int) -> ChatPolicy:
+        """Get the effective policy for a chat."""
+        return self._policies.get(chat_id, self._default)
+
+    def overrides(self, chat_id: int) -> Dict[str, Any]:
+        """Get a copy of a chat's stored overrides."""
+        return dict(self._overrides.get(chat_id, {}))
+
+    def load(self, overrides: Mapping[int, Mapping[str, Any]]):
+        """Replace all per-chat overrides (e.g. from the database at startup)."""
+        self._overrides = {chat_id: dict(rules) for chat_id, rules in overrides.items() if rules}
+        self._rebuild()
+
+    def reload(self, config: Config):
+        """Recompile every snapshot against a new global config."""
+        self.config = config
+        self._rebuild()
+
+    def set_overrides(self, chat_id: int, rules: Mapping[str, Any]):
+        """Replace one chat's overrides and swap in its new snapshot."""
+        overrides = dict(self._overrides)
+        policies = dict(self._policies)
+        if rules:
+            overrides[chat_id] = dict(rules)
+            policies[chat_id] = ChatPolicy.compile(self.config, rules)
+        else:
+            overrides.pop(chat_id, None)
+            policies.pop(chat_id, None)
+        self._overrides = overrides
+        self._policies = policies
+
+    def max_repost_window(self) -> int:
+        """Longest repost window of any chat with repost detection on (0 if none)."""
+        policies = [self._default, *self._policies.values()]
+        return max((policy.repost_window for policy in policies if policy.repost != 'off'), default=0)
+
+    def _rebuild(self):
+        """Compile all snapshots and swap them in together."""
+        default = ChatPolicy.compile(self.config)
+        policies = {
+            chat_id: ChatPolicy.compile(self.config, rules)
+            for chat_id, rules in self._overrides.items()
+        }
+        self._default, self._policies = default, policies
+
+
+class ConfigWatcher:
+    """Polls config.yml for changes and reloads it in the background.
+
+    Only the modification time is checked, so polling is a single stat()
+    call. An edit that fails validation, or whose rules fail to compile, is
+    logged and the previous configuration stays in effect.
+    """
+
+    def __init__(self, config: Config, on_reload: Callable[[Config], None], interval: float = 5.0):
+        """Watch config.config_path; call start() from within the event loop."""
+        self.config = config
+        self.on_reload = on_reload
+        self.interval = interval
+        self._mtime = self._current_mtime()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def _current_mtime(self) -> Optional[float]:
+        """Get the config file's modification time, or None if it does not exist."""
+        try:
+            return os.stat(self.config.config_path).st_mtime
+        except OSError:
+            return None
+
+    def start(self):
+        """Start polling."""
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop polling."""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+    async def _run(self):
+        """Reload whenever the modification time changes."""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                break
+
+            mtime = self._current_mtime()
+            if mtime is None or mtime == self._mtime:
+                continue
+            self._mtime = mtime
+            try:
+                self.check()
+            except Exception as e:
+                # Keep polling: the next edit may well fix it
+                logger.error(f"Failed to reload {self.config.config_path}: {e}", exc_info=True)
+
+    def check(self):
+        """Reload the config file now, keeping the old settings if it is invalid.
+
+        on_reload compiles the new rules before swapping them in, so if it
+        raises nothing has changed yet and the previous settings are restored.
+        """
+        previous = self.config.config
+        try:
+            self.config.reload()
+            self.on_reload(self.config)
+        except Exception as e:
+            self.config.config = previous
+            logger.error(f"Not applying changed {self.config.config_path}: {e}")
+            return
+        logger.info(f"Reloaded {self.config.config_path}")
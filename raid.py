@@ -0,0 +1,211 @@
+"""
+Raid handling for X link moderation bot.
+Folds bursts of violations into one summary warning per chat.
+"""
+
+import asyncio
+import html
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+
+from telegram import Message
+from telegram.error import TelegramError
+
+from outbound import OutboundScheduler, Priority
+from scheduler import DeletionScheduler
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Raid:
+    """Summary state for one chat that is currently in raid mode."""
+
+    __slots__ = ('chat_id', 'users', 'removed', 'summary', 'sending', 'dirty', 'last_violation', 'task')
+
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        # user_id -> [mention html, messages removed]
+        self.users: 'OrderedDict[int, List]' = OrderedDict()
+        self.removed = 0
+        self.summary: Optional[Message] = None
+        self.sending = False
+        self.dirty = False
+        self.last_violation = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+
+class RaidGuard:
+    """Per-chat burst detector that replaces individual warnings with one summary.
+
+    Violations are counted over a sliding window of window seconds. Once a
+    chat reaches threshold violations in that window it enters raid mode:
+    offending messages are still deleted, but instead of one warning each,
+    a single summary listing the affected users is posted and then edited
+    in place (at most once per edit_interval). When no violation has
+    arrived for quiet seconds, the summary is deleted and the chat returns
+    to normal warnings.
+    """
+
+    # Mentions listed in a summary before it switches to "and N more"
+    MAX_LISTED_USERS = 15
+
+    def __init__(self, outbound: OutboundScheduler, deletions: DeletionScheduler,
+                 threshold: int = 5, window: float = 10.0, quiet: float = 30.0,
+                 edit_interval: float = 3.0):
+        """Create a guard; chats are tracked on demand."""
+        self.outbound = outbound
+        self.deletions = deletions
+        self.threshold = threshold
+        self.window = window
+        self.quiet = quiet
+        self.edit_interval = edit_interval
+        self._recent: Dict[int, Deque[float]] = {}
+        self._raids: Dict[int, _Raid] = {}
+
+    @property
+    def active(self) -> int:
+        """Number of chats currently in raid mode."""
+        return len(self._raids)
+
+    def absorb(self, message: Message) -> bool:
+        """Record a violation; return True if it was folded into a raid summary.
+
+        When this returns False the caller should warn the user as usual.
+        """
+        chat_id = message.chat_id
+        now = time.monotonic()
+
+        raid = self._raids.get(chat_id)
+        if raid is None:
+            recent = self._recent.get(chat_id)
+            if recent is None:
+                recent = self._recent[chat_id] = deque()
+            recent.append(now)
+            while recent and now - recent[0] > self.window:
+                recent.popleft()
+            if len(recent) < self.threshold:
+                self._forget_quiet_chats(now)
+                return False
+
+            del self._recent[chat_id]
+            raid = self._raids[chat_id] = _Raid(chat_id)
+            raid.task = asyncio.create_task(self._run(raid, message.get_bot()))
+            logger.warning(f"Raid mode on in chat {chat_id}: {self.threshold} violations in {self.window:.0f}s")
+
+        user = message.from_user
+        entry = raid.users.get(user.id)
+        if entry is None:
+            raid.users[user.id] = [user.mention_html(), 1]
+        else:
+            entry[1] += 1
+        raid.removed += 1
+        raid.last_violation = now
+        raid.dirty = True
+
+        if raid.summary is None and not raid.sending:
+            self._send_summary(raid, message.get_bot())
+        return True
+
+    def _forget_quiet_chats(self, now: float):
+        """Drop sliding windows that have emptied out, so memory tracks active chats."""
+        if len(self._recent) > 1000:
+            self._recent = {
+                chat_id: recent for chat_id, recent in self._recent.items()
+                if recent and now - recent[-1] <= self.window
+            }
+
+    def summary_text(self, raid: _Raid) -> str:
+        """Render the summary message (HTML)."""
+        listed = list(raid.users.values())[:self.MAX_LISTED_USERS]
+        mentions = ', '.join(
+            mention if count == 1 else f"{mention} ({count})" for mention, count in listed
+        )
+        more = len(raid.users) - len(listed)
+        if more > 0:
+            mentions += html.escape(f" and {more} more")
+        return (
+            f"🚨 <b>Raid mode</b>: removed {raid.removed} message(s) that broke the X link rules.\n"
+            f"{mentions}\n\n"
+            "Type /rules to see this chat's limits."
+        )
+
+    def _send_summary(self, raid: _Raid, bot):
+        """Post the summary message in the background."""
+        raid.sending = True
+        raid.dirty = False
+        text = self.summary_text(raid)
+        future = self.outbound.submit(
+            Priority.WARNING,
+            lambda: bot.send_message(raid.chat_id, text, parse_mode='HTML'),
+            chat_id=raid.chat_id
+        )
+
+        def sent(done: asyncio.Future):
+            raid.sending = False
+            if done.cancelled():
+                raid.dirty = True
+                return
+            if done.exception() is not None:
+                logger.error(f"Failed to post raid summary in chat {raid.chat_id}: {done.exception()}")
+                raid.dirty = True
+                return
+            raid.summary = done.result()
+            if raid.task is None:
+                # The raid already ended while the summary was queued
+                self.deletions.schedule(raid.summary.chat_id, raid.summary.message_id, 0)
+
+        future.add_done_callback(sent)
+
+    async def _edit_summary(self, raid: _Raid, bot):
+        """Bring the posted summary up to date."""
+        raid.dirty = False
+        summary = raid.summary
+        text = self.summary_text(raid)
+        try:
+            await self.outbound.submit(
+                Priority.WARNING,
+                lambda: bot.edit_message_text(
+                    text, chat_id=summary.chat_id, message_id=summary.message_id, parse_mode='HTML'
+                ),
+                chat_id=raid.chat_id
+            )
+        except TelegramError as e:
+            # Most likely deleted by an admin; post a fresh one next time
+            logger.debug(f"Could not edit raid summary in chat {raid.chat_id}: {e}")
+            raid.summary = None
+            raid.dirty = True
+
+    async def _run(self, raid: _Raid, bot):
+        """Keep the summary current and end the raid once the chat has been quiet."""
+        try:
+            while True:
+                await asyncio.sleep(self.edit_interval)
+                if time.monotonic() - raid.last_violation >= self.quiet:
+                    break
+                if raid.dirty and not raid.sending:
+                    if raid.summary is not None:
+                        await self._edit_summary(raid, bot)
+                    else:
+                        # The first summary could not be posted or was deleted
+                        self._send_summary(raid, bot)
+        finally:
+            self._end(raid)
+
+    def _end(self, raid: _Raid):
+        """Leave raid mode and clean up the summary."""
+        raid.task = None
+        self._raids.pop(raid.chat_id, None)
+        logger.info(f"Raid mode off in chat {raid.chat_id}: removed {raid.removed} message(s) "
+                    f"from {len(raid.users)} user(s)")
+        if raid.summary is not None:
+            self.deletions.schedule(raid.summary.chat_id, raid.summary.message_id, 0)
+
+    async def stop(self):
+        """End every raid now, scheduling its summary for deletion."""
+        tasks = [raid.task for raid in self._raids.values() if raid.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
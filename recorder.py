@@ -0,0 +1,162 @@
+"""
+Update recording for X link moderation bot.
+Appends what moderation decisions depend on to a compact binary log that
+simulate.py can replay offline.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import struct
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# XGR1 logs stored post hashes sorted and deduplicated, losing which were counted
+MAGIC = b'XGR2'
+# chat_id, user_id, timestamp, link count, context length, canonical id count
+RECORD = struct.Struct('<qqIHHB')
+READ_CHUNK = 1 << 22
+
+
+# One message with X links, as the moderator saw it: chat_id, user_id,
+# timestamp, link count, context length and the 64-bit hashes of its
+# canonical post ids in link order (for repost checks; the bot marks only
+# the counted links' posts as shared)
+RecordedMessage = Tuple[int, int, int, int, int, Tuple[int, ...]]
+
+
+def post_hash(canonical_id: str) -> int:
+    """Stable 64-bit hash of a canonical post id."""
+    return int.from_bytes(hashlib.blake2b(canonical_id.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def encode_message(chat_id: int, user_id: int, timestamp: int, link_count: int,
+                   context_length: int, canonical_ids: Iterable[str]) -> bytes:
+    """Pack one message into its log record, keeping its posts in link order."""
+    posts = [post_hash(canonical_id) for canonical_id in canonical_ids][:255]
+    return RECORD.pack(
+        chat_id, user_id, timestamp, min(link_count, 0xFFFF), min(context_length, 0xFFFF), len(posts)
+    ) + struct.pack(f'<{len(posts)}Q', *posts)
+
+
+def read_log(paths: Sequence[str]) -> Iterator[List[RecordedMessage]]:
+    """Stream recorded messages from one or more log files, in file order.
+
+    Messages come in batches, one per chunk read from disk, so consumers can
+    run their own tight loop over each batch. A record cut short by a crash
+    at the end of a file is skipped.
+    """
+    record_size = RECORD.size
+    count_offset = record_size - 1
+    # One Struct per post count, so a whole record is a single unpack
+    formats = [struct.Struct(RECORD.format + 'Q' * count) for count in range(256)]
+    for path in paths:
+        with open(path, 'rb') as f:
+            header = f.read(len(MAGIC))
+            if header == b'XGR1':
+                raise ValueError(f"{path} was recorded by an older version whose posts cannot be replayed "
+                                 f"exactly; record a new log")
+            if header != MAGIC:
+                raise ValueError(f"{path} is not an update log")
+            buffer = b''
+            while True:
+                chunk = f.read(READ_CHUNK)
+                if not chunk:
+                    break
+                buffer = buffer + chunk if buffer else chunk
+                offset = 0
+                end = len(buffer)
+                batch = []
+                append = batch.append
+                while offset + record_size <= end:
+                    record = formats[buffer[offset + count_offset]]
+                    if offset + record.size > end:
+                        break
+                    values = record.unpack_from(buffer, offset)
+                    append((values[0], values[1], values[2], values[3], values[4], values[6:]))
+                    offset += record.size
+                buffer = buffer[offset:]
+                yield batch
+            if buffer:
+                logger.warning(f"Ignoring {len(buffer)} trailing byte(s) of a partial record in {path}")
+
+
+class UpdateRecorder:
+    """Opt-in append-only log of every message with X links.
+
+    record() only packs the message into an in-memory buffer; a background
+    task appends the buffer to the file every flush_interval seconds, off
+    the event loop, so recording never waits on disk. Records are about
+    25 bytes plus 8 per link.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0):
+        """Create an idle recorder; call start() from within the event loop."""
+        self.path = path
+        self.flush_interval = flush_interval
+        self.recorded = 0
+        self._buffer: List[bytes] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def start(self):
+        """Open the log (writing its header if new) and start the flush task.
+
+        A log in an older format is renamed to <path>.old first, so new
+        records never land in a file that says otherwise.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                header = f.read(len(MAGIC))
+            if header and header != MAGIC:
+                os.replace(self.path, self.path + '.old')
+                logger.warning(f"Moved update log in an older format to {self.path}.old")
+        with open(self.path, 'ab') as f:
+            if f.tell() == 0:
+                f.write(MAGIC)
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the task and write out whatever is still buffered."""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+    def record(self, chat_id: int, user_id: int, timestamp: int, link_count: int,
+               context_length: int, canonical_ids: Iterable[str]):
+        """Queue one message for the log."""
+        self._buffer.append(encode_message(chat_id, user_id, timestamp, link_count, context_length, canonical_ids))
+        self.recorded += 1
+
+    async def flush(self):
+        """Append buffered records to the log."""
+        if not self._buffer:
+            return
+        data = b''.join(self._buffer)
+        self._buffer = []
+        await asyncio.get_running_loop().run_in_executor(None, self._append, data)
+
+    def _append(self, data: bytes):
+        with open(self.path, 'ab') as f:
+            f.write(data)
+
+    async def _run(self):
+        """Flush periodically until stopped, then once more."""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except OSError as e:
+                logger.error(f"Failed to write update log {self.path}: {e}")
@@ -0,0 +1,292 @@
+"""
+Scheduled message deletion for X link moderation bot.
+Lets handlers hand off "delete this in N seconds" and return immediately,
+and folds deletions in the same chat into bulk deleteMessages calls.
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+from typing import Any, Awaitable, Dict, List, Optional, Set, Tuple
+
+from telegram import Bot
+from telegram.error import TelegramError
+
+from async_database import AsyncDatabase
+from outbound import OutboundScheduler, Priority
+
+
+logger = logging.getLogger(__name__)
+
+
+class DeletionBatcher:
+    """Collects message deletions per chat and sends them as bulk requests.
+
+    The first deletion for a chat opens a batch that is flushed window
+    seconds later, or as soon as it holds MAX_BATCH ids, as a single
+    deleteMessages call through the outbound scheduler. Batches are kept
+    per priority, so violation deletes never wait for a cleanup batch. If
+    the bulk call fails, each message is retried with its own deleteMessage
+    so one undeletable message does not keep the others around.
+    """
+
+    # Telegram accepts at most 100 ids per deleteMessages call
+    MAX_BATCH = 100
+
+    def __init__(self, outbound: OutboundScheduler, window: float = 0.1, metrics: Optional[Any] = None):
+        """Create an idle batcher; call start() once the bot is available."""
+        self.outbound = outbound
+        self.window = window
+        self.metrics = metrics
+        self.bot: Optional[Bot] = None
+        self._batches: Dict[Tuple[int, Priority], List[Tuple[int, asyncio.Future]]] = {}
+        self._timers: Dict[Tuple[int, Priority], asyncio.TimerHandle] = {}
+        self._sending: Set[asyncio.Task] = set()
+        self.bulk_requests = 0
+        self.fallbacks = 0
+
+    @property
+    def pending(self) -> int:
+        """Number of deletions waiting for their batch to be flushed."""
+        return sum(len(batch) for batch in self._batches.values())
+
+    def start(self, bot: Bot):
+        """Set the bot used for deleting."""
+        self.bot = bot
+
+    async def stop(self):
+        """Flush every open batch now and wait for the requests to finish."""
+        for key in list(self._batches):
+            self._flush(key)
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+
+    def delete(self, chat_id: int, message_id: int, priority: Priority = Priority.CLEANUP) -> asyncio.Future:
+        """Queue a message for deletion; the future resolves once the request completes."""
+        future = asyncio.get_running_loop().create_future()
+        key = (chat_id, priority)
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = []
+            self._timers[key] = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+        batch.append((message_id, future))
+        if len(batch) >= self.MAX_BATCH:
+            self._flush(key)
+        return future
+
+    def _flush(self, key: Tuple[int, Priority]):
+        """Close a batch and send it in the background."""
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._batches.pop(key, None)
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._send(key[0], key[1], batch))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, chat_id: int, priority: Priority, batch: List[Tuple[int, asyncio.Future]]):
+        """Delete a batch with one request, falling back to one request per message."""
+        if self.metrics is not None:
+            self.metrics.delete_batch_size.observe(len(batch))
+        if len(batch) == 1:
+            await self._send_single(chat_id, priority, batch, 'single')
+            return
+
+        message_ids = [message_id for message_id, _ in batch]
+        self.bulk_requests += 1
+        try:
+            await self.outbound.submit(
+                priority, lambda: self.bot.delete_messages(chat_id, message_ids), chat_id=chat_id, send=False
+            )
+        except TelegramError as e:
+            self.fallbacks += 1
+            logger.warning(f"Bulk delete of {len(batch)} message(s) in chat {chat_id} failed ({e}), "
+                           f"deleting them one by one")
+            await self._send_single(chat_id, priority, batch, 'fallback')
+            return
+        except asyncio.CancelledError:
+            # The outbound scheduler shut down before the call went out
+            for _, future in batch:
+                future.cancel()
+            return
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self._count('bulk', 'ok', len(batch))
+        for _, future in batch:
+            if not future.done():
+                future.set_result(True)
+
+    async def _send_single(self, chat_id: int, priority: Priority,
+                           batch: List[Tuple[int, asyncio.Future]], mode: str):
+        """Delete each message of a batch with its own request."""
+        calls = [
+            self.outbound.submit(
+                priority, lambda message_id=message_id: self.bot.delete_message(chat_id=chat_id, message_id=message_id),
+                chat_id=chat_id, send=False
+            )
+            for message_id, _ in batch
+        ]
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        for (_, future), result in zip(batch, results):
+            self._count(mode, 'failed' if isinstance(result, BaseException) else 'ok')
+            if future.done():
+                continue
+            if isinstance(result, asyncio.CancelledError):
+                future.cancel()
+            elif isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _count(self, mode: str, result: str, amount: int = 1):
+        """Record deletions in the metrics, if enabled."""
+        if self.metrics is not None:
+            self.metrics.message_deletes.inc(mode, result, amount=amount)
+
+
+class DeletionScheduler:
+    """Heap-based timer that deletes messages when they fall due.
+
+    Pending deletions are persisted in SQLite so warnings still get cleaned
+    up after a restart. Expired items are flushed in batches of up to
+    batch_size, and their database rows are removed in a single write.
+    Deletes go through the deletion batcher, if given, at cleanup priority
+    so they never delay moderation and share bulk requests per chat.
+    A delete that fails for any reason other than a Telegram error (or is
+    cancelled, e.g. at shutdown) stays persisted and is retried after
+    RETRY_DELAY seconds.
+    """
+
+    # Seconds before a delete that failed unexpectedly is tried again
+    RETRY_DELAY = 60
+
+    def __init__(self, database: AsyncDatabase, deleter: Optional[DeletionBatcher] = None,
+                 batch_size: int = 100):
+        """Create an idle scheduler; call start() once the bot is available."""
+        self.db = database
+        self.deleter = deleter
+        self.batch_size = batch_size
+        self.bot: Optional[Bot] = None
+        self._heap: List[Tuple[float, int, int]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._pending_writes: Set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> int:
+        """Number of deletions waiting to fall due."""
+        return len(self._heap)
+
+    async def start(self, bot: Bot):
+        """Load persisted deletions and start the timer task."""
+        self.bot = bot
+        self._stopping = False
+        for item in await self.db.get_pending_deletions():
+            heapq.heappush(self._heap, item)
+        if self._heap:
+            logger.info(f"Restored {len(self._heap)} pending message deletion(s)")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the timer task; unflushed deletions stay persisted for the next start."""
+        if self._task is not None:
+            # Ask the loop to exit rather than cancelling it mid-flush
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        if self._pending_writes:
+            await asyncio.gather(*self._pending_writes, return_exceptions=True)
+
+    def schedule(self, chat_id: int, message_id: int, delay: float):
+        """Delete a message after delay seconds. Returns immediately."""
+        due_at = time.time() + delay
+        heapq.heappush(self._heap, (due_at, chat_id, message_id))
+        self._wakeup.set()
+        self._spawn_write(self.db.add_pending_deletion(chat_id, message_id, due_at))
+
+    def _spawn_write(self, coro):
+        """Run a persistence write in the background, keeping a reference until it finishes."""
+        task = asyncio.ensure_future(coro)
+        self._pending_writes.add(task)
+        task.add_done_callback(self._pending_writes.discard)
+
+    async def _run(self):
+        """Sleep until the earliest deletion is due, then flush everything that expired."""
+        while not self._stopping:
+            if not self._heap:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            now = time.time()
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+                _, chat_id, message_id = heapq.heappop(self._heap)
+                due.append((chat_id, message_id))
+
+            try:
+                await self._flush(due)
+            except Exception as e:
+                logger.error(f"Failed to flush scheduled deletions: {e}")
+
+    async def _flush(self, due: List[Tuple[int, int]]):
+        """Delete a batch of expired messages and forget the finished ones in one database write."""
+        try:
+            results = await asyncio.gather(
+                *(self._delete(chat_id, message_id) for chat_id, message_id in due),
+                return_exceptions=True
+            )
+        except asyncio.CancelledError:
+            # The timer task itself is being cancelled; the rows stay persisted
+            self._retry(due)
+            raise
+
+        finished = []
+        failed = []
+        for (chat_id, message_id), result in zip(due, results):
+            if isinstance(result, TelegramError):
+                # Already gone, too old, or not ours to delete: retrying will not help
+                logger.debug(f"Could not delete message {message_id} in chat {chat_id}: {result}")
+            elif isinstance(result, asyncio.CancelledError):
+                failed.append((chat_id, message_id))
+                continue
+            elif isinstance(result, BaseException):
+                logger.warning(f"Deleting message {message_id} in chat {chat_id} failed ({result!r}), "
+                               f"retrying in {self.RETRY_DELAY}s")
+                failed.append((chat_id, message_id))
+                continue
+            finished.append((chat_id, message_id))
+
+        self._retry(failed)
+        if finished:
+            await self.db.remove_pending_deletions(finished)
+
+    def _retry(self, messages: List[Tuple[int, int]]):
+        """Put deletions back on the heap to be tried again after RETRY_DELAY seconds."""
+        due_at = time.time() + self.RETRY_DELAY
+        for chat_id, message_id in messages:
+            heapq.heappush(self._heap, (due_at, chat_id, message_id))
+
+    def _delete(self, chat_id: int, message_id: int) -> Awaitable[bool]:
+        """Delete one message, batched with others in the chat when there is a batcher."""
+        if self.deleter is None:
+            return self.bot.delete_message(chat_id=chat_id, message_id=message_id)
+        return self.deleter.delete(chat_id, message_id, Priority.CLEANUP)
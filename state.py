@@ -0,0 +1,334 @@
+"""
+Link quota state backends for X link moderation bot.
+Lets several bot workers share weekly link counts, and the posts behind
+them for repost checks, through a common store.
+"""
+
+import logging
+import secrets
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from async_database import AsyncDatabase
+from database import LINK_WINDOW_SECONDS
+from link_scanner import canonical_link
+
+
+logger = logging.getLogger(__name__)
+
+
+class StateBackend(ABC):
+    """Where the per-user link windows that enforce the weekly quota live.
+
+    Every method is keyed by chat, so a backend can be split across workers
+    (or Redis cluster nodes) by chat_id. message_id makes a reservation
+    idempotent where the backend supports it: recording the same message
+    twice, e.g. after a webhook redelivery, returns the first decision
+    instead of counting the links again.
+
+    Every recorded link is also remembered as a shared post, under its
+    canonical_link(), for repost checks.
+    """
+
+    @abstractmethod
+    async def add_links(self, user_id: int, link_urls: List[str], chat_id: int,
+                        message_id: Optional[int] = None):
+        """Record links posted by a user without checking the quota."""
+
+    @abstractmethod
+    async def count_links(self, user_id: int, chat_id: int) -> int:
+        """Count a user's links in the current window."""
+
+    @abstractmethod
+    async def reserve_links(self, user_id: int, link_urls: List[str], chat_id: int,
+                            max_links: int, message_id: Optional[int] = None) -> Tuple[bool, int]:
+        """Atomically check the quota and record links if they fit; returns (allowed, count_before)."""
+
+    @abstractmethod
+    async def cleanup(self) -> int:
+        """Remove expired state kept outside link_history; returns the number of entries removed.
+
+        Called by RetentionJob on every pass, after it has pruned (or
+        archived) link_history itself.
+        """
+
+    @abstractmethod
+    async def find_posts(self, chat_id: int, canonical_ids: Iterable[str],
+                         since: float) -> Dict[str, Tuple[int, int]]:
+        """Get the latest (timestamp, user_id) after since for each post already recorded in a chat."""
+
+    async def recent_posts(self, since: float) -> Optional[List[Tuple[int, str, int, int]]]:
+        """Get (chat_id, canonical_id, timestamp, user_id) for every post recorded after since, oldest first.
+
+        Returns None if the backend cannot list them cheaply; callers then
+        ask find_posts() instead.
+        """
+        return None
+
+    async def close(self):
+        """Release connections held by the backend."""
+
+
+class SQLiteBackend(StateBackend):
+    """Link state in the bot's own SQLite database (a single worker per file).
+
+    A process only sees each update once, so message_id is not needed for
+    idempotency here. Several workers can still use this backend as long
+    as each owns a disjoint set of chats and its own database file.
+    """
+
+    def __init__(self, database: AsyncDatabase):
+        """Use the link_history table behind an AsyncDatabase."""
+        self.db = database
+
+    async def add_links(self, user_id: int, link_urls: List[str], chat_id: int,
+                        message_id: Optional[int] = None):
+        """Record links posted by a user without checking the quota."""
+        await self.db.add_links(user_id, link_urls, chat_id)
+
+    async def count_links(self, user_id: int, chat_id: int) -> int:
+        """Count a user's links in the current window."""
+        return await self.db.count_user_links_last_week(user_id, chat_id)
+
+    async def reserve_links(self, user_id: int, link_urls: List[str], chat_id: int,
+                            max_links: int, message_id: Optional[int] = None) -> Tuple[bool, int]:
+        """Atomically check the quota and record links if they fit; returns (allowed, count_before)."""
+        return await self.db.reserve_links(user_id, link_urls, chat_id, max_links)
+
+    async def cleanup(self) -> int:
+        """Nothing to do: all state is in link_history."""
+        return 0
+
+    async def find_posts(self, chat_id: int, canonical_ids: Iterable[str],
+                         since: float) -> Dict[str, Tuple[int, int]]:
+        """Look up posts in link_history."""
+        return await self.db.find_recent_posts(chat_id, canonical_ids, int(since))
+
+    async def recent_posts(self, since: float) -> Optional[List[Tuple[int, str, int, int]]]:
+        """Read every post recorded after since from link_history."""
+        return await self.db.get_recent_posts(int(since))
+
+
+class GCRABackend(SQLiteBackend):
+    """Link quotas as one GCRA state row per (chat, user) in SQLite.
+
+    Instead of counting a week of link_history rows, each check is a single
+    UPSERT on rate_limit_state, so its cost does not grow with a user's
+    activity. The quota becomes a smooth one: a user may post max_links
+    links at once, and after that regains one every week / max_links,
+    rather than each link expiring exactly a week after it was posted.
+    Links recorded without a check (add_links) use default_limit for
+    their spacing.
+    """
+
+    def __init__(self, database: AsyncDatabase, default_limit: int = 3):
+        """Use the rate_limit_state table behind an AsyncDatabase."""
+        super().__init__(database)
+        self.default_limit = default_limit
+
+    async def add_links(self, user_id: int, link_urls: List[str], chat_id: int,
+                        message_id: Optional[int] = None):
+        """Record links posted by a user without checking the quota."""
+        await self.db.reserve_rate(user_id, link_urls, chat_id, max(self.default_limit, 1), enforce=False)
+
+    async def count_links(self, user_id: int, chat_id: int) -> int:
+        """Count the links currently held against a user's quota."""
+        return await self.db.get_rate_usage(user_id, chat_id)
+
+    async def reserve_links(self, user_id: int, link_urls: List[str], chat_id: int,
+                            max_links: int, message_id: Optional[int] = None) -> Tuple[bool, int]:
+        """Atomically check the quota and record links if they fit; returns (allowed, count_before)."""
+        return await self.db.reserve_rate(user_id, link_urls, chat_id, max_links)
+
+    async def cleanup(self) -> int:
+        """Delete state rows that have fully drained."""
+        return await self.db.prune_rate_state()
+
+
+# Sliding-window reservation, run atomically on the Redis server.
+# KEYS[1]: the user's window, a sorted set of links scored by post time
+# KEYS[2]: the chat's shared posts, a sorted set of canonical ids scored by post time
+# KEYS[3]: the chat's posters, a hash of canonical id to the user who shared it last
+# KEYS[4] (optional): the message's recorded decision, for idempotency
+# ARGV: now, window start, max links (-1 = no limit), ttl seconds, post ttl seconds,
+#       user id, then one member per link followed by one canonical id per link
+RESERVE_SCRIPT = """
+if #KEYS > 3 then
+  local decided = redis.call('GET', KEYS[4])
+  if decided then
+    local sep = string.find(decided, ':')
+    return {tonumber(string.sub(decided, 1, sep - 1)), tonumber(string.sub(decided, sep + 1))}
+  end
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+local current = redis.call('ZCARD', KEYS[1])
+local limit = tonumber(ARGV[3])
+local links = (#ARGV - 6) / 2
+local allowed = 0
+if limit < 0 or current + links <= limit then
+  for i = 7, 6 + links do
+    redis.call('ZADD', KEYS[1], ARGV[1], ARGV[i])
+  end
+  redis.call('EXPIRE', KEYS[1], ARGV[4])
+  local cutoff = tonumber(ARGV[1]) - tonumber(ARGV[5])
+  for _, old in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', cutoff)) do
+    redis.call('HDEL', KEYS[3], old)
+  end
+  redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', cutoff)
+  for i = 7 + links, #ARGV do
+    redis.call('ZADD', KEYS[2], ARGV[1], ARGV[i])
+    redis.call('HSET', KEYS[3], ARGV[i], ARGV[6])
+  end
+  redis.call('EXPIRE', KEYS[2], ARGV[5])
+  redis.call('EXPIRE', KEYS[3], ARGV[5])
+  allowed = 1
+end
+if #KEYS > 3 then
+  redis.call('SET', KEYS[4], allowed .. ':' .. current, 'EX', ARGV[4])
+end
+return {allowed, current}
+"""
+
+# Repost lookup in one round trip.
+# KEYS[1], KEYS[2]: the chat's shared posts and posters, as written by RESERVE_SCRIPT
+# ARGV: since, canonical ids...
+# Returns a flat list of canonical id, post time, user id for each post shared after since
+FIND_POSTS_SCRIPT = """
+local found = {}
+for i = 2, #ARGV do
+  local score = redis.call('ZSCORE', KEYS[1], ARGV[i])
+  if score and tonumber(score) > tonumber(ARGV[1]) then
+    table.insert(found, ARGV[i])
+    table.insert(found, score)
+    table.insert(found, redis.call('HGET', KEYS[2], ARGV[i]) or '0')
+  end
+end
+return found
+"""
+
+
+class RedisBackend(StateBackend):
+    """Link state shared through Redis (or any server speaking its protocol).
+
+    Each user's window is a sorted set of links scored by post time; the
+    check and the insert run as one Lua script, so workers racing on the
+    same user can never both fit under the limit. Keys carry the chat id
+    as a hash tag, which keeps a chat's keys on one Redis cluster node.
+    Keys expire one window after their last write, so there is nothing to
+    prune.
+
+    The same script records each link's post in a per-chat sorted set kept
+    for post_window seconds (default: one window), which answers repost
+    checks. Listing every chat's posts would need a key scan, so
+    recent_posts() is not supported and the caller asks find_posts().
+
+    client is any redis.asyncio-compatible client, e.g. an in-process fake
+    for tests; without one, a client for url is created, which requires
+    the redis package.
+    """
+
+    def __init__(self, client: Any = None, url: str = 'redis://localhost:6379/0',
+                 prefix: str = 'xgate', window: int = LINK_WINDOW_SECONDS,
+                 post_window: Optional[int] = None):
+        """Connect lazily; no request is made until the first call."""
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError:
+                raise RuntimeError("The redis state backend needs the redis package (pip install redis)") from None
+            client = redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.window = window
+        self.post_window = max(window, post_window or 0)
+        self._reserve = client.register_script(RESERVE_SCRIPT)
+        self._find_posts = client.register_script(FIND_POSTS_SCRIPT)
+
+    def _links_key(self, chat_id: int, user_id: int) -> str:
+        return f"{self.prefix}:{{{chat_id}}}:links:{user_id}"
+
+    def _message_key(self, chat_id: int, message_id: int) -> str:
+        return f"{self.prefix}:{{{chat_id}}}:msg:{message_id}"
+
+    def _post_keys(self, chat_id: int) -> List[str]:
+        return [f"{self.prefix}:{{{chat_id}}}:posts", f"{self.prefix}:{{{chat_id}}}:posters"]
+
+    async def _run_reserve(self, user_id: int, link_urls: List[str], chat_id: int,
+                           max_links: int, message_id: Optional[int]) -> Tuple[bool, int]:
+        """Run the reservation script for one message."""
+        keys = [self._links_key(chat_id, user_id), *self._post_keys(chat_id)]
+        if message_id is not None:
+            keys.append(self._message_key(chat_id, message_id))
+            # Deterministic members, so even a replayed ZADD cannot add a link twice
+            token = str(message_id)
+        else:
+            token = secrets.token_hex(8)
+
+        now = time.time()
+        members = [f"{token}:{index}" for index in range(len(link_urls))]
+        canonical_ids = [canonical_link(link_url) for link_url in link_urls]
+        allowed, current = await self._reserve(
+            keys=keys,
+            args=[now, now - self.window, max_links, self.window, self.post_window, user_id,
+                  *members, *canonical_ids]
+        )
+        return bool(int(allowed)), int(current)
+
+    async def add_links(self, user_id: int, link_urls: List[str], chat_id: int,
+                        message_id: Optional[int] = None):
+        """Record links posted by a user without checking the quota."""
+        await self._run_reserve(user_id, link_urls, chat_id, -1, message_id)
+
+    async def count_links(self, user_id: int, chat_id: int) -> int:
+        """Count a user's links in the current window."""
+        return int(await self.client.zcount(
+            self._links_key(chat_id, user_id), f"({time.time() - self.window}", '+inf'
+        ))
+
+    async def reserve_links(self, user_id: int, link_urls: List[str], chat_id: int,
+                            max_links: int, message_id: Optional[int] = None) -> Tuple[bool, int]:
+        """Atomically check the quota and record links if they fit; returns (allowed, count_before)."""
+        return await self._run_reserve(user_id, link_urls, chat_id, max_links, message_id)
+
+    async def cleanup(self) -> int:
+        """Nothing to do: windows are trimmed on write and keys expire on their own."""
+        return 0
+
+    async def find_posts(self, chat_id: int, canonical_ids: Iterable[str],
+                         since: float) -> Dict[str, Tuple[int, int]]:
+        """Look up posts in the chat's sorted set with one script call."""
+        canonical_ids = list(canonical_ids)
+        if not canonical_ids:
+            return {}
+        found = await self._find_posts(keys=self._post_keys(chat_id), args=[since, *canonical_ids])
+        found = [value.decode() if isinstance(value, bytes) else value for value in found]
+        return {
+            found[i]: (int(float(found[i + 1])), int(found[i + 2]))
+            for i in range(0, len(found), 3)
+        }
+
+    async def close(self):
+        """Close the client's connections."""
+        close = getattr(self.client, 'aclose', None) or getattr(self.client, 'close', None)
+        if close is not None:
+            await close()
+
+
+class ShardSpec:
+    """Which chats a worker owns when several workers share the load.
+
+    A chat belongs to shard chat_id % count, so each chat is always handled
+    by the same worker and its messages stay in order.
+    """
+
+    def __init__(self, count: int = 1, index: int = 0):
+        """Describe shard index out of count."""
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f"invalid shard {index} of {count}")
+        self.count = count
+        self.index = index
+
+    def owns(self, chat_id: int) -> bool:
+        """Check whether this worker handles a chat."""
+        return self.count == 1 or chat_id % self.count == self.index
@@ -0,0 +1,24 @@
+"""Shared fixtures for the X-Gate test suite."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# Config refuses to load without a token; tests never reach Telegram
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:TEST')
+
+from config import Config  # noqa: E402
+
+
+def write_config(path, text: str) -> Config:
+    """Write config.yml text (bot token included) and load it."""
+    path.write_text('telegram:\n  bot_token: "123456:TEST"\n' + text)
+    return Config(str(path))
+
+
+@pytest.fixture
+def config(tmp_path) -> Config:
+    """Default settings, as used when no config.yml exists."""
+    return Config(str(tmp_path / 'missing.yml'))
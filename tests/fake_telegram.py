@@ -0,0 +1,98 @@
+"""
+Local fake Telegram Bot API endpoint for tests.
+Serves the handful of methods the bot calls at startup over real HTTP, so
+an Application pointed at it with base_url runs unmodified.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import parse_qsl
+
+BOT_ID = 424242
+
+
+class FakeBotAPI:
+    """Records every call (method name and decoded parameters) and answers getUpdates from a queue."""
+
+    def __init__(self):
+        self.calls: List[tuple] = []
+        self.updates: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/bot"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def params(self, method: str) -> List[Dict[str, Any]]:
+        """Parameters of every call to method so far."""
+        with self._lock:
+            return [params for name, params in self.calls if name == method]
+
+    def wait_for(self, method: str, timeout: float = 5.0) -> Dict[str, Any]:
+        """Block until method has been called; returns the latest call's parameters."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            calls = self.params(method)
+            if calls:
+                return calls[-1]
+            time.sleep(0.01)
+        raise AssertionError(f"{method} was never called")
+
+    def _answer(self, method: str, params: Dict[str, Any]):
+        with self._lock:
+            self.calls.append((method, params))
+            if method == 'getUpdates':
+                offset = int(params.get('offset') or 0)
+                pending = [update for update in self.updates if update['update_id'] >= offset]
+                self.updates = pending
+        if method == 'getMe':
+            return {'id': BOT_ID, 'is_bot': True, 'first_name': 'X-Gate', 'username': 'xgate_test_bot'}
+        if method == 'getUpdates':
+            if not pending:
+                # Long poll, briefly
+                time.sleep(0.05)
+            return pending
+        if method == 'getWebhookInfo':
+            return {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        return True
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                method = self.path.rsplit('/', 1)[-1]
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    params = json.loads(body or '{}')
+                else:
+                    params = {}
+                    for name, value in parse_qsl(body):
+                        try:
+                            params[name] = json.loads(value)
+                        except ValueError:
+                            params[name] = value
+                payload = json.dumps({'ok': True, 'result': fake._answer(method, params)}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
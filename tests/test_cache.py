@@ -0,0 +1,111 @@
+"""Tests for the chat metadata cache's single lookup per chat."""
+
+import asyncio
+
+import pytest
+
+from cache import ChatMetadataCache
+
+
+class Lookups:
+    """Counts fetches; each one waits until released."""
+
+    def __init__(self, result=None, error=None):
+        self.calls = 0
+        self.result = result
+        self.error = error
+        self.release = asyncio.Event()
+
+    async def fetch(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_concurrent_misses_share_one_lookup():
+    async def scenario():
+        cache = ChatMetadataCache()
+        lookups = Lookups(result='member')
+        waiters = [asyncio.ensure_future(cache.load_bot_member(-100, lookups.fetch)) for _ in range(20)]
+        other = asyncio.ensure_future(cache.load_bot_member(-200, lookups.fetch))
+        await asyncio.sleep(0)
+        lookups.release.set()
+        results = await asyncio.gather(*waiters, other)
+        return cache, lookups, results
+
+    cache, lookups, results = asyncio.run(scenario())
+    assert lookups.calls == 2
+    assert results == ['member'] * 21
+    assert cache.get_bot_member(-100) == 'member'
+    assert cache.stats()['joined'] == 19
+
+
+def test_admin_ids_are_stored_as_a_frozenset():
+    async def scenario():
+        cache = ChatMetadataCache()
+        lookups = Lookups(result=[1, 2, 2])
+        lookups.release.set()
+        return cache, await cache.load_admin_ids(-100, lookups.fetch)
+
+    cache, admin_ids = asyncio.run(scenario())
+    assert admin_ids == frozenset({1, 2})
+    assert cache.get_admin_ids(-100) == admin_ids
+
+
+def test_failed_lookup_reaches_every_waiter_and_is_not_cached():
+    async def scenario():
+        cache = ChatMetadataCache()
+        lookups = Lookups(error=RuntimeError('flood'))
+        waiters = [asyncio.ensure_future(cache.load_admin_ids(-100, lookups.fetch)) for _ in range(3)]
+        await asyncio.sleep(0)
+        lookups.release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+
+        retry = Lookups(result=[5])
+        retry.release.set()
+        return cache, results, await cache.load_admin_ids(-100, retry.fetch)
+
+    cache, results, retried = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert retried == frozenset({5})
+
+
+def test_cancelled_waiter_does_not_cancel_the_lookup():
+    async def scenario():
+        cache = ChatMetadataCache()
+        lookups = Lookups(result='member')
+        impatient = asyncio.ensure_future(cache.load_bot_member(-100, lookups.fetch))
+        patient = asyncio.ensure_future(cache.load_bot_member(-100, lookups.fetch))
+        await asyncio.sleep(0)
+        impatient.cancel()
+        lookups.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await impatient
+        return await patient
+
+    assert asyncio.run(scenario()) == 'member'
+
+
+def test_invalidated_lookup_is_not_stored():
+    async def scenario():
+        cache = ChatMetadataCache()
+        stale = Lookups(result=[1])
+        first = asyncio.ensure_future(cache.load_admin_ids(-100, stale.fetch))
+        await asyncio.sleep(0)
+        # An admin change arrives while the roster is being fetched
+        cache.invalidate_admins(-100)
+        fresh = Lookups(result=[2])
+        second = asyncio.ensure_future(cache.load_admin_ids(-100, fresh.fetch))
+        await asyncio.sleep(0)
+        # The fresh roster lands first; the stale one must not overwrite it
+        fresh.release.set()
+        await second
+        stale.release.set()
+        await first
+        return cache, stale, fresh
+
+    cache, stale, fresh = asyncio.run(scenario())
+    assert stale.calls == fresh.calls == 1
+    assert cache.get_admin_ids(-100) == frozenset({2})
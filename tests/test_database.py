@@ -0,0 +1,46 @@
+"""Tests for database migrations and maintenance."""
+
+import os
+import sqlite3
+
+from database import Database
+
+
+def test_existing_databases_are_switched_to_incremental_vacuum(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    Database(path).close()
+    # Turn it back into a database from before auto_vacuum was set
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA auto_vacuum=NONE")
+    conn.execute("VACUUM")
+    conn.execute("DELETE FROM schema_migrations WHERE version = 8")
+    conn.commit()
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+    conn.close()
+
+    db = Database(path)
+    conn = db._get_connection()
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()[0] == 8
+
+    # Freed pages now actually leave the file
+    for user_id in range(2000):
+        db.add_link(user_id, 'https://x.com/a/status/' + 'x' * 200, -100)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("DELETE FROM link_history")
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    before = os.path.getsize(path)
+    cursor = conn.cursor()
+    db._run_maintenance(cursor, vacuum_pages=100000)
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    assert os.path.getsize(path) < before
+    db.close()
+
+
+def test_incremental_vacuum_migration_skips_new_databases(tmp_path, caplog):
+    with caplog.at_level('INFO'):
+        Database(str(tmp_path / 'bot.db')).close()
+    assert 'Rewriting the database' not in caplog.text
@@ -0,0 +1,98 @@
+"""Tests for export.py and /export: read-only database access and the Redis backend refusal."""
+
+import asyncio
+import gzip
+import hashlib
+import os
+import sqlite3
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import export
+from async_database import AsyncDatabase
+from database import Database
+from state import RedisBackend
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from fake_redis import FakeRedis  # noqa: E402
+
+
+def run_export(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['export.py', *args])
+    export.main()
+
+
+def digest(path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def test_export_reads_without_touching_the_database(tmp_path, monkeypatch):
+    path = tmp_path / 'bot.db'
+    db = Database(str(path))
+    db.add_link(7, 'https://x.com/a/status/1', -100)
+    db.add_link(8, 'https://x.com/b/status/2', -200)
+    db._get_connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db.close()
+    before = digest(path)
+
+    output = tmp_path / 'links.csv.gz'
+    run_export(monkeypatch, '--db', str(path), '--chat', '-100', '-o', str(output))
+
+    lines = gzip.decompress(output.read_bytes()).decode().splitlines()
+    assert lines[0].split(',') == list(export.EXPORT_FIELDS)
+    assert len(lines) == 2 and 'status/1' in lines[1]
+    assert digest(path) == before
+
+
+def test_export_does_not_migrate_an_old_database(tmp_path, monkeypatch):
+    path = tmp_path / 'old.db'
+    conn = sqlite3.connect(str(path))
+    conn.execute("""
+        CREATE TABLE link_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+            timestamp DATETIME NOT NULL, link_url TEXT NOT NULL, chat_id INTEGER NOT NULL
+        )
+    """)
+    conn.commit()
+    conn.close()
+    before = digest(path)
+
+    with pytest.raises(SystemExit, match='schema up to date'):
+        run_export(monkeypatch, '--db', str(path), '-o', str(tmp_path / 'links.csv.gz'))
+    assert digest(path) == before
+
+
+def test_read_only_database_refuses_writes(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    Database(path).close()
+    with pytest.raises(sqlite3.OperationalError):
+        Database(path, read_only=True).add_link(7, 'https://x.com/a/status/1', -100)
+
+
+def test_export_command_refuses_under_the_redis_backend(config, tmp_path):
+    from bot import XLinkModerator
+
+    async def scenario():
+        async_db = AsyncDatabase(Database(str(tmp_path / 'bot.db')))
+        async_db.start()
+        moderator = XLinkModerator(config, async_db, state=RedisBackend(FakeRedis()))
+        replies = []
+
+        async def is_admin(message):
+            return True
+
+        moderator.is_chat_admin = is_admin
+        moderator.reply = lambda message, text, **kwargs: replies.append(text)
+        message = SimpleNamespace(chat=SimpleNamespace(type='supergroup', id=-100), chat_id=-100,
+                                  reply_to_message=None)
+        try:
+            await moderator.export_command(SimpleNamespace(message=message), SimpleNamespace(args=[]))
+        finally:
+            await async_db.close()
+        return replies
+
+    replies = asyncio.run(scenario())
+    assert len(replies) == 1 and 'Redis' in replies[0]
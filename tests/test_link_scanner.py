@@ -0,0 +1,141 @@
+"""LinkScanner: parity with the regexes it replaced, adversarial inputs, canonical ids."""
+
+import random
+import re
+import time
+
+import pytest
+from telegram import MessageEntity
+
+from link_scanner import URL_PATTERN, LinkScanner, canonical_link
+
+# The extraction LinkScanner replaced (its context stripping now ignores scheme case)
+LEGACY_REGEX = re.compile('|'.join(
+    rf'https?://(?:www\.)?{re.escape(host)}/\S+(?<![.,?!:;])'
+    for host in ('x.com', 'twitter.com', 'vxtwitter.com', 'fxtwitter.com', 'fixupx.com')
+), re.IGNORECASE)
+
+
+def reference_scan(text):
+    links = LEGACY_REGEX.findall(text)
+    if not links:
+        return [], 0
+    return links, len(' '.join(URL_PATTERN.sub('', text).split()))
+
+
+PARITY_CORPUS = [
+    "",
+    "no links here at all",
+    "Interesting thread, worth a read: https://x.com/someone/status/1234567890",
+    "https://x.com/a/status/1",
+    "see https://x.com/a/status/1. and https://twitter.com/b/status/2?s=20, ok?",
+    "https://www.twitter.com/a https://vxtwitter.com/b https://fxtwitter.com/c https://fixupx.com/d",
+    "Docs at https://example.com/docs and https://github.com/org/repo, no X links",
+    "redirect https://t.example/?u=https://fxtwitter.com/a/status/1.",
+    "https://x.com/a/status/1https://x.com/b/status/2",
+    "Look HTTPS://X.com/a/status/1 and Http://www.TWITTER.com/b and ftp://x.com/c plus xhttps://x.com/d.",
+    "ftp://https://x.com/a/status/1",
+    "http:// x.com/a https://x.com",
+    "https://x.com/",
+    "https://x.com/.",
+    "https://x.co/1 https://x.com.evil/2 https://notx.com/3 https://x.com/4",
+    "émoji 🚀 https://x.com/ü/status/1 ünïcödé context",
+    "httpſ://x.com/a/status/1 hTtPs://x.com/b/status/2",
+    "tabs\thttps://x.com/a\tand\nnewlines\nhttps://example.com/b\n",
+    ":// :// https:// https://x.com/a :// ftp:// http://example.com",
+]
+
+
+def random_corpus(count=500, seed=7):
+    """Messages stitched together from URL-ish fragments."""
+    rng = random.Random(seed)
+    fragments = [
+        'https://', 'http://', 'HTTPS://', 'ftp://', '://', 'x.com/', 'www.', 'twitter.com/', 'fixupx.com',
+        'example.com/', 'a', 'status/', '123', '.', ',', '?s=20', ' ', ' ', '  ', '\n', 'word', 'ı', 'ſ',
+    ]
+    return [''.join(rng.choice(fragments) for _ in range(rng.randrange(1, 40))) for _ in range(count)]
+
+
+@pytest.fixture(scope='module')
+def scanner():
+    return LinkScanner()
+
+
+@pytest.mark.parametrize('text', PARITY_CORPUS)
+def test_matches_reference_on_corpus(scanner, text):
+    result = scanner.scan(text)
+    assert (result.links, result.context_length) == reference_scan(text)
+
+
+def test_matches_reference_on_random_messages(scanner):
+    for text in random_corpus():
+        result = scanner.scan(text)
+        assert (result.links, result.context_length) == reference_scan(text), text
+
+
+def test_both_scan_paths_agree(scanner):
+    for text in PARITY_CORPUS + random_corpus():
+        if '://' not in text:
+            continue
+        general = scanner._scan_any(text)
+        result = scanner.scan(text)
+        assert (general.links, general.context_length) == (result.links, result.context_length), text
+
+
+ADVERSARIAL = {
+    'long_token': 'a' * 1_000_000,
+    'long_url': 'https://x.com/' + 'a' * 1_000_000,
+    'long_other_url': 'https://example.com/' + 'a' * 1_000_000,
+    'long_punctuation': 'https://x.com/' + '.' * 500_000,
+    'scheme_storm': 'http://' * 200_000,
+    'upper_scheme_storm': 'HTTP://' * 200_000,
+    'almost_x': ' '.join('https://x.co/' + str(i) for i in range(50_000)),
+    'nested_storm': 'https://example.com/?u=' * 50_000 + 'https://x.com/a/status/1',
+    'colons': ':' * 500_000 + '//',
+}
+
+
+@pytest.mark.parametrize('name', sorted(ADVERSARIAL))
+def test_adversarial_inputs_scan_in_linear_time(scanner, name):
+    text = ADVERSARIAL[name]
+    started = time.perf_counter()
+    result = scanner.scan(text)
+    elapsed = time.perf_counter() - started
+    assert (result.links, result.context_length) == reference_scan(text)
+    # Linear scans of these take milliseconds; backtracking blowups take minutes
+    assert elapsed < 2.0, f"{name} took {elapsed:.2f}s"
+
+
+def test_canonical_ids_are_computed_on_demand(scanner):
+    result = scanner.scan("a https://x.com/a/status/1?s=20 b https://fxtwitter.com/b/status/1 https://x.com/home")
+    assert result._canonical_ids is None
+    assert result.canonical_ids == ('status:1', 'status:1', 'path:/home')
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('https://x.com/a/status/1', 'status:1'),
+    ('https://twitter.com/B/Status/1?s=20', 'status:1'),
+    ('https://fxtwitter.com/a/status/1/photo/1', 'status:1'),
+    ('https://x.com/i/web/status/9#frag', 'status:9'),
+    ('https://x.com/i/status/5', 'status:5'),
+    ('https://x.com/a/statuses/7', 'status:7'),
+    ('x.com/a/status/3', 'status:3'),
+    ('https://x.com/a?x/status/3', 'path:/a'),
+    ('https://x.com/Some/Path/', 'path:/some/path'),
+    ('https://x.com', 'path:/'),
+    ('https://x.com/a/status/', 'path:/a/status'),
+])
+def test_canonical_link(url, expected):
+    assert canonical_link(url) == expected
+
+
+def test_entities_use_utf16_offsets_and_keep_hidden_link_text(scanner):
+    text = "🚀 launch notes https://x.com/a/status/1 and more"
+    start = len("🚀 launch notes ".encode('utf-16-le')) // 2
+    entities = [
+        MessageEntity(MessageEntity.URL, start, len("https://x.com/a/status/1")),
+        MessageEntity(MessageEntity.TEXT_LINK, 0, 2, url='https://twitter.com/b/status/2'),
+    ]
+    result = scanner.scan_entities(text, entities)
+    assert result.links == ['https://x.com/a/status/1', 'https://twitter.com/b/status/2']
+    assert result.context_length == len("🚀 launch notes and more")
@@ -0,0 +1,173 @@
+"""Tests for the outbound scheduler against a fake Bot that records calls and can answer 429."""
+
+import asyncio
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+from outbound import OutboundScheduler, Priority
+
+
+class FakeBot:
+    """Records each call with its time; chats in flood_chats answer the first call with RetryAfter."""
+
+    def __init__(self, retry_after: float = 0.3):
+        self.retry_after = retry_after
+        self.calls = []
+        self.flood_chats = set()
+        self.flood_global = False
+
+    async def call(self, method: str, chat_id=None):
+        await asyncio.sleep(0)
+        if chat_id in self.flood_chats:
+            self.flood_chats.discard(chat_id)
+            raise RetryAfter(self.retry_after)
+        if method == 'get_me' and self.flood_global:
+            self.flood_global = False
+            raise RetryAfter(self.retry_after)
+        self.calls.append((method, chat_id, time.monotonic()))
+        return method
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_queued_calls_dispatch_in_priority_order():
+    async def scenario():
+        bot = FakeBot()
+        outbound = OutboundScheduler(max_in_flight=1)
+        futures = [
+            outbound.submit(Priority.CLEANUP, lambda: bot.call('cleanup', 1), chat_id=1, send=False),
+            outbound.submit(Priority.WARNING, lambda: bot.call('warning', 2), chat_id=2),
+            outbound.submit(Priority.DELETE, lambda: bot.call('delete', 3), chat_id=3, send=False),
+            outbound.submit(Priority.WARNING, lambda: bot.call('reply', 4), chat_id=4),
+        ]
+        outbound.start()
+        await asyncio.gather(*futures)
+        await outbound.stop()
+        return [method for method, _, _ in bot.calls]
+
+    assert run(scenario()) == ['delete', 'warning', 'reply', 'cleanup']
+
+
+def test_sends_are_paced_per_chat_without_holding_up_other_chats():
+    async def scenario():
+        bot = FakeBot()
+        # Bursts of 2 per chat, then one message every 0.2s
+        outbound = OutboundScheduler(chat_rate_per_minute=2)
+        outbound.chat_rate = 5
+        outbound.start()
+        busy = [outbound.submit(Priority.WARNING, lambda: bot.call('send', 1), chat_id=1) for _ in range(3)]
+        other = outbound.submit(Priority.WARNING, lambda: bot.call('send', 2), chat_id=2)
+        await other
+        assert [chat for _, chat, _ in bot.calls].count(1) == 2
+        await asyncio.gather(*busy)
+        await outbound.stop()
+        return bot.calls
+
+    calls = run(scenario())
+    busy_times = [at for _, chat, at in calls if chat == 1]
+    other_time = next(at for _, chat, at in calls if chat == 2)
+    assert busy_times[2] - busy_times[0] >= 0.15
+    assert other_time < busy_times[2]
+
+
+def test_deletes_do_not_spend_send_tokens():
+    async def scenario():
+        bot = FakeBot()
+        outbound = OutboundScheduler(chat_rate_per_minute=1)
+        outbound.start()
+        await outbound.submit(Priority.WARNING, lambda: bot.call('send', 1), chat_id=1)
+        start = time.monotonic()
+        await asyncio.gather(*(
+            outbound.submit(Priority.DELETE, lambda: bot.call('delete', 1), chat_id=1, send=False)
+            for _ in range(5)
+        ))
+        elapsed = time.monotonic() - start
+        await outbound.stop()
+        return elapsed
+
+    assert run(scenario()) < 0.1
+
+
+def test_retry_after_on_a_delete_pauses_only_that_chat():
+    async def scenario():
+        bot = FakeBot(retry_after=0.3)
+        bot.flood_chats.add(1)
+        outbound = OutboundScheduler()
+        outbound.start()
+        start = time.monotonic()
+        flooded = outbound.submit(Priority.DELETE, lambda: bot.call('delete', 1), chat_id=1, send=False)
+        await asyncio.sleep(0.05)
+        others = [
+            outbound.submit(Priority.DELETE, lambda: bot.call('delete', 2), chat_id=2, send=False),
+            outbound.submit(Priority.WARNING, lambda: bot.call('send', 3), chat_id=3),
+        ]
+        await asyncio.gather(*others)
+        others_done = time.monotonic() - start
+        assert await flooded == 'delete'
+        flooded_done = time.monotonic() - start
+        await outbound.stop()
+        return outbound, others_done, flooded_done
+
+    outbound, others_done, flooded_done = run(scenario())
+    assert outbound.retries == 1
+    assert others_done < 0.2
+    assert flooded_done >= 0.3
+
+
+def test_retry_after_without_a_chat_pauses_everything():
+    async def scenario():
+        bot = FakeBot(retry_after=0.3)
+        bot.flood_global = True
+        outbound = OutboundScheduler()
+        outbound.start()
+        start = time.monotonic()
+        lookup = outbound.submit(Priority.DELETE, lambda: bot.call('get_me'))
+        await asyncio.sleep(0.05)
+        send = outbound.submit(Priority.WARNING, lambda: bot.call('send', 2), chat_id=2)
+        await send
+        send_done = time.monotonic() - start
+        await lookup
+        await outbound.stop()
+        return outbound, send_done
+
+    outbound, send_done = run(scenario())
+    assert outbound.retries == 1
+    assert send_done >= 0.3
+
+
+def test_retry_after_gives_up_after_max_retries():
+    async def scenario():
+        outbound = OutboundScheduler(max_retries=1)
+        outbound.start()
+
+        async def always_flooded():
+            raise RetryAfter(0.01)
+
+        future = outbound.submit(Priority.DELETE, always_flooded, chat_id=1, send=False)
+        with pytest.raises(RetryAfter):
+            await future
+        await outbound.stop()
+        return outbound
+
+    assert run(scenario()).retries == 1
+
+
+def test_calls_past_max_delay_are_dropped():
+    async def scenario():
+        bot = FakeBot()
+        outbound = OutboundScheduler(chat_rate_per_minute=1)
+        outbound.start()
+        await outbound.submit(Priority.WARNING, lambda: bot.call('send', 1), chat_id=1)
+        late = outbound.submit(Priority.WARNING, lambda: bot.call('send', 1), chat_id=1, max_delay=0.05)
+        with pytest.raises(asyncio.CancelledError):
+            await late
+        await outbound.stop()
+        return outbound, bot
+
+    outbound, bot = run(scenario())
+    assert outbound.dropped == 1
+    assert len(bot.calls) == 1
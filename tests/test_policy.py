@@ -0,0 +1,119 @@
+"""Rule validation, compiled chat policies and hot config reload."""
+
+import asyncio
+import os
+
+import pytest
+
+from conftest import write_config
+from policy import ChatPolicy, ConfigWatcher, PolicyEngine, decide, parse_rule
+
+
+def rules_yaml(**rules) -> str:
+    return 'rules:\n' + ''.join(f'  {name}: {value}\n' for name, value in rules.items())
+
+
+def rewrite(path, text: str, mtime_ns: int):
+    """Replace the config file and give it a distinct modification time."""
+    path.write_text('telegram:\n  bot_token: "123456:TEST"\n' + text)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.mark.parametrize('rules', [
+    {'max_links_per_week': 'three'},
+    {'max_links_per_week': -1},
+    {'min_context_length': '1.5'},
+    {'repost_window_hours': '[]'},
+    {'require_context': '"false"'},
+    {'count_per_link': 2},
+    {'repost': 'sometimes'},
+])
+def test_invalid_rule_values_are_rejected(tmp_path, rules):
+    with pytest.raises(ValueError):
+        write_config(tmp_path / 'config.yml', rules_yaml(**rules))
+
+
+@pytest.mark.parametrize('message', ['"{maximum} links"', '"{0} links"', '"{max"'])
+def test_invalid_message_templates_are_rejected(tmp_path, message):
+    with pytest.raises(ValueError):
+        write_config(tmp_path / 'config.yml', f'messages:\n  rate_limit: {message}\n')
+
+
+def test_overrides_compile_into_per_chat_snapshots(config):
+    engine = PolicyEngine(config)
+    engine.set_overrides(-100, {'max_links_per_week': '5', 'repost': 'block'})
+    policy = engine.for_chat(-100)
+    assert (policy.max_links_per_week, policy.repost, policy.overridden) == (5, 'block', {'max_links_per_week', 'repost'})
+    assert engine.for_chat(-200) is engine.for_chat(-300)
+    assert engine.for_chat(-200).max_links_per_week == 3
+    engine.set_overrides(-100, {})
+    assert engine.for_chat(-100) is engine.for_chat(-200)
+
+
+def test_decide_applies_rules_in_moderation_order(config):
+    policy = ChatPolicy.compile(config, {'repost': 'block', 'count_per_link': 'off'})
+    assert decide(policy, 0, 1, 0, True) == 'no_context'
+    assert decide(policy, 50, 1, 0, True) == 'repost'
+    assert decide(policy, 50, 4, 2, False) is None
+    assert decide(policy, 50, 1, 3, False) == 'rate_limit'
+    with pytest.raises(ValueError):
+        parse_rule('max_links_per_week', 'three')
+
+
+def test_watcher_survives_bad_file_and_applies_next_good_one(tmp_path):
+    path = tmp_path / 'config.yml'
+    config = write_config(path, rules_yaml(max_links_per_week=3))
+    engine = PolicyEngine(config)
+
+    async def settle(watcher):
+        # A few polling rounds
+        await asyncio.sleep(0.2)
+        assert not watcher._task.done()
+
+    async def run():
+        watcher = ConfigWatcher(config, engine.reload, interval=0.01)
+        watcher.start()
+        try:
+            rewrite(path, rules_yaml(max_links_per_week='three'), 1_000_000_000)
+            await settle(watcher)
+            assert config.max_links_per_week == 3
+            assert engine.for_chat(1).max_links_per_week == 3
+
+            rewrite(path, rules_yaml(max_links_per_week=7), 2_000_000_000)
+            await settle(watcher)
+            assert config.max_links_per_week == 7
+            assert engine.for_chat(1).max_links_per_week == 7
+        finally:
+            await watcher.stop()
+    asyncio.run(run())
+
+
+def test_failed_reload_callback_restores_previous_config(tmp_path):
+    path = tmp_path / 'config.yml'
+    config = write_config(path, rules_yaml(max_links_per_week=3))
+    applied = []
+
+    def on_reload(new_config):
+        if not applied:
+            applied.append(None)
+            raise RuntimeError("compile failed")
+        applied.append(new_config.max_links_per_week)
+
+    watcher = ConfigWatcher(config, on_reload)
+    rewrite(path, rules_yaml(max_links_per_week=5), 1_000_000_000)
+    watcher.check()
+    assert config.max_links_per_week == 3
+    watcher.check()
+    assert applied == [None, 5]
+    assert config.max_links_per_week == 5
+
+
+def test_unreadable_yaml_keeps_previous_config(tmp_path):
+    path = tmp_path / 'config.yml'
+    config = write_config(path, rules_yaml(max_links_per_week=3))
+    watcher = ConfigWatcher(config, lambda new_config: None)
+    path.write_text('rules: [unclosed\n')
+    watcher.check()
+    path.write_text('')
+    watcher.check()
+    assert config.max_links_per_week == 3
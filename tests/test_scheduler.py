@@ -0,0 +1,80 @@
+"""Tests for the deletion scheduler's handling of failed and cancelled deletes."""
+
+import asyncio
+
+from telegram.error import BadRequest
+
+from scheduler import DeletionScheduler
+
+
+class FakeDatabase:
+    """Pending deletions kept in a set, like the pending_deletions table."""
+
+    def __init__(self):
+        self.rows = set()
+
+    async def get_pending_deletions(self):
+        return []
+
+    async def add_pending_deletion(self, chat_id, message_id, due_at):
+        self.rows.add((chat_id, message_id))
+
+    async def remove_pending_deletions(self, messages):
+        self.rows.difference_update(messages)
+
+
+class FakeBot:
+    """delete_message answers per message id: 1 deletes, 2 is a Telegram error, 3 crashes, 4 is cancelled."""
+
+    def __init__(self):
+        self.deleted = []
+
+    async def delete_message(self, chat_id, message_id):
+        if message_id == 2:
+            raise BadRequest("Message to delete not found")
+        if message_id == 3:
+            raise RuntimeError("connection reset")
+        if message_id == 4:
+            raise asyncio.CancelledError()
+        self.deleted.append(message_id)
+        return True
+
+
+def test_unexpected_failures_are_retried_and_finished_rows_removed():
+    async def scenario():
+        db = FakeDatabase()
+        scheduler = DeletionScheduler(db)
+        await scheduler.start(FakeBot())
+        for message_id in (1, 2, 3, 4):
+            scheduler.schedule(-100, message_id, 0)
+        await asyncio.sleep(0.1)
+        # The timer task survived the cancelled delete
+        alive = not scheduler._task.done()
+        await scheduler.stop()
+        return db, scheduler, alive
+
+    db, scheduler, alive = asyncio.run(scenario())
+    assert alive
+    assert db.rows == {(-100, 3), (-100, 4)}
+    assert sorted(message_id for _, _, message_id in scheduler._heap) == [3, 4]
+
+
+def test_retried_deletes_run_again_after_the_delay():
+    async def scenario():
+        db = FakeDatabase()
+        bot = FakeBot()
+        scheduler = DeletionScheduler(db)
+        scheduler.RETRY_DELAY = 0.05
+        await scheduler.start(bot)
+        scheduler.schedule(-100, 3, 0)
+        await asyncio.sleep(0.02)
+        first_attempt = list(scheduler._heap)
+        bot.delete_message = lambda chat_id, message_id: asyncio.sleep(0, result=True)
+        await asyncio.sleep(0.15)
+        await scheduler.stop()
+        return db, scheduler, first_attempt
+
+    db, scheduler, first_attempt = asyncio.run(scenario())
+    assert len(first_attempt) == 1
+    assert scheduler.pending == 0
+    assert db.rows == set()
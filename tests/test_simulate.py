@@ -0,0 +1,92 @@
+"""Tests for the update recorder and the offline simulator's parity with the bot."""
+
+import asyncio
+import random
+
+import pytest
+
+import database
+from database import Database
+from recorder import MAGIC, UpdateRecorder, encode_message, post_hash, read_log
+from simulate import Simulation, build_engine
+
+
+def write_log(path, messages):
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        for message in messages:
+            f.write(encode_message(*message))
+
+
+def engine(config, **rules):
+    return build_engine(config, rules, {})
+
+
+def test_posts_are_recorded_in_link_order(tmp_path):
+    path = tmp_path / 'updates.xgr'
+    write_log(path, [(-100, 7, 1000, 3, 12, ['status:2', 'status:1', 'status:2'])])
+
+    [[message]] = list(read_log([str(path)]))
+    assert message == (-100, 7, 1000, 3, 12, tuple(map(post_hash, ['status:2', 'status:1', 'status:2'])))
+
+
+def test_only_counted_posts_are_marked_as_shared(config):
+    simulation = Simulation('test', engine(config, count_per_link=False, repost='block'))
+    first, second = post_hash('status:1'), post_hash('status:2')
+    simulation.feed([
+        (-100, 7, 1000, 2, 50, (first, second)),
+        # Only the first link counted, so the bot never recorded status:2
+        (-100, 8, 1100, 1, 50, (second,)),
+        (-100, 9, 1200, 1, 50, (first,)),
+    ])
+    assert simulation.outcomes['allowed'] == 2
+    assert simulation.outcomes['repost'] == 1
+
+
+def test_older_logs_are_refused_and_moved_aside(tmp_path):
+    path = tmp_path / 'updates.xgr'
+    path.write_bytes(b'XGR1')
+    with pytest.raises(ValueError, match='older version'):
+        list(read_log([str(path)]))
+
+    async def start_and_stop():
+        recorder = UpdateRecorder(str(path))
+        recorder.start()
+        await recorder.stop()
+
+    asyncio.run(start_and_stop())
+    assert (tmp_path / 'updates.xgr.old').read_bytes() == b'XGR1'
+    assert path.read_bytes() == MAGIC
+
+
+def test_gcra_simulation_matches_the_database(config, tmp_path, monkeypatch):
+    db = Database(str(tmp_path / 'bot.db'))
+    conn = db._get_connection()
+    rng = random.Random(5)
+    limits = {-100: 3, -200: 5}
+    simulations = {
+        chat_id: Simulation(str(chat_id), engine(config, max_links_per_week=limit, count_per_link=True),
+                            window=7 * 24 * 3600, limiter='gcra')
+        for chat_id, limit in limits.items()
+    }
+
+    timestamp = 1_700_000_000
+    expected, simulated = [], []
+    for _ in range(400):
+        timestamp += rng.choice([60, 3600, 20000, 86400])
+        chat_id = rng.choice(list(limits))
+        user_id = rng.choice([7, 8])
+        links = rng.choice([1, 1, 2])
+        monkeypatch.setattr(database.time, 'time', lambda: timestamp)
+        allowed, _ = db._reserve_rate(conn.cursor(), user_id, ['https://x.com/a/status/1'] * links,
+                                      chat_id, limits[chat_id])
+        conn.commit()
+        expected.append(allowed)
+
+        simulation = simulations[chat_id]
+        before = simulation.outcomes['allowed']
+        simulation.feed([(chat_id, user_id, timestamp, links, 50, ())])
+        simulated.append(simulation.outcomes['allowed'] > before)
+
+    assert simulated == expected
+    assert 0 < sum(expected) < len(expected)
@@ -0,0 +1,219 @@
+"""Tests for the link state backends, sharding and their config checks, using an in-process fake Redis."""
+
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+from async_database import AsyncDatabase
+from database import Database
+from maintenance import RetentionJob
+from state import GCRABackend, RedisBackend, ShardSpec, SQLiteBackend
+
+from conftest import write_config
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from fake_redis import FakeRedis  # noqa: E402
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_reservations_never_exceed_the_quota():
+    async def scenario():
+        redis = FakeRedis(latency=0.001)
+        # Two workers sharing one server
+        workers = [RedisBackend(redis), RedisBackend(redis)]
+        results = await asyncio.gather(*(
+            workers[i % 2].reserve_links(7, ['https://x.com/a/status/1'], -100, 3, message_id=i)
+            for i in range(20)
+        ))
+        return results, await workers[0].count_links(7, -100)
+
+    results, count = run(scenario())
+    assert sum(allowed for allowed, _ in results) == 3
+    assert count == 3
+
+
+def test_redelivered_message_returns_the_first_decision():
+    async def scenario():
+        backend = RedisBackend(FakeRedis())
+        links = ['https://x.com/a/status/1', 'https://x.com/a/status/2']
+        first = await backend.reserve_links(7, links, -100, 3, message_id=50)
+        again = await backend.reserve_links(7, links, -100, 3, message_id=50)
+        return first, again, await backend.count_links(7, -100)
+
+    first, again, count = run(scenario())
+    assert first == again == (True, 0)
+    assert count == 2
+
+
+def test_add_links_ignores_the_quota_and_counts_per_chat_and_user():
+    async def scenario():
+        backend = RedisBackend(FakeRedis())
+        await backend.add_links(7, ['a', 'b', 'c', 'd'], -100)
+        allowed, current = await backend.reserve_links(7, ['e'], -100, 3)
+        return allowed, current, await backend.count_links(7, -200), await backend.count_links(8, -100)
+
+    assert run(scenario()) == (False, 4, 0, 0)
+
+
+def test_keys_are_tagged_by_chat():
+    async def scenario():
+        redis = FakeRedis()
+        backend = RedisBackend(redis, prefix='test')
+        await backend.reserve_links(7, ['a'], -100, 3, message_id=1)
+        return redis
+
+    redis = run(scenario())
+    assert set(redis._zsets) == {'test:{-100}:links:7', 'test:{-100}:posts'}
+    assert set(redis._hashes) == {'test:{-100}:posters'}
+    assert set(redis._strings) == {'test:{-100}:msg:1'}
+
+
+def test_redis_cleanup_has_nothing_to_do():
+    assert run(RedisBackend(FakeRedis()).cleanup()) == 0
+
+
+def test_redis_backend_without_client_needs_the_package():
+    try:
+        import redis  # noqa: F401
+    except ImportError:
+        with pytest.raises(RuntimeError, match='pip install redis'):
+            RedisBackend()
+    else:
+        pytest.skip('redis is installed')
+
+
+@pytest.mark.parametrize('backend_class', [SQLiteBackend, GCRABackend])
+def test_retention_job_runs_the_backend_cleanup(tmp_path, backend_class):
+    async def scenario():
+        db = Database(str(tmp_path / 'bot.db'))
+        async_db = AsyncDatabase(db)
+        async_db.start()
+        backend = backend_class(async_db)
+        try:
+            allowed, _ = await backend.reserve_links(7, ['https://x.com/a/status/1'], -100, 3)
+            assert allowed
+            # Drain the user's state as if a week had passed
+            db._get_connection().execute("UPDATE rate_limit_state SET tat = 0")
+            db._get_connection().commit()
+            await RetentionJob(async_db, state=backend).prune()
+            return db._get_connection().execute("SELECT COUNT(*) FROM rate_limit_state").fetchone()[0]
+        finally:
+            await async_db.close()
+
+    assert run(scenario()) == 0
+
+
+def test_shard_spec_splits_chats_by_id():
+    shards = [ShardSpec(3, index) for index in range(3)]
+    for chat_id in (-1001, -1002, -1003, 5, 6):
+        assert sum(shard.owns(chat_id) for shard in shards) == 1
+    assert ShardSpec().owns(12345)
+    with pytest.raises(ValueError):
+        ShardSpec(2, 2)
+
+
+def test_sharding_requires_webhook_mode(tmp_path):
+    path = tmp_path / 'config.yml'
+    with pytest.raises(ValueError, match='webhook'):
+        write_config(path, "state:\n  shard_count: 2\n  shard_index: 1\n")
+
+    config = write_config(path, (
+        "state:\n  shard_count: 2\n  shard_index: 1\n"
+        "webhook:\n  enabled: true\n  url: https://example.com\n"
+    ))
+    assert config.shard_count == 2
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    db = Database(str(tmp_path / 'bot.db'))
+    return AsyncDatabase(db)
+
+
+@pytest.mark.parametrize('backend_name', ['sqlite', 'gcra', 'redis'])
+def test_recorded_links_are_found_as_posts(sqlite_db, backend_name):
+    async def scenario():
+        sqlite_db.start()
+        backend = {
+            'sqlite': lambda: SQLiteBackend(sqlite_db),
+            'gcra': lambda: GCRABackend(sqlite_db),
+            'redis': lambda: RedisBackend(FakeRedis()),
+        }[backend_name]()
+        try:
+            before = time.time() - 60
+            await backend.reserve_links(7, ['https://x.com/a/status/1'], -100, 3)
+            # Rejected links are not recorded
+            await backend.reserve_links(9, ['https://x.com/b/status/2'] * 4, -100, 3)
+            await backend.add_links(8, ['https://twitter.com/c/status/1?s=20', 'https://x.com/c'], -100)
+            found = await backend.find_posts(-100, ['status:1', 'status:2', 'path:/c', 'status:3'], before)
+            later = await backend.find_posts(-100, ['status:1'], time.time() + 60)
+            elsewhere = await backend.find_posts(-200, ['status:1'], before)
+            return found, later, elsewhere
+        finally:
+            await sqlite_db.close()
+
+    found, later, elsewhere = run(scenario())
+    assert set(found) == {'status:1', 'path:/c'}
+    # Both users shared status:1 within the same second, so either may be the latest
+    assert found['status:1'][1] in (7, 8)
+    assert found['path:/c'][1] == 8
+    assert later == elsewhere == {}
+
+
+def test_only_sqlite_backends_list_recent_posts(sqlite_db):
+    async def scenario():
+        sqlite_db.start()
+        try:
+            backend = SQLiteBackend(sqlite_db)
+            await backend.add_links(7, ['https://x.com/a/status/1'], -100)
+            return await backend.recent_posts(time.time() - 60), await RedisBackend(FakeRedis()).recent_posts(0)
+        finally:
+            await sqlite_db.close()
+
+    listed, unlisted = run(scenario())
+    assert [(chat_id, canonical_id, user_id) for chat_id, canonical_id, _, user_id in listed] == [(-100, 'status:1', 7)]
+    assert unlisted is None
+
+
+def test_redis_posts_expire_after_post_window():
+    async def scenario():
+        redis = FakeRedis()
+        backend = RedisBackend(redis, window=60, post_window=120)
+        await backend.add_links(7, ['https://x.com/a/status/1'], -100)
+        # Age the first post past the post window; the next write trims it
+        posts = redis._zsets['xgate:{-100}:posts']
+        posts['status:1'] -= 121
+        await backend.add_links(8, ['https://x.com/a/status/2'], -100)
+        return redis, await backend.find_posts(-100, ['status:1', 'status:2'], 0)
+
+    redis, found = run(scenario())
+    assert set(found) == {'status:2'}
+    assert set(redis._hashes['xgate:{-100}:posters']) == {'status:2'}
+
+
+def test_moderator_checks_reposts_in_the_redis_backend(config, sqlite_db):
+    from bot import XLinkModerator
+
+    config.config['rules']['repost'] = 'block'
+
+    async def scenario():
+        sqlite_db.start()
+        redis = FakeRedis()
+        moderator = XLinkModerator(config, sqlite_db, state=RedisBackend(redis))
+        try:
+            await moderator.load_repost_index()
+            # Shared through another worker, so only Redis knows about it
+            await RedisBackend(redis).reserve_links(8, ['https://x.com/a/status/1'], -100, 3)
+            return await moderator.find_repost(-100, ['status:1', 'status:2'], 3600)
+        finally:
+            await sqlite_db.close()
+
+    shared = run(scenario())
+    assert shared is not None and shared[1] == 8
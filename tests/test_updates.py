@@ -0,0 +1,173 @@
+"""Update intake: allowed_updates narrowing, shard filtering, polling and webhook against a fake Bot API."""
+
+import asyncio
+import socket
+from datetime import datetime, timezone
+
+import pytest
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+from async_database import AsyncDatabase
+from bot import XLinkModerator, add_handlers, allowed_updates_for
+from database import Database
+from fake_telegram import FakeBotAPI
+
+NARROW = sorted([Update.MESSAGE, Update.MY_CHAT_MEMBER, Update.CHAT_MEMBER])
+
+
+def build(config, tmp_path, base_url=None):
+    """Application and moderator wired the way main() does, without starting anything."""
+    moderator = XLinkModerator(config, AsyncDatabase(Database(str(tmp_path / 'bot.db'))))
+    builder = Application.builder().token(config.bot_token)
+    if base_url:
+        builder = builder.base_url(base_url)
+    return builder.build(), moderator
+
+
+def message_update(update_id: int, chat_id: int, text: str = 'hello there') -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(datetime.now(timezone.utc).timestamp()),
+            'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'test'},
+            'from': {'id': 7, 'is_bot': False, 'first_name': 'user'},
+            'text': text,
+        },
+    }
+
+
+@pytest.fixture
+def sharded(config):
+    config.config['state']['shard_count'] = 2
+    config.config['state']['shard_index'] = 1
+    config.config['webhook'].update(enabled=True, url='https://xgate.example.com')
+    return config
+
+
+def test_polling_is_the_default(config):
+    assert not config.webhook_enabled
+
+
+def test_allowed_updates_cover_only_registered_handlers(config, tmp_path):
+    application, moderator = build(config, tmp_path)
+    assert add_handlers(application, moderator, config) == NARROW
+
+
+def test_shard_filter_does_not_widen_allowed_updates(sharded, tmp_path):
+    application, moderator = build(sharded, tmp_path)
+    assert add_handlers(application, moderator, sharded) == NARROW
+    assert len(application.handlers[-1]) == 1
+
+
+def test_unrecognized_handler_keeps_all_update_types(config, tmp_path):
+    application, moderator = build(config, tmp_path)
+    add_handlers(application, moderator, config)
+    # Same callback as the shard filter, but not registered as one
+    application.add_handler(TypeHandler(Update, moderator.skip_other_shards), group=-1)
+    assert allowed_updates_for(application) == Update.ALL_TYPES
+
+
+def test_updates_from_other_shards_are_dropped(sharded, tmp_path):
+    api = FakeBotAPI().start()
+    application, moderator = build(sharded, tmp_path, api.base_url)
+    seen = []
+
+    async def handle_message(update, context):
+        seen.append(update.effective_chat.id)
+    moderator.handle_message = handle_message
+    add_handlers(application, moderator, sharded)
+
+    async def run():
+        await application.initialize()
+        try:
+            for update_id, chat_id in enumerate((-1001, -1002, -1003, -1004), 1):
+                await application.process_update(Update.de_json(message_update(update_id, chat_id), application.bot))
+        finally:
+            await application.shutdown()
+    try:
+        asyncio.run(run())
+    finally:
+        api.stop()
+    # Shard 1 of 2 owns chats with chat_id % 2 == 1
+    assert seen == [-1001, -1003]
+
+
+def test_polling_requests_only_allowed_updates(config, tmp_path):
+    api = FakeBotAPI().start()
+    try:
+        application, moderator = build(config, tmp_path, api.base_url)
+        seen = []
+
+        async def handle_message(update, context):
+            seen.append(update.message.text)
+        moderator.handle_message = handle_message
+        allowed_updates = add_handlers(application, moderator, config)
+        api.updates.append(message_update(1, -1001, 'first update'))
+
+        async def run():
+            async with application:
+                await application.start()
+                await application.updater.start_polling(allowed_updates=allowed_updates, poll_interval=0)
+                for _ in range(200):
+                    if seen:
+                        break
+                    await asyncio.sleep(0.01)
+                await application.updater.stop()
+                await application.stop()
+        asyncio.run(run())
+
+        assert seen == ['first update']
+        assert api.wait_for('getUpdates')['allowed_updates'] == NARROW
+    finally:
+        api.stop()
+
+
+def test_webhook_registers_secret_and_narrow_updates(sharded, tmp_path):
+    pytest.importorskip('tornado')
+    import httpx
+
+    api = FakeBotAPI().start()
+    try:
+        application, moderator = build(sharded, tmp_path, api.base_url)
+        seen = []
+
+        async def handle_message(update, context):
+            seen.append(update.effective_chat.id)
+        moderator.handle_message = handle_message
+        allowed_updates = add_handlers(application, moderator, sharded)
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+
+        async def run():
+            async with application:
+                await application.start()
+                await application.updater.start_webhook(
+                    listen='127.0.0.1', port=port, url_path='telegram',
+                    webhook_url='https://xgate.example.com/telegram',
+                    secret_token='s3cret', max_connections=7, allowed_updates=allowed_updates
+                )
+                url = f"http://127.0.0.1:{port}/telegram"
+                async with httpx.AsyncClient() as client:
+                    rejected = await client.post(url, json=message_update(1, -1001))
+                    accepted = await client.post(url, json=message_update(2, -1001),
+                                                 headers={'X-Telegram-Bot-Api-Secret-Token': 's3cret'})
+                for _ in range(200):
+                    if seen:
+                        break
+                    await asyncio.sleep(0.01)
+                await application.updater.stop()
+                await application.stop()
+                return rejected.status_code, accepted.status_code
+        rejected, accepted = asyncio.run(run())
+
+        assert (rejected, accepted) == (403, 200)
+        assert seen == [-1001]
+        registered = api.wait_for('setWebhook')
+        assert registered['secret_token'] == 's3cret'
+        assert registered['max_connections'] == 7
+        assert registered['allowed_updates'] == NARROW
+    finally:
+        api.stop()